@@ -1,16 +1,52 @@
+import itertools
 import networkx as nx
+import numpy as np
 import sys
+import instrumentation
+from paths import DEFAULT_K_PATHS, PathEngine
+from topology import snapshot_edges
 
+# ResourceLedger.evaluate checks candidate sets up to this size with a plain loop: below it the
+# array setup of the vectorized check costs more than the check itself (crossover ~8-16 paths)
+SMALL_EVALUATE_PATHS = 8
 
-def search_alternate_path(G, i, j):
-    return nx.all_shortest_paths(G, source=i, target=j)
 
+@instrumentation.timed("allocation.search_alternate_path")
+def search_alternate_path(G, i, j, k=DEFAULT_K_PATHS):
+    """
+    Candidate paths between two nodes, at most k of them, cheapest first.
+    :param G: PathEngine of the current step (cached CSR search), TopologySnapshot, or networkx graph.
+    :param i: Source node.
+    :param j: Target node.
+    :param k: Maximum number of paths (ignored for a PathEngine, which has its own).
+    :return: List of paths (empty when j is unreachable).
+    """
+    if isinstance(G, PathEngine):
+        return G.paths(i, j)
+    if hasattr(G, "indptr"):
+        return PathEngine(G, k).paths(i, j)
+    try:
+        return list(itertools.islice(nx.shortest_simple_paths(G, i, j), k))
+    except (nx.NetworkXNoPath, nx.NodeNotFound):
+        return []
 
-def allocate(path_set, satellite_num, bandwidth, isl_capacity, isl_max, antenna):
+
+@instrumentation.timed("allocation.allocate")
+def allocate(path_set, satellite_num, bandwidth, isl_capacity, isl_max, antenna, gateways=None):
     # path_set=search_alternate_path(G, i, j)
+    # gateways: optional GatewayNetwork whose antennas, backhaul and CSLs paths must also fit
+    if isinstance(isl_capacity, ResourceLedger):
+        if gateways is not None and gateways is not isl_capacity.gateways:
+            raise ValueError("Attach the GatewayNetwork to the ResourceLedger instead of passing it to allocate")
+        best_path_index = isl_capacity.select(path_set, bandwidth)
+        if best_path_index is None:
+            instrumentation.count("allocate.no_path")
+            return 0
+        return path_set[best_path_index]
     path_set_num = len(path_set)
     activate_counter = [0 for i in range(path_set_num)]
     exist = False
+    infeasible = 0
     for index in range(path_set_num):
         isavailable = True
         # check antenna remain
@@ -36,12 +72,23 @@ def allocate(path_set, satellite_num, bandwidth, isl_capacity, isl_max, antenna)
                 # check whether the link is already activated
                 elif isl_capacity[path_set[index][node_index]][path_set[index][node_index+1]] < isl_max:
                     activate_counter[index] += 1
-            # TODO: also consider ICL, CSL...
+            # TODO: also consider ICL (CSLs are checked through gateways below)
             elif path_set[index][node_index] > satellite_num and path_set[index][node_index+1] > satellite_num:
                 if isavailable == False:
                     continue
-        exist = True
+        # check gateway antennas, backhaul and CSL capacity
+        if isavailable and gateways is not None and not gateways.fits(path_set[index], bandwidth):
+            isavailable = False
+            activate_counter[index] = -1
+        infeasible += not isavailable
+        if isavailable:
+            exist = True
+    if instrumentation.ENABLED:
+        instrumentation.count("paths.evaluated", path_set_num)
+        instrumentation.count("paths.infeasible", infeasible)
+        instrumentation.observe("allocate.candidates", path_set_num)
     if exist == False:
+        instrumentation.count("allocate.no_path")
         print("No available path!\n")
         return 0
         sys.exit(1)
@@ -51,6 +98,9 @@ def allocate(path_set, satellite_num, bandwidth, isl_capacity, isl_max, antenna)
 
 
 def reset_antenna(current_path, antenna, satellite_num):
+    if isinstance(antenna, ResourceLedger):
+        # Antennas and ISL capacity move together in a ledger, see reset_isl_capacity
+        return antenna
     for node_index in range(len(current_path)):
         if node_index == 0 or node_index == len(current_path)-1:
             if current_path[node_index] < satellite_num:
@@ -61,7 +111,13 @@ def reset_antenna(current_path, antenna, satellite_num):
     return antenna
 
 
-def reset_isl_capacity(current_path, bandwidth, isl_capacity, satellite_num):
+@instrumentation.timed("allocation.reset_isl_capacity")
+def reset_isl_capacity(current_path, bandwidth, isl_capacity, satellite_num, gateways=None):
+    if isinstance(isl_capacity, ResourceLedger):
+        isl_capacity.release(current_path, bandwidth)
+        return isl_capacity
+    if gateways is not None:
+        gateways.release(current_path, bandwidth)
     for node_index in range(len(current_path)-1):
         if current_path[node_index] < satellite_num and current_path[node_index+1] < satellite_num:
             isl_capacity[current_path[node_index]][current_path[node_index+1]] += bandwidth
@@ -70,6 +126,8 @@ def reset_isl_capacity(current_path, bandwidth, isl_capacity, satellite_num):
 
 
 def update_antenna(best_path, antenna, satellite_num):
+    if isinstance(antenna, ResourceLedger):
+        return antenna
     for node_index in range(len(best_path)):
         if node_index == 0 or node_index == len(best_path)-1:
             if best_path[node_index] < satellite_num:
@@ -80,10 +138,294 @@ def update_antenna(best_path, antenna, satellite_num):
     return antenna
 
 
-def update_isl_capacity(best_path, bandwidth, isl_capacity, satellite_num):
+@instrumentation.timed("allocation.update_isl_capacity")
+def update_isl_capacity(best_path, bandwidth, isl_capacity, satellite_num, gateways=None):
+    if isinstance(isl_capacity, ResourceLedger):
+        if not isl_capacity.reserve(best_path, bandwidth):
+            raise ValueError(f"Path {best_path} does not fit the remaining capacity")
+        return isl_capacity
+    if gateways is not None and not gateways.reserve(best_path, bandwidth):
+        raise ValueError(f"Path {best_path} does not fit the remaining gateway capacity")
     for node_index in range(len(best_path)-1):
         if best_path[node_index] < satellite_num and best_path[node_index+1] < satellite_num:
             isl_capacity[best_path[node_index]][best_path[node_index+1]] -= bandwidth
             isl_capacity[best_path[node_index+1]][best_path[node_index]] -= bandwidth
     return isl_capacity
 
+
+class ResourceLedger:
+    """
+    Remaining antenna and ISL capacity of one timestep, array-backed.
+    Antennas are a vector indexed by satellite. ISL capacity is stored once per undirected link,
+    indexed through a sorted key array, so memory follows the number of links rather than
+    satellite_num ** 2. Paths follow the allocation rules of this module: satellite endpoints need
+    one free antenna, transit satellites two, every satellite-satellite hop must be an existing
+    link with more than `bandwidth` capacity left, and ground nodes (>= satellite_num) are free
+    unless they are gateways of an attached GatewayNetwork, whose antennas, backhaul and CSLs are
+    then checked and reserved together with the ISLs.
+    The module-level allocate / update_* / reset_* functions accept a ledger in place of the
+    isl_capacity list-of-lists and delegate to it.
+    Speed: per allocate call on a handful of candidate paths the list-of-lists state stays about
+    3x faster (plain indexing against a few NumPy calls). The ledger wins on state size instead:
+    building the lists takes ~6 ms at 960 satellites and ~140 ms at 3840, so with ~300 allocate
+    calls per fresh state (benchmark.py bench_relay) it overtakes them from roughly 1500-2000
+    satellites. Candidate sets above SMALL_EVALUATE_PATHS paths take the vectorized check.
+    """
+
+    def __init__(self, satellite_num, links, antenna, isl_max, gateways=None):
+        """
+        :param satellite_num: Number of satellites (node ids below it are satellites).
+        :param links: Array [num_links, 2] of satellite pairs; direction and duplicates are ignored.
+        :param antenna: Antennas per satellite (scalar or [satellite_num]).
+        :param isl_max: Capacity of an idle ISL.
+        :param gateways: Optional gateways.GatewayNetwork.
+        """
+        self.satellite_num = satellite_num
+        self.isl_max = isl_max
+        self.gateways = gateways
+        self.keys = self._link_keys(links)
+        self._indexed_keys = None
+        self.capacity = np.full(len(self.keys), isl_max, dtype=float)
+        self.antenna_total = np.broadcast_to(np.asarray(antenna, dtype=np.int64), (satellite_num,)).copy()
+        self.antenna = self.antenna_total.copy()
+
+    def _link_keys(self, links):
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        links = links[(links < self.satellite_num).all(axis=1)]
+        return np.unique(links.min(axis=1) * self.satellite_num + links.max(axis=1))
+
+    def relink(self, links):
+        """
+        Move to the link set of another timestep: links that persist keep their remaining capacity,
+        new links start idle, vanished links are dropped together with what was reserved on them.
+        :param links: Array [num_links, 2] of satellite pairs.
+        """
+        keys = self._link_keys(links)
+        capacity = np.full(len(keys), self.isl_max, dtype=float)
+        if len(self.keys):
+            previous = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            kept = self.keys[previous] == keys
+            capacity[kept] = self.capacity[previous[kept]]
+        self.keys = keys
+        self.capacity = capacity
+
+    def set_antenna(self, antenna):
+        """
+        Change the antenna budget (e.g. failed terminals) keeping current reservations;
+        satellites left with a negative count are over-subscribed until paths are released.
+        :param antenna: Antennas per satellite (scalar or [satellite_num]).
+        """
+        total = np.broadcast_to(np.asarray(antenna, dtype=np.int64), (self.satellite_num,))
+        self.antenna += total - self.antenna_total
+        self.antenna_total = total.copy()
+
+    @classmethod
+    def from_snapshot(cls, snapshot, satellite_num, antenna, isl_max, gateways=None):
+        """
+        Ledger over the ISLs of a TopologySnapshot (ground links carry no ISL capacity).
+        """
+        return cls(satellite_num, snapshot_edges(snapshot), antenna, isl_max, gateways)
+
+    @classmethod
+    def from_lists(cls, antenna, isl_capacity, isl_max):
+        """
+        Ledger equivalent to the legacy list-of-lists state: every pair with non-zero capacity is a link.
+        :param antenna: List of remaining antennas per satellite.
+        :param isl_capacity: Square list-of-lists of remaining capacity.
+        """
+        matrix = np.asarray(isl_capacity, dtype=float)
+        u, v = np.nonzero(np.triu(matrix, 1))
+        ledger = cls(len(antenna), np.stack((u, v), axis=1), antenna, isl_max)
+        ledger.capacity = matrix[u, v][np.argsort(u * len(antenna) + v)]
+        return ledger
+
+    def link_ids(self, u, v):
+        """
+        :return: Index into self.capacity of each (u, v) satellite link, -1 where there is no link.
+        """
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        keys = np.minimum(u, v) * self.satellite_num + np.maximum(u, v)
+        ids = np.searchsorted(self.keys, keys)
+        ids = np.minimum(ids, max(len(self.keys) - 1, 0))
+        found = (self.keys[ids] == keys) if len(self.keys) else np.zeros(keys.shape, dtype=bool)
+        return np.where(found, ids, -1)
+
+    def _link_index(self):
+        """
+        :return: Dict link key -> index into self.capacity, rebuilt when the link set changes (relink).
+        """
+        if self._indexed_keys is not self.keys:
+            self._index = dict(zip(self.keys.tolist(), range(len(self.keys))))
+            self._indexed_keys = self.keys
+        return self._index
+
+    def _evaluate_small(self, paths, bandwidth):
+        """
+        evaluate() as a plain loop, for candidate sets too small to amortize the array setup.
+        The antennas and capacities involved are still read with one gather each.
+        """
+        satellite_num = self.satellite_num
+        link_index = self._link_index()
+        nodes, links = [], []
+        for path in paths:
+            nodes.extend(node for node in path if node < satellite_num)
+            for u, v in zip(path, path[1:]):
+                if u < satellite_num and v < satellite_num:
+                    # Missing links read as zero capacity (index -1, see below)
+                    links.append(link_index.get(u * satellite_num + v if u < v else v * satellite_num + u, -1))
+        remaining = iter(self.antenna[nodes].tolist())
+        links = np.asarray(links, dtype=np.intp)
+        capacity = np.where(links >= 0, self.capacity[links] if len(self.keys) else 0, 0)
+        hops = zip(capacity.tolist(), ((links >= 0) & (capacity < self.isl_max)).tolist())
+        feasible = np.zeros(len(paths), dtype=bool)
+        active = np.zeros(len(paths), dtype=np.intp)
+        for i, (path, need) in enumerate(zip(paths, bandwidth.tolist())):
+            last = len(path) - 1
+            ok = last >= 0
+            for position, node in enumerate(path):
+                if node < satellite_num and next(remaining) < (1 if position == 0 or position == last else 2):
+                    ok = False
+            # Like the vectorized check, active counts every loaded ISL, even of infeasible paths
+            used = 0
+            for u, v in zip(path, path[1:]):
+                if u < satellite_num and v < satellite_num:
+                    link_capacity, loaded = next(hops)
+                    if link_capacity <= need:
+                        ok = False
+                    used += loaded
+            feasible[i] = ok
+            active[i] = used
+        return feasible, active
+
+    def _flatten(self, paths):
+        """
+        Flatten a list of paths into per-node and per-hop arrays.
+        :return: Tuple (lengths, antenna_nodes, antenna_demand, antenna_path,
+                        hop_links, hop_path), restricted to satellite nodes / satellite-satellite hops.
+        """
+        lengths = np.fromiter(map(len, paths), dtype=np.intp, count=len(paths))
+        nodes = np.fromiter(itertools.chain.from_iterable(paths), dtype=np.int64, count=int(lengths.sum()))
+        path_of = np.repeat(np.arange(len(paths)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        position = np.arange(len(nodes)) - starts[path_of]
+        endpoint = (position == 0) | (position == lengths[path_of] - 1)
+        satellite = nodes < self.satellite_num
+        demand = np.where(endpoint, 1, 2)[satellite]
+
+        hop = (position[:-1] + 1 < lengths[path_of[:-1]]) if len(nodes) else np.zeros(0, dtype=bool)
+        hop &= satellite[:-1] & satellite[1:]
+        links = self.link_ids(nodes[:-1][hop], nodes[1:][hop])
+        return lengths, nodes[satellite], demand, path_of[satellite], links, path_of[:-1][hop]
+
+    @instrumentation.timed("ResourceLedger.evaluate")
+    def evaluate(self, paths, bandwidth):
+        """
+        Check a whole candidate set at once.
+        :param paths: List of paths (lists of node ids).
+        :param bandwidth: Bandwidth every path would carry (scalar or [len(paths)]).
+        :return: Tuple (feasible, active): boolean array [len(paths)] and, per path, the number of
+                 ISLs it uses that already carry traffic.
+        """
+        if len(paths) == 0:
+            return np.zeros(0, dtype=bool), np.zeros(0, dtype=np.intp)
+        bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=float), (len(paths),))
+        if len(paths) <= SMALL_EVALUATE_PATHS:
+            feasible, active = self._evaluate_small(paths, bandwidth)
+        else:
+            lengths, nodes, demand, node_path, links, link_path = self._flatten(paths)
+            # Missing links read as zero capacity
+            capacity = np.where(links >= 0, self.capacity[np.maximum(links, 0)] if len(self.keys) else 0, 0)
+            bad = np.concatenate((node_path[self.antenna[nodes] < demand],
+                                  link_path[capacity <= bandwidth[link_path]]))
+            feasible = (np.bincount(bad, minlength=len(paths)) == 0) & (lengths > 0)
+            active = np.bincount(link_path[(links >= 0) & (capacity < self.isl_max)], minlength=len(paths))
+        if self.gateways is not None and feasible.any():
+            candidates = np.nonzero(feasible)[0]
+            feasible[candidates] = self.gateways.feasible([paths[i] for i in candidates], bandwidth[candidates])
+        if instrumentation.ENABLED:
+            instrumentation.count("paths.evaluated", len(paths))
+            instrumentation.count("paths.infeasible", len(paths) - int(feasible.sum()))
+        return feasible, active
+
+    def feasible(self, paths, bandwidth):
+        """
+        :return: Boolean array [len(paths)], see evaluate.
+        """
+        return self.evaluate(paths, bandwidth)[0]
+
+    def select(self, paths, bandwidth):
+        """
+        Pick the feasible path reusing the most already-active ISLs (first one on ties), like allocate.
+        :return: Index into paths, or None when no path is feasible.
+        """
+        feasible, active = self.evaluate(paths, bandwidth)
+        if not feasible.any():
+            return None
+        return int(np.argmax(np.where(feasible, active, -1)))
+
+    def _apply(self, path, bandwidth, sign, partial=False):
+        # One path: read its nodes and links directly rather than through _flatten
+        satellite_num = self.satellite_num
+        link_index = self._link_index()
+        last = len(path) - 1
+        nodes = np.array([node for node in path if node < satellite_num], dtype=np.intp)
+        demand = np.array([1 if position == 0 or position == last else 2
+                           for position, node in enumerate(path) if node < satellite_num], dtype=np.int64)
+        links = np.array([link_index.get(u * satellite_num + v if u < v else v * satellite_num + u, -1)
+                          for u, v in zip(path, path[1:]) if u < satellite_num and v < satellite_num], dtype=np.intp)
+        if partial:
+            links = links[links >= 0]
+        elif (links < 0).any():
+            raise ValueError(f"Path {path} uses a satellite pair that is not a link")
+        np.add.at(self.antenna, nodes, sign * demand)
+        np.add.at(self.capacity, links, sign * bandwidth)
+        return nodes, links
+
+    def reserve(self, path, bandwidth):
+        """
+        Take the antennas and ISL capacity of a path, all or nothing.
+        :return: True if reserved; False (ledger untouched) if the path is not feasible.
+        """
+        if not self.feasible([path], bandwidth)[0]:
+            return False
+        self._apply(path, bandwidth, -1)
+        if self.gateways is not None:
+            self.gateways.reserve(path, bandwidth)
+        return True
+
+    def release(self, path, bandwidth, partial=False):
+        """
+        Give back what reserve(path, bandwidth) took.
+        Raises ValueError (ledger untouched) if that would exceed the initial capacity.
+        :param partial: Skip links that vanished since the reservation (see relink) instead of raising.
+        """
+        nodes, links = self._apply(path, bandwidth, 1, partial)
+        if (self.antenna[nodes] > self.antenna_total[nodes]).any() or (self.capacity[links] > self.isl_max).any():
+            self._apply(path, bandwidth, -1, partial)
+            raise ValueError(f"Releasing {path} exceeds the initial capacity, it was not reserved")
+        if self.gateways is not None:
+            try:
+                self.gateways.release(path, bandwidth)
+            except ValueError:
+                self._apply(path, bandwidth, -1, partial)
+                raise
+
+    def reserve_all(self, paths, bandwidth):
+        """
+        Reserve several paths (e.g. every user of a session) atomically: on the first failure,
+        the ones already reserved are released again.
+        :return: True if every path was reserved.
+        """
+        done = []
+        for path in paths:
+            if not self.reserve(path, bandwidth):
+                for reserved in reversed(done):
+                    self.release(reserved, bandwidth)
+                return False
+            done.append(path)
+        return True
+
+    def release_all(self, paths, bandwidth, partial=False):
+        for path in paths:
+            self.release(path, bandwidth, partial)
@@ -0,0 +1,90 @@
+import numpy as np
+from satellites import LATENCY_MODELS, calculate_synchronization
+from session_information import SessionTable
+from spatial_index import SatelliteIndex
+
+LATENCY_WEIGHT = 0.7
+SYNCHRONIZATION_WEIGHT = 0.3
+
+
+def assign_step(users, sat_lats, sat_longs, k=3, index=None, chunk_size=65536, latency_weight=LATENCY_WEIGHT,
+                synchronization_weight=SYNCHRONIZATION_WEIGHT, latency_model="flat"):
+    """
+    Assign every user to its best satellite at a single timestep.
+    :param users: Array of user locations [num_users, 2 (lat, lon)].
+    :param sat_lats: Array of satellite latitudes at this step.
+    :param sat_longs: Array of satellite longitudes at this step.
+    :param k: Number of nearest satellites considered per user.
+    :param index: Optional SatelliteIndex over (sat_lats, sat_longs).
+    :param chunk_size: Users scored at once, bounds the [chunk_size, k] temporaries.
+    :param latency_weight: Weight for latency in the cost function.
+    :param synchronization_weight: Weight for synchronization in the cost function.
+    :param latency_model: Name in satellites.LATENCY_MODELS ("flat" is the original calculate_latency).
+    :return: Tuple (best [num_users], cost [num_users], candidates [num_users, k]).
+    """
+    calculate_latency = LATENCY_MODELS[latency_model]
+    users = np.asarray(users, dtype=float).reshape(-1, 2)
+    sat_lats = np.asarray(sat_lats)
+    sat_longs = np.asarray(sat_longs)
+    if index is None:
+        index = SatelliteIndex(sat_lats, sat_longs)
+    num_users = len(users)
+    k = min(k, len(index))
+    best = np.zeros(num_users, dtype=np.intp)
+    cost = np.zeros(num_users)
+    candidates = np.zeros((num_users, k), dtype=np.intp)
+
+    for begin in range(0, num_users, chunk_size):
+        rows = slice(begin, min(begin + chunk_size, num_users))
+        user_lat = users[rows, 0:1]
+        user_lon = users[rows, 1:2]
+        closest, _ = index.query(user_lat[:, 0], user_lon[:, 0], k)
+        latency = calculate_latency(user_lat, user_lon, sat_lats[closest], sat_longs[closest])
+        sync_cost = calculate_synchronization(user_lat, user_lon, sat_lats[closest], sat_longs[closest])
+        candidate_cost = latency_weight * latency + synchronization_weight * sync_cost
+        choice = np.argmin(candidate_cost, axis=1)
+        picked = np.arange(len(choice))
+        best[rows] = closest[picked, choice]
+        cost[rows] = candidate_cost[picked, choice]
+        candidates[rows] = closest
+    return best, cost, candidates
+
+
+def assign_users(users, satellite_positions, k=3, chunk_size=65536, latency_weight=LATENCY_WEIGHT,
+                 synchronization_weight=SYNCHRONIZATION_WEIGHT, latency_model="flat"):
+    """
+    Assign every user to its best satellite at every timestep in one call.
+    Same rule as find_best_satellite: take the k nearest satellites, score them with
+    latency_weight * latency + synchronization_weight * sync and keep the cheapest
+    (the nearest one wins ties).
+    :param users: Array of user locations [num_users, 2 (lat, lon)].
+    :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)].
+    :param k: Number of nearest satellites considered per user.
+    :param chunk_size: Users scored at once, bounds the [chunk_size, k] temporaries.
+    :param latency_weight: Weight for latency in the cost function.
+    :param synchronization_weight: Weight for synchronization in the cost function.
+    :param latency_model: Name in satellites.LATENCY_MODELS ("flat" is the original calculate_latency).
+    :return: Tuple (best, cost) of [num_users, num_steps] arrays (satellite index and its cost).
+    """
+    users = np.asarray(users, dtype=float).reshape(-1, 2)
+    num_steps = satellite_positions.shape[1]
+    best = np.zeros((len(users), num_steps), dtype=np.intp)
+    cost = np.zeros((len(users), num_steps))
+    for time in range(num_steps):
+        best[:, time], cost[:, time], _ = assign_step(
+            users, satellite_positions[:, time, 0], satellite_positions[:, time, 1], k, None, chunk_size,
+            latency_weight, synchronization_weight, latency_model)
+    return best, cost
+
+
+def session_user_locations(sessions):
+    """
+    Flatten the users of a list of sessions into one location array.
+    :param sessions: List of session objects, or a SessionTable.
+    :return: Tuple (locations [num_users, 2], users) with users in the same order.
+    """
+    if isinstance(sessions, SessionTable):
+        return sessions.users.locations(), list(sessions.users)
+    users = [user_obj for session in sessions for user_obj in session.get_user()]
+    locations = np.array([user_obj.get_location() for user_obj in users], dtype=float).reshape(-1, 2)
+    return locations, users
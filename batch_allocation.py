@@ -0,0 +1,291 @@
+import heapq
+import itertools
+import time
+import numpy as np
+import instrumentation
+import scipy.sparse
+from scipy.optimize import linprog
+from allocation import ResourceLedger
+from paths import DEFAULT_K_PATHS, PathEngine, session_path_set
+from topology import snapshot_edges
+
+# Weight of the hop-count spread between users, as in session.find_best_relay
+VARIATION_WEIGHT = 50
+
+
+def _evaluate_options(ledger, options, path_sets, bandwidths):
+    """
+    Pick a path for every user of every (session, relay) option against the current ledger and score it.
+    Every candidate path of every option goes through a single ledger.evaluate call.
+    :param ledger: ResourceLedger.
+    :param options: Array [num_options, 2] of (session index, relay index into its cu_set).
+    :param path_sets: Per session, all_path_set[user_index][relay_index] = list of paths.
+    :param bandwidths: Array [num_sessions] of session bandwidths.
+    :return: Tuple (feasible [num_options], score [num_options], chosen) where chosen[o] lists the
+             path picked for each user of option o (None for infeasible options).
+    """
+    flat_paths, path_slot, slot_option = [], [], []
+    for option, (s, r) in enumerate(options):
+        for user_paths in path_sets[s]:
+            slot = len(slot_option)
+            slot_option.append(option)
+            flat_paths.extend(user_paths[r])
+            path_slot.extend([slot] * len(user_paths[r]))
+    num_options = len(options)
+    slot_option = np.asarray(slot_option, dtype=np.intp)
+    path_slot = np.asarray(path_slot, dtype=np.intp)
+    feasible, active = ledger.evaluate(flat_paths, bandwidths[options[slot_option[path_slot], 0]]
+                                       if len(flat_paths) else 0)
+
+    # Per user slot, the feasible path with the most active ISLs, first one on ties (allocate's rule)
+    rank = np.where(feasible, active, -1)
+    order = np.lexsort((np.arange(len(flat_paths)), -rank, path_slot))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = path_slot[order][1:] != path_slot[order][:-1]
+    best = np.full(len(slot_option), -1, dtype=np.intp)
+    best[path_slot[order][first]] = order[first]
+    slot_ok = best >= 0
+    slot_ok[slot_ok] = feasible[best[slot_ok]]
+
+    option_ok = np.bincount(slot_option[~slot_ok], minlength=num_options) == 0
+    hops = np.where(slot_ok, np.fromiter((len(flat_paths[p]) - 1 if p >= 0 else 0 for p in best),
+                                         dtype=float, count=len(best)), 0)
+    users = np.bincount(slot_option, minlength=num_options)
+    mean = np.bincount(slot_option, hops, minlength=num_options) / np.maximum(users, 1)
+    spread = np.bincount(slot_option, np.abs(hops - mean[slot_option]), minlength=num_options)
+    score = mean + VARIATION_WEIGHT * spread
+    option_ok &= users > 0
+
+    chosen = [None] * num_options
+    for slot, option in enumerate(slot_option):
+        if option_ok[option]:
+            if chosen[option] is None:
+                chosen[option] = []
+            chosen[option].append(flat_paths[best[slot]])
+    return option_ok, score, chosen
+
+
+def _lp_priority(ledger, options, chosen, score, bandwidths, num_sessions):
+    """
+    LP relaxation of the joint relay selection: at most one relay per session, ISL and antenna
+    capacity shared by all sessions, serving a session always beats any hop-count saving.
+    :return: Fractional assignment [num_options], used to order the greedy commit.
+    """
+    penalty = float(score.max()) + 1.0 if len(score) else 1.0
+    cost = score - penalty
+    session_rows = scipy.sparse.csr_matrix((np.ones(len(options)), (options[:, 0], np.arange(len(options)))),
+                                           shape=(num_sessions, len(options)))
+    link_rows, link_cols, link_vals, node_rows, node_cols, node_vals = [], [], [], [], [], []
+    for option, paths in enumerate(chosen):
+        _, nodes, demand, _, links, _ = ledger._flatten(paths)
+        link_rows.append(links)
+        link_cols.append(np.full(len(links), option))
+        link_vals.append(np.full(len(links), bandwidths[options[option, 0]], dtype=float))
+        node_rows.append(nodes)
+        node_cols.append(np.full(len(nodes), option))
+        node_vals.append(demand.astype(float))
+    link_rows, link_cols, link_vals, node_rows, node_cols, node_vals = (
+        np.concatenate(part) if part else np.zeros(0) for part in
+        (link_rows, link_cols, link_vals, node_rows, node_cols, node_vals))
+    links = scipy.sparse.csr_matrix((link_vals, (link_rows, link_cols)), shape=(len(ledger.keys), len(options)))
+    nodes = scipy.sparse.csr_matrix((node_vals, (node_rows, node_cols)), shape=(ledger.satellite_num, len(options)))
+    # allocate needs strictly more capacity than the bandwidth left on a link: keep a margin of one
+    result = linprog(cost, A_ub=scipy.sparse.vstack((session_rows, links, nodes)).tocsc(),
+                     b_ub=np.concatenate((np.ones(num_sessions), ledger.capacity - 1, ledger.antenna)),
+                     bounds=(0, 1), method="highs")
+    if result.status != 0:
+        return np.zeros(len(options))
+    return result.x
+
+
+@instrumentation.timed("batch_allocation.allocate_sessions")
+def allocate_sessions(sessions, path_sets, ledger, method="greedy"):
+    """
+    Jointly choose the relay and the user paths of every session of one timestep.
+    Every (session, relay) option is scored like session.find_best_relay (mean hop count plus
+    VARIATION_WEIGHT times the spread between users) in one vectorized pass. Options are then
+    committed from a priority queue, cheapest first ("greedy") or in the order of an LP relaxation
+    of the joint problem ("lp"). A commit reserves the session's paths atomically in the shared
+    ledger; when capacity taken by earlier commits makes it fail, only that session is re-scored
+    and pushed back.
+    :param sessions: List of session objects with cu_set, user and bandwidth set.
+    :param path_sets: Per session, all_path_set[user_index][relay_index] = list of paths (see paths.session_path_set).
+    :param ledger: ResourceLedger shared by all sessions; reservations are left in it.
+    :param method: "greedy" or "lp".
+    :return: Dict of statistics: sessions, allocated, options, paths_evaluated, rescored, seconds, sessions_per_s.
+    """
+    if method not in ("greedy", "lp"):
+        raise ValueError(f"Unknown allocation method {method!r}")
+    started = time.perf_counter()
+    num_sessions = len(sessions)
+    bandwidths = np.array([s.bandwidth for s in sessions], dtype=float)
+    options = np.array([(s, r) for s in range(num_sessions) for r in range(len(sessions[s].cu_set or []))],
+                       dtype=np.intp).reshape(-1, 2)
+    paths_evaluated = sum(len(p) for s, r in options for p in (user[r] for user in path_sets[s]))
+    feasible, score, chosen = _evaluate_options(ledger, options, path_sets, bandwidths)
+
+    if method == "lp" and feasible.any():
+        keep = np.nonzero(feasible)[0]
+        fraction = np.zeros(len(options))
+        fraction[keep] = _lp_priority(ledger, options[keep], [chosen[o] for o in keep], score[keep],
+                                      bandwidths, num_sessions)
+    else:
+        fraction = np.zeros(len(options))
+    counter = itertools.count()
+    # Entries carry the number of commits made when they were scored
+    heap = [(-fraction[o], score[o], next(counter), o, chosen[o], 0) for o in np.nonzero(feasible)[0]]
+    heapq.heapify(heap)
+
+    for session in sessions:
+        session.best_relay = None
+        session.best_user_relay_path = []
+    done = np.zeros(num_sessions, dtype=bool)
+    # Commit count at each session's last re-scoring; older entries of the session are superseded
+    rescored_at = np.full(num_sessions, -1)
+    rescored = commits = 0
+    while heap:
+        _, _, _, option, paths, scored_at = heapq.heappop(heap)
+        s, r = options[option]
+        if done[s] or scored_at < rescored_at[s]:
+            continue
+        if ledger.reserve_all(paths, bandwidths[s]):
+            done[s] = True
+            commits += 1
+            session = sessions[s]
+            session.best_relay = session.cu_set[r]
+            session.best_user_relay_path = paths
+            for user, path in zip(session.user, paths):
+                user.path = path
+            continue
+        if scored_at == commits:
+            # Nothing changed since scoring: the users' paths fit one by one but not together
+            continue
+        # Capacity changed since this option was scored: re-score the session's options only
+        rescored += 1
+        rescored_at[s] = commits
+        own = np.nonzero(options[:, 0] == s)[0]
+        own_ok, own_score, own_chosen = _evaluate_options(ledger, options[own], path_sets, bandwidths)
+        paths_evaluated += sum(len(user[options[o, 1]]) for o in own for user in path_sets[s])
+        for o, ok, sc, ch in zip(own, own_ok, own_score, own_chosen):
+            if ok:
+                heapq.heappush(heap, (-fraction[o], sc, next(counter), o, ch, commits))
+
+    seconds = time.perf_counter() - started
+    return {"sessions": num_sessions, "allocated": int(done.sum()), "options": len(options),
+            "paths_evaluated": paths_evaluated, "rescored": rescored, "seconds": seconds,
+            "sessions_per_s": num_sessions / seconds if seconds > 0 else float("inf")}
+
+
+def _broken_paths(paths, snapshot, ledger):
+    """
+    :return: Boolean array [len(paths)]: the path uses a link missing from snapshot or a satellite
+             whose antennas are over-subscribed in ledger.
+    """
+    if len(paths) == 0:
+        return np.zeros(0, dtype=bool)
+    edges = snapshot_edges(snapshot)
+    edge_keys = edges[:, 0].astype(np.int64) * snapshot.num_nodes + edges[:, 1]
+    lengths = np.fromiter(map(len, paths), dtype=np.intp, count=len(paths))
+    nodes = np.fromiter(itertools.chain.from_iterable(paths), dtype=np.int64, count=int(lengths.sum()))
+    path_of = np.repeat(np.arange(len(paths)), lengths)
+    hop = path_of[:-1] == path_of[1:]
+    u, v = nodes[:-1][hop], nodes[1:][hop]
+    keys = np.minimum(u, v) * snapshot.num_nodes + np.maximum(u, v)
+    missing = ~np.isin(keys, edge_keys)
+    exhausted = (nodes < ledger.satellite_num) & (ledger.antenna[np.minimum(nodes, ledger.satellite_num - 1)] < 0)
+    bad = np.concatenate((path_of[:-1][hop][missing], path_of[exhausted]))
+    return np.bincount(bad, minlength=len(paths)) > 0
+
+
+class IncrementalAllocator:
+    """
+    Relay allocation carried from one timestep to the next.
+    Reservations live in one ResourceLedger and paths in one PathEngine, both moved to the new
+    topology at every step. Only sessions that are new, or whose current_user_relay_path uses a
+    vanished link or an over-subscribed satellite, are released and re-allocated (allocate_sessions);
+    every other session keeps its relay, paths and reservation, so the cost of a step follows the
+    churn rather than the number of sessions.
+    """
+
+    def __init__(self, snapshot, satellite_num, antenna, isl_max, k=DEFAULT_K_PATHS, method="greedy", gateways=None):
+        """
+        :param snapshot: TopologySnapshot of the first step.
+        :param satellite_num: Number of satellites.
+        :param antenna: Antennas per satellite (scalar or [satellite_num]).
+        :param isl_max: Capacity of an idle ISL.
+        :param k: Candidate paths per (user, relay).
+        :param method: allocate_sessions method for the sessions being (re-)allocated.
+        :param gateways: Optional GatewayNetwork whose capacity is reserved alongside the ISLs.
+        """
+        self.satellite_num = satellite_num
+        self.method = method
+        self.snapshot = snapshot
+        self.engine = PathEngine(snapshot, k, num_satellites=satellite_num)
+        self.ledger = ResourceLedger.from_snapshot(snapshot, satellite_num, antenna, isl_max, gateways)
+        # session id -> (paths, bandwidth) reserved in the ledger
+        self.reserved = {}
+        self.seen = set()
+
+    def advance(self, snapshot, antenna=None):
+        """
+        Move paths and capacity to the next step's topology.
+        :param snapshot: TopologySnapshot of the next step (its `removed` drives path invalidation).
+        :param antenna: Optional new antenna budget.
+        """
+        self.snapshot = snapshot
+        self.engine.update(snapshot)
+        self.ledger.relink(snapshot_edges(snapshot))
+        if antenna is not None:
+            self.ledger.set_antenna(antenna)
+
+    def allocate(self, sessions, user_nodes, reroute=(), switch=True):
+        """
+        Bring the sessions of the current step up to date.
+        :param sessions: List of session objects active at this step (with cu_set refreshed).
+        :param user_nodes: Per session, the graph node of each of its users.
+        :param reroute: Ids of sessions to re-allocate even if their paths still work (e.g. their
+                        relay left cu_set); counted as rerouted.
+        :param switch: Call switch_relay on the re-allocated sessions. With False the caller switches
+                       them later (best_* hold the new allocation, which is already reserved).
+        :return: Dict of statistics: sessions, carried, rerouted, new, retried (not allocated at the
+                 previous step), departed, allocated, seconds, plus the allocate_sessions statistics
+                 of the re-allocated ones under "batch".
+        """
+        started = time.perf_counter()
+        active = {session.id for session in sessions}
+        departed = [sid for sid in self.reserved if sid not in active]
+        for sid in departed:
+            paths, bandwidth = self.reserved.pop(sid)
+            self.ledger.release_all(paths, bandwidth, partial=True)
+        self.seen &= active
+
+        carried = [i for i, session in enumerate(sessions) if session.id in self.reserved]
+        flat_paths, owner = [], []
+        for i in carried:
+            paths = self.reserved[sessions[i].id][0]
+            flat_paths.extend(paths)
+            owner.extend([i] * len(paths))
+        broken = set(np.asarray(owner, dtype=np.intp)[_broken_paths(flat_paths, self.snapshot, self.ledger)].tolist())
+        reroute = set(reroute)
+        broken.update(i for i in carried if sessions[i].id in reroute)
+        for i in broken:
+            paths, bandwidth = self.reserved.pop(sessions[i].id)
+            self.ledger.release_all(paths, bandwidth, partial=True)
+
+        # Sessions never allocated, previously unallocatable, or just released as broken
+        todo_index = [i for i, session in enumerate(sessions) if session.id not in self.reserved]
+        new = sum(sessions[i].id not in self.seen for i in todo_index)
+        self.seen.update(active)
+        todo = [sessions[i] for i in todo_index]
+        path_sets = [session_path_set(self.engine, user_nodes[i], sessions[i].cu_set or []) for i in todo_index]
+        batch = allocate_sessions(todo, path_sets, self.ledger, self.method)
+        for session in todo:
+            if switch:
+                session.switch_relay()
+            if session.best_relay is not None:
+                self.reserved[session.id] = (session.best_user_relay_path, session.bandwidth)
+
+        seconds = time.perf_counter() - started
+        return {"sessions": len(sessions), "carried": len(carried) - len(broken), "rerouted": len(broken),
+                "new": new, "retried": len(todo) - len(broken) - new, "departed": len(departed),
+                "allocated": len(self.reserved), "seconds": seconds, "batch": batch}
@@ -0,0 +1,250 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import allocation
+from assignment import assign_users
+from batch_allocation import allocate_sessions
+from paths import PathEngine, session_path_set
+from propagation import generate_satellite_ecef
+from satellites import generate_satellite_positions
+from scenario import generate_scenario, walker_catalog
+from tests import find_best_satellite
+from tle import load_tle_catalog
+from topology import ConstellationTopology, to_networkx
+from users_information import k_center
+
+STATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.txt")
+START_TIME = datetime.datetime(2024, 11, 27)
+TIME_STEP = 60
+ANTENNA = 64
+ISL_MAX = 100
+# Largest constellation the list-of-lists ISL matrix of allocation.py is benchmarked with
+LIST_STATE_MAX_SATELLITES = 1000
+# Users whose path search / allocation is timed per configuration
+MAX_PATH_USERS = 200
+REGRESSION_THRESHOLD = 1.25
+
+# satellites: 0 stands for the bundled stations.txt catalog, other sizes are Walker constellations
+GRIDS = {
+    "quick": {"satellites": [0, 240], "users": [100], "steps": [10]},
+    "full": {"satellites": [0, 240, 960, 3840], "users": [100, 1000], "steps": [10, 100]},
+}
+
+
+def measure(function, repeat=3, min_time=0.2):
+    """
+    :return: Best wall time in seconds of at least `repeat` calls, repeated until min_time has passed
+             so that millisecond-scale timings are stable enough to compare between runs.
+    """
+    best = float("inf")
+    calls = 0
+    total = 0.0
+    while calls < repeat or total < min_time:
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = min(best, elapsed)
+        total += elapsed
+        calls += 1
+    return best
+
+
+def load_catalog(num_satellites):
+    if num_satellites == 0:
+        return load_tle_catalog(STATIONS_PATH, strict=False)
+    return walker_catalog(num_satellites)
+
+
+def _record(results, benchmark, variant, satellites, users, steps, seconds, items):
+    results.append({"benchmark": benchmark, "variant": variant, "satellites": satellites, "users": users,
+                    "steps": steps, "seconds": seconds, "items": items,
+                    "items_per_s": items / seconds if seconds > 0 else None})
+    print(f"{benchmark:>22} {variant:>10}  sats={satellites:<5} users={users:<5} steps={steps:<4} "
+          f"{seconds * 1000:10.2f} ms  ({items} items)")
+
+
+def bench_propagation(results, catalog, satellites, steps):
+    """
+    generate_satellite_positions for every backend that is practical at this size.
+    """
+    for backend in ("numpy", "chebyshev", "ephem"):
+        if backend == "ephem" and len(catalog) * steps > 20000:
+            continue
+        seconds = measure(lambda: generate_satellite_positions(catalog, TIME_STEP, steps, start_time=START_TIME,
+                                                               backend=backend))
+        _record(results, "propagation", backend, satellites, 0, steps, seconds, len(catalog) * steps)
+
+
+def bench_nearest(results, positions, sessions, satellites, users):
+    """
+    k_center per session and batched (SessionTable.find_k_central), and find_best_satellite per user against the vectorized assign_users.
+    """
+    session_list = list(sessions)
+    seconds = measure(lambda: [k_center(s.user, positions, 0, 3) for s in session_list])
+    _record(results, "k_center", "per_session", satellites, users, 1, seconds, len(session_list))
+    seconds = measure(lambda: sessions.find_k_central(positions, 0, 3))
+    _record(results, "k_center", "batch", satellites, users, 1, seconds, len(session_list))
+
+    locations = sessions.users.locations()
+    sat_lats, sat_lons = positions[:, 0, 0], positions[:, 0, 1]
+    seconds = measure(lambda: [find_best_satellite(lat, lon, sat_lats, sat_lons) for lat, lon in locations])
+    _record(results, "find_best_satellite", "per_user", satellites, users, 1, seconds, len(locations))
+    seconds = measure(lambda: assign_users(locations, positions[:, :1]))
+    _record(results, "find_best_satellite", "vectorized", satellites, users, 1, seconds, len(locations))
+
+
+def bench_paths(results, snapshot, num_satellites, pairs, satellites, users):
+    """
+    search_alternate_path + allocate for (user node, satellite) pairs: networkx with list-of-lists
+    state against the PathEngine with a ResourceLedger.
+    """
+    bandwidth = 2
+    if num_satellites <= LIST_STATE_MAX_SATELLITES:
+        graph = to_networkx(snapshot)
+        antenna = [ANTENNA] * num_satellites
+        isl_capacity = [[ISL_MAX] * num_satellites for _ in range(num_satellites)]
+
+        def networkx_lists():
+            for source, target in pairs:
+                path_set = allocation.search_alternate_path(graph, source, target)
+                if path_set:
+                    allocation.allocate(path_set, num_satellites, bandwidth, isl_capacity, ISL_MAX, antenna)
+        seconds = measure(networkx_lists, repeat=1)
+        _record(results, "path_allocate", "networkx", satellites, users, 1, seconds, len(pairs))
+
+    def engine_ledger():
+        engine = PathEngine(snapshot, num_satellites=num_satellites)
+        ledger = allocation.ResourceLedger.from_snapshot(snapshot, num_satellites, ANTENNA, ISL_MAX)
+        for source, target in pairs:
+            path_set = allocation.search_alternate_path(engine, source, target)
+            if path_set:
+                allocation.allocate(path_set, num_satellites, bandwidth, ledger, ISL_MAX, ledger)
+    seconds = measure(engine_ledger, repeat=1)
+    _record(results, "path_allocate", "engine", satellites, users, 1, seconds, len(pairs))
+
+
+def bench_relay(results, snapshot, positions, sessions, num_satellites, satellites, users):
+    """
+    session.find_best_relay one session at a time against allocate_sessions for all of them.
+    """
+    session_list = []
+    for s in sessions:
+        if sessions.offsets[s.row + 1] > MAX_PATH_USERS:
+            break
+        session_list.append(s)
+    sessions.find_k_central(positions, 0, 3, [s.row for s in session_list])
+    engine = PathEngine(snapshot, num_satellites=num_satellites)
+    user_nodes = [(num_satellites + np.arange(sessions.offsets[s.row], sessions.offsets[s.row + 1])).tolist()
+                  for s in session_list]
+    started = time.perf_counter()
+    path_sets = [session_path_set(engine, nodes, s.cu_set) for s, nodes in zip(session_list, user_nodes)]
+    _record(results, "path_sets", "engine", satellites, users, 1, time.perf_counter() - started, len(session_list))
+
+    if num_satellites <= LIST_STATE_MAX_SATELLITES:
+        def lists_sequential():
+            # Fresh state every repeat, like the ledger variants
+            antenna = [ANTENNA] * num_satellites
+            isl_capacity = [[ISL_MAX] * num_satellites for _ in range(num_satellites)]
+            for s, p in zip(session_list, path_sets):
+                s.find_best_relay(p, num_satellites, s.bandwidth, isl_capacity, ISL_MAX, antenna)
+        seconds = measure(lists_sequential)
+        _record(results, "find_best_relay", "lists", satellites, users, 1, seconds, len(session_list))
+
+    def ledger_sequential():
+        ledger = allocation.ResourceLedger.from_snapshot(snapshot, num_satellites, ANTENNA, ISL_MAX)
+        for s, p in zip(session_list, path_sets):
+            s.find_best_relay(p, num_satellites, s.bandwidth, ledger, ISL_MAX, ledger)
+    seconds = measure(ledger_sequential)
+    _record(results, "find_best_relay", "ledger", satellites, users, 1, seconds, len(session_list))
+
+    def batch():
+        ledger = allocation.ResourceLedger.from_snapshot(snapshot, num_satellites, ANTENNA, ISL_MAX)
+        allocate_sessions(session_list, path_sets, ledger)
+    seconds = measure(batch)
+    _record(results, "find_best_relay", "batch", satellites, users, 1, seconds, len(session_list))
+
+
+def run(grid, seed=0):
+    """
+    Run every benchmark over a scaling grid. Propagation scales with satellites x steps; the
+    nearest-satellite, path and relay benchmarks with satellites x users at a single step.
+    :param grid: Dict with "satellites", "users" and "steps" lists (see GRIDS).
+    :param seed: Scenario seed, so that runs compare like with like.
+    :return: List of result dicts.
+    """
+    results = []
+    for satellites in grid["satellites"]:
+        catalog = load_catalog(satellites)
+        num_satellites = len(catalog)
+        for steps in grid["steps"]:
+            bench_propagation(results, catalog, satellites, steps)
+        positions = generate_satellite_positions(catalog, TIME_STEP, 1, start_time=START_TIME)
+        ecef = generate_satellite_ecef(catalog, TIME_STEP, 1, start_time=START_TIME)
+        for users in grid["users"]:
+            sessions = generate_scenario(max(1, users // 3), 5, seed=seed, spread_km=500)
+            bench_nearest(results, positions, sessions, satellites, users)
+            path_users = min(len(sessions.users), MAX_PATH_USERS)
+            topology = ConstellationTopology(ecef, ground_points=sessions.users.locations()[:path_users],
+                                             ground_links=2)
+            snapshot = topology.snapshot(0)
+            rng = np.random.default_rng(seed)
+            pairs = [(num_satellites + u, int(rng.integers(num_satellites))) for u in range(path_users)]
+            bench_paths(results, snapshot, num_satellites, pairs, satellites, users)
+            bench_relay(results, snapshot, positions, sessions, num_satellites, satellites, users)
+    return results
+
+
+def result_key(result):
+    return result["benchmark"], result["variant"], result["satellites"], result["users"], result["steps"]
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Flag results slower than their baseline counterpart by more than `threshold` times.
+    :param results: List of result dicts.
+    :param baseline: List of result dicts of an earlier run.
+    :return: List of (key, baseline seconds, current seconds, ratio) for every regression.
+    """
+    previous = {result_key(r): r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before and result["seconds"] > before * threshold:
+            regressions.append((result_key(result), before, result["seconds"], result["seconds"] / before))
+    return regressions
+
+
+def environment():
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "cpus": os.cpu_count(),
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks")
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="quick")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown ratio reported as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(GRIDS[args.grid], args.seed)
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "grid": args.grid, "seed": args.seed, "results": results}, f,
+                  indent=1)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        for key, before, after, ratio in regressions:
+            print(f"REGRESSION {key}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
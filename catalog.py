@@ -0,0 +1,177 @@
+import json
+import os
+import tempfile
+from collections import namedtuple
+import numpy as np
+import requests
+import propagation
+from ephemeris_cache import cache_key
+from tle import TLE_DTYPE, iter_tle, load_tle_catalog, parse_tle_record, valid_tle_line
+
+# Rows of TLECatalog.records touched by one refresh: changed and added are rows of the refreshed catalog,
+# removed the NORAD ids dropped upstream and removed_rows the rows they had before the refresh
+CatalogDelta = namedtuple("CatalogDelta", ["changed", "added", "removed", "removed_rows"])
+
+
+def _empty_delta():
+    empty = np.zeros(0, dtype=np.intp)
+    return CatalogDelta(empty, empty, np.zeros(0, dtype=np.int64), empty)
+
+
+class TLECatalog:
+    """
+    Local TLE catalog kept in sync with an upstream file by NORAD id.
+    The catalog lives at `path` as a plain 3-line TLE file (readable by tle.load_tle_catalog);
+    the HTTP validators of the last download are kept next to it in `path + '.meta.json'`.
+    Row order is stable: satellites removed upstream are deleted (full refreshes only), the others keep
+    their relative order and new ones are appended, so propagated position arrays only need the rows
+    listed in the returned CatalogDelta dropped or recomputed (see refresh_positions).
+    """
+
+    def __init__(self, path, url=None):
+        self.path = path
+        self.url = url
+        self.meta_path = path + ".meta.json"
+        self.meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        if os.path.exists(path):
+            self.records = load_tle_catalog(path, strict=False)
+        else:
+            self.records = np.zeros(0, dtype=TLE_DTYPE)
+        self._index()
+
+    def _index(self):
+        self.row_of = {int(norad_id): row for row, norad_id in enumerate(self.records["norad_id"])}
+        self.lines_of = {int(norad_id): (line1.decode(), line2.decode()) for norad_id, line1, line2 in
+                         zip(self.records["norad_id"], self.records["line1"], self.records["line2"])}
+
+    def __len__(self):
+        return len(self.records)
+
+    def apply(self, entries, full=False):
+        """
+        Merge (name, TLE line 1, TLE line 2) entries into the catalog.
+        Entries whose lines are unchanged are skipped before any parsing or checksum work; a NORAD id
+        listed more than once counts once, with its last valid lines.
+        :param entries: Iterable of TLE tuples, e.g. tle.iter_tle(source, validate=False).
+        :param full: True if entries are the whole upstream catalog: satellites missing from it are removed.
+        :return: CatalogDelta of the refresh.
+        """
+        changed = {}
+        added = {}
+        seen = set()
+        for name, tle_line1, tle_line2 in entries:
+            try:
+                norad_id = int(tle_line1[2:7])
+            except ValueError:
+                continue
+            seen.add(norad_id)
+            lines = (tle_line1[:69], tle_line2[:69])
+            if self.lines_of.get(norad_id) == lines:
+                continue
+            if not (valid_tle_line(tle_line1, 1) and valid_tle_line(tle_line2, 2)
+                    and tle_line1[2:7] == tle_line2[2:7]):
+                continue
+            self.lines_of[norad_id] = lines
+            if norad_id in self.row_of:
+                changed[norad_id] = parse_tle_record(name, tle_line1, tle_line2)
+            else:
+                added[norad_id] = parse_tle_record(name, tle_line1, tle_line2)
+
+        removed = [norad_id for norad_id in self.row_of if norad_id not in seen] if full else []
+        removed_rows = np.array(sorted(self.row_of[norad_id] for norad_id in removed), dtype=np.intp)
+        if len(removed_rows):
+            self.records = np.delete(self.records, removed_rows)
+            self._index()
+        changed_rows = np.array([self.row_of[norad_id] for norad_id in changed], dtype=np.intp)
+        if changed:
+            self.records[changed_rows] = np.array(list(changed.values()), dtype=TLE_DTYPE)
+        start = len(self.records)
+        if added:
+            self.records = np.concatenate((self.records, np.array(list(added.values()), dtype=TLE_DTYPE)))
+        self._index()
+        return CatalogDelta(np.sort(changed_rows), np.arange(start, len(self.records), dtype=np.intp),
+                            np.array(sorted(removed), dtype=np.int64), removed_rows)
+
+    def refresh(self, timeout=30):
+        """
+        Conditionally download the upstream file and apply it as a delta.
+        Sends If-None-Match / If-Modified-Since from the previous download, so an unchanged
+        upstream costs one 304 round trip.
+        :param timeout: Request timeout in seconds.
+        :return: CatalogDelta (empty when the server answered 304 Not Modified).
+        """
+        if self.url is None:
+            raise ValueError("Catalog has no upstream URL")
+        headers = {}
+        if self.meta.get("etag"):
+            headers["If-None-Match"] = self.meta["etag"]
+        if self.meta.get("last_modified"):
+            headers["If-Modified-Since"] = self.meta["last_modified"]
+
+        with requests.get(self.url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                return _empty_delta()
+            if response.status_code != 200:
+                raise ValueError(f"Failed to fetch TLE data from {self.url}")
+            delta = self.apply(iter_tle(response.iter_lines(decode_unicode=True), strict=False, validate=False),
+                               full=True)
+            self.meta = {"etag": response.headers.get("ETag"),
+                         "last_modified": response.headers.get("Last-Modified")}
+        if len(delta.changed) or len(delta.added) or len(delta.removed) or not os.path.exists(self.path):
+            self.save()
+        else:
+            self._save_meta()
+        return delta
+
+    def save(self):
+        """
+        Atomically rewrite the local catalog file and its metadata.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for name, line1, line2 in zip(self.records["name"], self.records["line1"], self.records["line2"]):
+                    f.write(f"{name}\n{line1.decode()}\n{line2.decode()}\n")
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._save_meta()
+
+    def _save_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump(self.meta, f)
+
+
+def refresh_positions(catalog, delta, positions, time_step, start_time, backend="numpy", cache=None):
+    """
+    Bring a positions array computed for the previous catalog up to date after a refresh.
+    Rows of removed satellites are dropped and only the changed and added rows are propagated again;
+    every other row is copied over.
+    :param catalog: TLECatalog after refresh().
+    :param delta: CatalogDelta returned by refresh() or apply().
+    :param positions: Array of shape [old_num_satellites, num_steps, 2] for the same time grid.
+    :param time_step: Time interval between steps (in seconds).
+    :param start_time: datetime of the first step the positions were computed for.
+    :param backend: Propagation backend name.
+    :param cache: Optional EphemerisCache, the updated array is stored under the new catalog key.
+    :return: Array of shape [len(catalog), num_steps, 2].
+    """
+    num_steps = positions.shape[1]
+    rows = np.concatenate((delta.changed, delta.added))
+    if len(rows) == 0 and len(delta.removed_rows) == 0 and len(positions) == len(catalog):
+        return positions
+
+    kept = np.delete(np.arange(len(positions)), delta.removed_rows)
+    updated = np.empty((len(catalog), num_steps, 2))
+    updated[:len(kept)] = positions[kept]
+    if len(rows):
+        updated[rows] = propagation.BACKENDS[backend](catalog.records[rows], time_step, num_steps, start_time)
+    if cache is not None:
+        cache.store(cache_key(catalog.records, start_time, time_step, num_steps, backend), updated)
+    return updated
@@ -1,28 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from satellites import fetch_tle_data, generate_dynamic_satellite_positions, calculate_latency, calculate_synchronization
-
-
-def find_best_satellite(user_lat, user_lon, sat_lats, sat_longs, k=3):
-    """
-    Find the best satellite for a user based on latency and synchronization.
-    """
-    distances = np.sqrt((sat_lats - user_lat) ** 2 + (sat_longs - user_lon) ** 2)
-    closest_indices = np.argsort(distances)[:k]
-
-    best_satellite = None
-    min_cost = float('inf')
-
-    for idx in closest_indices:
-        latency = calculate_latency(user_lat, user_lon, sat_lats[idx], sat_longs[idx])
-        sync_cost = calculate_synchronization(user_lat, user_lon, sat_lats[idx], sat_longs[idx])
-        cost = 0.7 * latency + 0.3 * sync_cost
-        if cost < min_cost:
-            min_cost = cost
-            best_satellite = idx
-
-    return best_satellite
+from assignment import assign_users
+from ephemeris_cache import EphemerisCache
+from rendering import LinkRenderer
+from satellites import fetch_tle_data, generate_dynamic_satellite_positions, pinned_start_time
 
 
 # Parameters
@@ -30,51 +11,25 @@ num_satellites = 30
 num_users = 20
 num_steps = 100
 k_nearest = 3
+output_path = None  # e.g. "links.mp4" or "frames/links_%05d.png" to render without a window
+output_fps = 10
 
 TLE_URL = "https://www.celestrak.com/NORAD/elements/stations.txt"
 tle_data = fetch_tle_data(TLE_URL, num_satellites)
-satellite_positions = generate_dynamic_satellite_positions(tle_data, num_steps)
+satellite_positions = generate_dynamic_satellite_positions(tle_data, num_steps, start_time=pinned_start_time(),
+                                                           cache=EphemerisCache())
 
 user_latitudes = np.random.uniform(-90, 90, num_users)
 user_longitudes = np.random.uniform(-180, 180, num_users)
-
-fig, ax = plt.subplots(figsize=(10, 6))
-satellite_scatter = ax.scatter([], [], color='red', label='Satellites', alpha=0.6)
-user_scatter = ax.scatter(user_longitudes, user_latitudes, color='blue', label='Users', alpha=0.6)
-line_segments = []
-
-ax.set_xlim(-180, 180)
-ax.set_ylim(-90, 90)
-ax.set_xlabel('Longitude')
-ax.set_ylabel('Latitude')
-ax.set_title('Dynamic Satellite and User Assignments Over Time')
-ax.legend(loc='upper left')
-ax.grid(True)
-
-def update(frame):
-    global line_segments
-    for line in line_segments:
-        line.remove()
-    line_segments = []
-
-    sat_lats = satellite_positions[:, frame, 0]
-    sat_longs = satellite_positions[:, frame, 1]
-    satellite_scatter.set_offsets(np.c_[sat_longs, sat_lats])
-
-    for i in range(num_users):
-        user_lat = user_latitudes[i]
-        user_lon = user_longitudes[i]
-
-        best_satellite_idx = find_best_satellite(user_lat, user_lon, sat_lats, sat_longs, k=k_nearest)
-
-        # Draw a line connecting the user to the best satellite
-        line = ax.plot([user_lon, sat_longs[best_satellite_idx]],
-                       [user_lat, sat_lats[best_satellite_idx]],
-                       color='green', lw=0.5, alpha=0.7)[0]
-        line_segments.append(line)
-
-    return satellite_scatter, user_scatter, *line_segments
-
-
-ani = FuncAnimation(fig, update, frames=num_steps, interval=500, blit=False)
-plt.show()
+users = np.c_[user_latitudes, user_longitudes]
+
+# Best satellite of every user at every step, scored 0.7 * latency + 0.3 * synchronization over the k nearest
+assignments, _ = assign_users(users, satellite_positions, k_nearest, latency_weight=0.7, synchronization_weight=0.3)
+renderer = LinkRenderer(users, satellite_positions, assignments,
+                        title='Dynamic Satellite and User Assignments Over Time')
+
+if output_path:
+    renderer.save(output_path, fps=output_fps)
+else:
+    ani = renderer.animate(interval=500)
+    plt.show()
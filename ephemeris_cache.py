@@ -0,0 +1,127 @@
+import datetime
+import hashlib
+import os
+import tempfile
+import numpy as np
+from tle import tle_lines
+
+DEFAULT_CACHE_DIR = os.environ.get("SATELLITES_EPHEMERIS_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "satellites_project"))
+DEFAULT_MAX_BYTES = 4 << 30  # 4 GiB
+
+
+def cache_key(tle_data, start_time, time_step, num_steps, backend="numpy"):
+    """
+    Hash everything that determines a propagated positions array.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param start_time: datetime of the first step.
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param backend: Propagation backend name.
+    :return: Hex digest used as the cache file name.
+    """
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    digest = hashlib.sha256()
+    digest.update(f"{backend}|{start_time.isoformat()}|{float(time_step)!r}|{int(num_steps)}\n".encode())
+    for tle_line1, tle_line2 in tle_lines(tle_data):
+        digest.update(tle_line1.strip().encode())
+        digest.update(b"\n")
+        digest.update(tle_line2.strip().encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class EphemerisCache:
+    """
+    Persistent cache of propagated positions stored as .npy files.
+    Hits are opened with np.load(mmap_mode='r') so several processes share one copy through
+    the page cache. The directory is kept under max_bytes by evicting the least recently used
+    entries; a hit refreshes the file's mtime, which is what the LRU order is based on.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def load(self, key):
+        """
+        Open a cached positions array.
+        :param key: Key returned by cache_key.
+        :return: Read-only memory-mapped array, or None on a miss.
+        """
+        path = self.path(key)
+        try:
+            positions = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Evicted by another process in the meantime, the mapping stays valid
+        return positions
+
+    def store(self, key, positions):
+        """
+        Write a positions array atomically, then evict old entries if over budget.
+        :param key: Key returned by cache_key.
+        :param positions: Array to cache.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(positions))
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        :return: List of (mtime, size, path) for every cached array, oldest first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+        Open memory maps of deleted files keep working until they are closed.
+        :param keep: Key that must survive, typically the entry that was just written.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        keep_path = self.path(keep) if keep is not None else None
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
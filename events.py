@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import time
+import numpy as np
+from batch_allocation import IncrementalAllocator
+from paths import DEFAULT_K_PATHS
+from session_information import SessionTable
+from topology import snapshot_edges
+
+# Event kinds, in the order they are handled when they share a timestamp
+DEPARTURE = 0
+ARRIVAL = 1
+TICK = 2
+HANDOVER = 3
+EVENT_NAMES = {DEPARTURE: "departure", ARRIVAL: "arrival", TICK: "tick", HANDOVER: "handover"}
+
+
+class EventSimulator:
+    """
+    Discrete-event simulation of the session lifecycle over a time-varying constellation.
+    A session arrives at the create_time of its first user and departs `duration` seconds later.
+    Every tick_interval seconds a re-optimization tick refreshes the k-central set of the active
+    sessions (find_k_central) and runs the IncrementalAllocator on them: new arrivals get a relay,
+    sessions whose paths broke or whose relay left cu_set are re-routed, the rest keep theirs.
+    Each relay change is then applied by a HANDOVER event (switch_relay) handover_delay seconds
+    later. All events go through one heapq ordered by (time, kind, sequence).
+    Ground node convention: user row r of the SessionTable is graph node num_satellites + r, so the
+    topology must be built with ground_points=sessions.users.locations().
+    """
+
+    def __init__(self, sessions, topology, satellite_positions, start_time, time_step, antenna, isl_max,
+                 tick_interval=60, duration=1800.0, handover_delay=0.0, seed=None, k=3,
+                 k_paths=DEFAULT_K_PATHS, method="greedy"):
+        """
+        :param sessions: SessionTable (a list of session objects is converted).
+        :param topology: ConstellationTopology over the simulated steps, with the users as ground points.
+        :param satellite_positions: Array [num_satellites, num_steps, 2 (lat, lon)] of the same steps.
+        :param start_time: Timestamp (seconds, same clock as create_time) of step 0.
+        :param time_step: Seconds between steps.
+        :param antenna: Antennas per satellite.
+        :param isl_max: Capacity of an idle ISL.
+        :param tick_interval: Seconds between re-optimization ticks.
+        :param duration: Session durations in seconds: array [num_sessions], or the mean of an
+                         exponential draw.
+        :param handover_delay: Seconds between a relay decision and its switch_relay.
+        :param seed: Seed for the duration draw.
+        :param k: Size of the k-central relay set.
+        :param k_paths: Candidate paths per (user, relay).
+        :param method: allocate_sessions method.
+        """
+        if not isinstance(sessions, SessionTable):
+            sessions = SessionTable.from_sessions(sessions)
+        self.sessions = sessions
+        self.topology = topology
+        self.satellite_positions = satellite_positions
+        self.start_time = start_time
+        self.time_step = time_step
+        self.antenna = antenna
+        self.isl_max = isl_max
+        self.tick_interval = tick_interval
+        self.handover_delay = handover_delay
+        self.k = k
+        self.k_paths = k_paths
+        self.method = method
+        self.end_time = start_time + topology.num_steps * time_step
+
+        self.arrival = sessions.reduce(np.minimum, sessions.users.create_time, np.iinfo(np.int64).max)
+        if np.ndim(duration) == 0:
+            duration = np.random.default_rng(seed).exponential(duration, len(sessions))
+        self.departure = self.arrival + np.asarray(duration, dtype=float)
+        self.user_nodes = [(topology.num_satellites + np.arange(sessions.offsets[i], sessions.offsets[i + 1])).tolist()
+                           for i in range(len(sessions))]
+
+        self.queue = []
+        self.sequence = itertools.count()
+        self.active = set()
+        self.allocator = None
+        self.snapshot = None
+        self.step = None
+        self.counts = dict.fromkeys(EVENT_NAMES.values(), 0)
+        self.counts.update(attached=0, dropped=0, allocated_sessions=0)
+        self.allocation_seconds = 0.0
+
+    def schedule(self, when, kind, row=None):
+        heapq.heappush(self.queue, (when, kind, next(self.sequence), row))
+
+    def _step_at(self, when):
+        return int(min((when - self.start_time) // self.time_step, self.topology.num_steps - 1))
+
+    def _advance_topology(self, when):
+        step = self._step_at(when)
+        if step == self.step:
+            return
+        previous = None if self.snapshot is None else snapshot_edges(self.snapshot)
+        self.snapshot = self.topology.snapshot(step, previous)
+        if self.allocator is None:
+            self.allocator = IncrementalAllocator(self.snapshot, self.topology.num_satellites, self.antenna,
+                                                  self.isl_max, self.k_paths, self.method)
+        else:
+            self.allocator.advance(self.snapshot)
+        self.step = step
+
+    def _tick(self, when):
+        self._advance_topology(when)
+        rows = sorted(self.active)
+        views = [self.sessions[row] for row in rows]
+        self.sessions.find_k_central(self.satellite_positions, self.step, self.k, rows)
+        reroute = []
+        for view in views:
+            if view.current_relay is not None and view.current_relay not in view.cu_set:
+                reroute.append(view.id)
+        started = time.perf_counter()
+        stats = self.allocator.allocate(views, [self.user_nodes[row] for row in rows], reroute, switch=False)
+        self.allocation_seconds += time.perf_counter() - started
+        self.counts["allocated_sessions"] += stats["batch"]["sessions"]
+        for row, view in zip(rows, views):
+            if view.best_relay != view.current_relay:
+                self.schedule(when + self.handover_delay, HANDOVER, row)
+
+    def _handover(self, row):
+        view = self.sessions[row]
+        if row not in self.active or view.best_relay == view.current_relay:
+            return
+        if view.current_relay is None:
+            self.counts["attached"] += 1
+        elif view.best_relay is None:
+            self.counts["dropped"] += 1
+        else:
+            self.counts["handover"] += 1
+        view.switch_relay()
+
+    def run(self, until=None):
+        """
+        Process events until the queue is empty or `until` (timestamp; default: end of the topology).
+        :return: Dict of statistics: event counts, attached / dropped / handover counts,
+                 allocated_sessions, allocation_seconds, sessions_per_s (allocation throughput),
+                 handover_rate (handovers per active-session hour) and wall seconds.
+        """
+        until = self.end_time if until is None else until
+        for row in np.nonzero(self.arrival < until)[0]:
+            self.schedule(float(self.arrival[row]), ARRIVAL, int(row))
+        first = max(self.start_time, float(self.arrival.min())) if len(self.arrival) else self.start_time
+        self.schedule(self.start_time + np.ceil((first - self.start_time) / self.tick_interval) * self.tick_interval,
+                      TICK)
+
+        started = time.perf_counter()
+        session_seconds = 0.0
+        last_time = None
+        while self.queue and self.queue[0][0] < until:
+            when, kind, _, row = heapq.heappop(self.queue)
+            if last_time is not None:
+                session_seconds += len(self.active) * (when - last_time)
+            last_time = when
+            if kind == ARRIVAL:
+                self.counts["arrival"] += 1
+                self.active.add(row)
+                self.schedule(float(self.departure[row]), DEPARTURE, row)
+            elif kind == DEPARTURE:
+                self.counts["departure"] += 1
+                self.active.discard(row)
+                self.sessions[row].best_relay = None
+                self.sessions[row].switch_relay()
+            elif kind == TICK:
+                self.counts["tick"] += 1
+                self._tick(when)
+                self.schedule(when + self.tick_interval, TICK)
+            else:
+                self._handover(row)
+
+        stats = dict(self.counts)
+        stats["allocation_seconds"] = self.allocation_seconds
+        stats["sessions_per_s"] = (self.counts["allocated_sessions"] / self.allocation_seconds
+                                   if self.allocation_seconds > 0 else 0.0)
+        stats["handover_rate"] = self.counts["handover"] / (session_seconds / 3600) if session_seconds > 0 else 0.0
+        stats["seconds"] = time.perf_counter() - started
+        return stats
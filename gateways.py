@@ -0,0 +1,194 @@
+import itertools
+import numpy as np
+from scipy.spatial import cKDTree
+from geometry import geodetic_to_ecef, latlon_to_unit
+from positions import PositionTensor
+from satellites import DEFAULT_SATELLITE_ALTITUDE_KM
+from spatial_index import angle_to_chord
+from visibility import coverage_angle
+
+DEFAULT_GATEWAY_ANTENNA = 8
+DEFAULT_BACKHAUL = 1000.0
+DEFAULT_CSL_MAX = 100.0
+
+
+class GatewayNetwork:
+    """
+    Ground stations (gateways) reachable over satellite-to-ground links (CSLs).
+    Gateway g is graph node first_node + g, after the satellites and any other ground nodes (users).
+    Capacity follows the allocation rules for satellites: a path takes one gateway antenna where it
+    starts or ends at a gateway (two when passing through one), `bandwidth` of the gateway's backhaul,
+    and `bandwidth` on every CSL it uses; a CSL or backhaul needs more than `bandwidth` left.
+    Idle CSLs are not stored, so memory follows the links in use rather than satellites x gateways.
+    Visible gateways per satellite per step are precomputed by build_visibility into a CSR lookup.
+    """
+
+    def __init__(self, locations, satellite_num, first_node=None, antenna=DEFAULT_GATEWAY_ANTENNA,
+                 backhaul=DEFAULT_BACKHAUL, csl_max=DEFAULT_CSL_MAX, names=None):
+        """
+        :param locations: Array [num_gateways, 2 (lat, lon)].
+        :param satellite_num: Number of satellites (node ids below it are satellites).
+        :param first_node: Graph node of gateway 0 (default satellite_num, i.e. no other ground nodes).
+        :param antenna: Antennas per gateway (scalar or [num_gateways]).
+        :param backhaul: Backhaul capacity per gateway (scalar or [num_gateways]).
+        :param csl_max: Capacity of an idle CSL.
+        :param names: Optional gateway names.
+        """
+        self.locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        num_gateways = len(self.locations)
+        self.satellite_num = satellite_num
+        self.first_node = satellite_num if first_node is None else first_node
+        if self.first_node < satellite_num:
+            raise ValueError(f"Gateway nodes must come after the {satellite_num} satellites, got {self.first_node}")
+        self.antenna_total = np.broadcast_to(np.asarray(antenna, dtype=np.int64), (num_gateways,)).copy()
+        self.antenna = self.antenna_total.copy()
+        self.backhaul_total = np.broadcast_to(np.asarray(backhaul, dtype=float), (num_gateways,)).copy()
+        self.backhaul = self.backhaul_total.copy()
+        self.csl_max = csl_max
+        self.csl = {}  # (satellite, gateway) -> remaining capacity, CSLs carrying traffic only
+        self.names = list(names) if names is not None else [f"GW-{g}" for g in range(num_gateways)]
+        self.ecef = geodetic_to_ecef(self.locations[:, 0], self.locations[:, 1]).reshape(-1, 3)
+        self.tree = cKDTree(latlon_to_unit(self.locations[:, 0], self.locations[:, 1]).reshape(-1, 3))
+        self.visible_offsets = None
+        self.visible_gateways = None
+
+    def __len__(self):
+        return len(self.locations)
+
+    @property
+    def num_nodes(self):
+        return self.first_node + len(self)
+
+    def gateway(self, node):
+        """
+        :return: Gateway index of a graph node, or -1 if the node is not a gateway.
+        """
+        g = node - self.first_node
+        return g if 0 <= g < len(self) else -1
+
+    def build_visibility(self, satellite_positions, sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM, elevation_mask=10.0):
+        """
+        Precompute the gateways above the elevation mask of every satellite at every step.
+        Each step is one ball query of all satellites against the (static) gateway tree, with the
+        footprint of each satellite as radius, so the cost follows the visible pairs.
+        :param satellite_positions: Array [num_satellites, num_steps, 2 (lat, lon)], or a PositionTensor
+                                    (whose altitudes are used instead of sat_alt).
+        :param sat_alt: Satellite altitude in km (scalar or [num_satellites]).
+        :param elevation_mask: Minimum elevation in degrees for a CSL.
+        """
+        if isinstance(satellite_positions, PositionTensor):
+            num_satellites, num_steps = satellite_positions.num_satellites, satellite_positions.num_steps
+            frame = lambda t: satellite_positions.frame(t).astype(float)
+            altitude = lambda t: satellite_positions.altitude[t].astype(float)
+        else:
+            num_satellites, num_steps = satellite_positions.shape[:2]
+            frame = lambda t: latlon_to_unit(satellite_positions[:, t, 0], satellite_positions[:, t, 1])
+            altitude = lambda t: np.broadcast_to(np.asarray(sat_alt, dtype=float), (num_satellites,))
+        if num_satellites != self.satellite_num:
+            raise ValueError(f"Positions cover {num_satellites} satellites, the network expects {self.satellite_num}")
+        counts = np.zeros(num_steps * num_satellites, dtype=np.intp)
+        gateways = []
+        for t in range(num_steps):
+            radius = angle_to_chord(np.degrees(coverage_angle(altitude(t), elevation_mask)))
+            hits = self.tree.query_ball_point(frame(t), radius, return_sorted=True)
+            counts[t * num_satellites:(t + 1) * num_satellites] = [len(hit) for hit in hits]
+            gateways.append(np.fromiter(itertools.chain.from_iterable(hits), dtype=np.int32))
+        self.visible_offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+        np.cumsum(counts, out=self.visible_offsets[1:])
+        self.visible_gateways = np.concatenate(gateways) if gateways else np.zeros(0, dtype=np.int32)
+        self.num_steps = num_steps
+
+    def visible(self, satellite, step):
+        """
+        :return: Sorted gateway indices visible from a satellite at a step (see build_visibility).
+        """
+        if self.visible_offsets is None:
+            raise ValueError("Gateway visibility has not been built, call build_visibility first")
+        row = step * self.satellite_num + satellite
+        return self.visible_gateways[self.visible_offsets[row]:self.visible_offsets[row + 1]]
+
+    def csl_edges(self, step):
+        """
+        :return: Array [n, 2] of (satellite, gateway node) CSLs available at a step.
+        """
+        if self.visible_offsets is None:
+            raise ValueError("Gateway visibility has not been built, call build_visibility first")
+        rows = slice(step * self.satellite_num, (step + 1) * self.satellite_num + 1)
+        offsets = self.visible_offsets[rows]
+        satellites = np.repeat(np.arange(self.satellite_num), np.diff(offsets))
+        nodes = self.first_node + self.visible_gateways[offsets[0]:offsets[-1]].astype(np.intp)
+        return np.stack((satellites, nodes), axis=1)
+
+    def _usage(self, path):
+        """
+        :return: Tuple (gateways, antenna demand, CSLs as (satellite, gateway)) of a path.
+        """
+        last = len(path) - 1
+        gateways, demand, links = [], [], []
+        for position, node in enumerate(path):
+            g = self.gateway(int(node))
+            if g < 0:
+                continue
+            gateways.append(g)
+            demand.append(1 if position == 0 or position == last else 2)
+            for neighbour_position in (position - 1, position + 1):
+                if 0 <= neighbour_position <= last and path[neighbour_position] < self.satellite_num:
+                    links.append((int(path[neighbour_position]), g))
+        return gateways, demand, links
+
+    def fits(self, path, bandwidth):
+        """
+        :return: True if the gateways and CSLs of a path can carry bandwidth (always True without gateways).
+        """
+        gateways, demand, links = self._usage(path)
+        for g, need in zip(gateways, demand):
+            if self.antenna[g] < need or self.backhaul[g] <= bandwidth:
+                return False
+        for link in links:
+            if self.csl.get(link, self.csl_max) <= bandwidth:
+                return False
+        return True
+
+    def feasible(self, paths, bandwidth):
+        """
+        :param bandwidth: Scalar or [len(paths)].
+        :return: Boolean array [len(paths)], see fits.
+        """
+        bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=float), (len(paths),))
+        return np.fromiter((self.fits(path, bw) for path, bw in zip(paths, bandwidth)), dtype=bool,
+                           count=len(paths))
+
+    def _apply(self, path, bandwidth, sign):
+        gateways, demand, links = self._usage(path)
+        for g, need in zip(gateways, demand):
+            self.antenna[g] += sign * need
+            self.backhaul[g] += sign * bandwidth
+        for link in links:
+            remaining = self.csl.get(link, self.csl_max) + sign * bandwidth
+            if remaining == self.csl_max:
+                self.csl.pop(link, None)
+            else:
+                self.csl[link] = remaining
+        return gateways, links
+
+    def reserve(self, path, bandwidth):
+        """
+        Take the gateway antennas, backhaul and CSL capacity of a path, all or nothing.
+        :return: True if reserved; False (network untouched) if the path does not fit.
+        """
+        if not self.fits(path, bandwidth):
+            return False
+        self._apply(path, bandwidth, -1)
+        return True
+
+    def release(self, path, bandwidth):
+        """
+        Give back what reserve(path, bandwidth) took.
+        Raises ValueError (network untouched) if that would exceed the initial capacity.
+        """
+        gateways, links = self._apply(path, bandwidth, 1)
+        if ((self.antenna[gateways] > self.antenna_total[gateways]).any()
+                or (self.backhaul[gateways] > self.backhaul_total[gateways]).any()
+                or any(self.csl.get(link, self.csl_max) > self.csl_max for link in links)):
+            self._apply(path, bandwidth, -1)
+            raise ValueError(f"Releasing {path} exceeds the gateway capacity, it was not reserved")
@@ -0,0 +1,166 @@
+import datetime
+import numpy as np
+
+# WGS84 ellipsoid, used for everything that touches the ground
+EARTH_RADIUS_KM = 6378.137
+EARTH_FLATTENING = 1 / 298.257223563
+EARTH_E2 = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+EARTH_ROTATION_RAD_S = 7.292115146706979e-5
+
+SPEED_OF_LIGHT_KM_S = 299792.458
+
+J2000_JD = 2451545.0
+UNIX_EPOCH_JD = 2440587.5
+
+
+def datetime_to_jd(when):
+    """
+    Convert a datetime to a Julian date (UTC).
+    :param when: datetime.datetime, naive values are treated as UTC.
+    :return: Julian date as float.
+    """
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    seconds = (when - when.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+    ordinal = when.toordinal()  # 0001-01-01 is day 1
+    return ordinal + 1721424.5 + seconds / 86400.0
+
+
+def gmst(jd_ut1):
+    """
+    Greenwich mean sidereal time (IAU-82), vectorized.
+    :param jd_ut1: Julian date(s) in UT1 (UTC is close enough here).
+    :return: GMST angle(s) in radians, wrapped to [0, 2*pi).
+    """
+    tut1 = (np.asarray(jd_ut1, dtype=float) - J2000_JD) / 36525.0
+    seconds = (-6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2
+               + (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+    return np.mod(np.radians(seconds / 240.0), 2 * np.pi)
+
+
+def latlon_to_unit(lat, lon):
+    """
+    Convert latitude/longitude in degrees to unit vectors on the sphere.
+    :param lat: Latitude(s) in degrees.
+    :param lon: Longitude(s) in degrees.
+    :return: Array of shape lat.shape + (3,).
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+def unit_to_latlon(vectors):
+    """
+    Convert (not necessarily normalized) vectors to spherical latitude/longitude.
+    :param vectors: Array of shape [..., 3].
+    :return: Tuple (lat, lon) in degrees, lon in [-180, 180].
+    """
+    vectors = np.asarray(vectors, dtype=float)
+    x, y, z = vectors[..., 0], vectors[..., 1], vectors[..., 2]
+    lat = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    lon = np.degrees(np.arctan2(y, x))
+    return lat, lon
+
+
+def geodetic_to_ecef(lat, lon, alt=0.0):
+    """
+    Convert geodetic coordinates to ECEF on the WGS84 ellipsoid.
+    :param lat: Geodetic latitude(s) in degrees.
+    :param lon: Longitude(s) in degrees.
+    :param alt: Height(s) above the ellipsoid in km.
+    :return: Array of shape broadcast(lat, lon, alt).shape + (3,), in km.
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    n = EARTH_RADIUS_KM / np.sqrt(1 - EARTH_E2 * sin_lat ** 2)
+    x = (n + alt) * cos_lat * np.cos(lon)
+    y = (n + alt) * cos_lat * np.sin(lon)
+    z = (n * (1 - EARTH_E2) + alt) * sin_lat
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+
+
+def ecef_to_geodetic(x, y, z, iterations=3):
+    """
+    Convert ECEF coordinates to geodetic latitude, longitude and height (WGS84).
+    :param x: ECEF x in km.
+    :param y: ECEF y in km.
+    :param z: ECEF z in km.
+    :param iterations: Number of fixed-point iterations on the latitude.
+    :return: Tuple (lat, lon, alt) with angles in degrees and alt in km.
+    """
+    r = np.hypot(x, y)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2(z, r * (1 - EARTH_E2))
+    # A fixed iteration count keeps the result independent of how inputs are chunked
+    for _ in range(iterations):
+        sin_lat = np.sin(lat)
+        n = EARTH_RADIUS_KM / np.sqrt(1 - EARTH_E2 * sin_lat ** 2)
+        lat = np.arctan2(z + EARTH_E2 * n * sin_lat, r)
+    sin_lat = np.sin(lat)
+    n = EARTH_RADIUS_KM / np.sqrt(1 - EARTH_E2 * sin_lat ** 2)
+    cos_lat = np.cos(lat)
+    # Use whichever formula is well conditioned at this latitude
+    alt = np.where(np.abs(cos_lat) > 1e-6,
+                   r / np.where(np.abs(cos_lat) > 1e-6, cos_lat, 1.0) - n,
+                   np.abs(z) - n * (1 - EARTH_E2))
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+def spherical_to_ecef(lat, lon, alt=0.0):
+    """
+    Place points given in spherical (geocentric) latitude/longitude at a height above the
+    equatorial radius. This matches the sub-satellite points produced by the propagators.
+    :param lat: Geocentric latitude(s) in degrees.
+    :param lon: Longitude(s) in degrees.
+    :param alt: Height(s) in km.
+    :return: Array of shape broadcast(lat, lon, alt).shape + (3,), in km.
+    """
+    lat, lon, alt = np.broadcast_arrays(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float),
+                                        np.asarray(alt, dtype=float))
+    return latlon_to_unit(lat, lon) * (EARTH_RADIUS_KM + alt)[..., None]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle angle between two sets of points, broadcastable.
+    :return: Central angle(s) in radians.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def look_geometry(user_lat, user_lon, sat_lat, sat_lon, sat_alt, user_alt=0.0):
+    """
+    Slant range and elevation of satellites seen from ground points, broadcastable.
+    :param user_lat: Geodetic latitude(s) of the ground point in degrees.
+    :param user_lon: Longitude(s) of the ground point in degrees.
+    :param sat_lat: Sub-satellite latitude(s) in degrees.
+    :param sat_lon: Sub-satellite longitude(s) in degrees.
+    :param sat_alt: Satellite height(s) in km.
+    :param user_alt: Ground point height(s) in km.
+    :return: Tuple (slant_range_km, elevation_deg).
+    """
+    return look_geometry_ecef(user_lat, user_lon, spherical_to_ecef(sat_lat, sat_lon, sat_alt), user_alt)
+
+
+def look_geometry_ecef(user_lat, user_lon, sat_ecef, user_alt=0.0):
+    """
+    look_geometry for satellites given as Earth-fixed positions, broadcastable.
+    :param user_lat: Geodetic latitude(s) of the ground point in degrees.
+    :param user_lon: Longitude(s) of the ground point in degrees.
+    :param sat_ecef: Satellite position(s) in km, shape [..., 3].
+    :param user_alt: Ground point height(s) in km.
+    :return: Tuple (slant_range_km, elevation_deg).
+    """
+    ground = geodetic_to_ecef(user_lat, user_lon, user_alt)
+    line_of_sight = np.asarray(sat_ecef, dtype=float) - ground
+    slant_range = np.sqrt(np.sum(line_of_sight ** 2, axis=-1))
+    # Local vertical is the ellipsoid normal, i.e. the unit vector at the geodetic latitude
+    up = latlon_to_unit(np.asarray(user_lat, dtype=float), np.asarray(user_lon, dtype=float))
+    sin_elevation = np.sum(line_of_sight * up, axis=-1) / np.maximum(slant_range, 1e-9)
+    return slant_range, np.degrees(np.arcsin(np.clip(sin_elevation, -1, 1)))
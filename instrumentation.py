@@ -0,0 +1,201 @@
+import cProfile
+import functools
+import json
+import math
+import os
+import time
+from collections import defaultdict
+
+# Instrumentation is decided when the instrumented modules are imported: set the environment
+# variable (or call enable() before importing them) to get timers; otherwise every decorator
+# returns the function unchanged and counters are skipped behind a single flag check.
+ENABLED = os.environ.get("SATELLITES_INSTRUMENT", "") not in ("", "0")
+
+
+def enable(enabled=True):
+    """
+    Switch instrumentation on or off. Functions decorated with timed() before this call keep the
+    state they were defined with; counters and stages follow the new state immediately.
+    """
+    global ENABLED
+    ENABLED = enabled
+
+
+class Recorder:
+    """
+    Stage timers, counters and log2-bucket histograms of one run.
+    Stage timings nest: every timed call records its self time under the ';'-joined stack of
+    enclosing stages, which is the collapsed-stack format flamegraph tools read.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(lambda: {"count": 0, "sum": 0.0, "min": math.inf, "max": -math.inf,
+                                               "buckets": defaultdict(int)})
+        self.stacks = defaultdict(float)
+        self._stack = []
+        self._child_seconds = []
+
+    def enter(self, name):
+        self._stack.append(name)
+        self._child_seconds.append(0.0)
+        return time.perf_counter()
+
+    def exit(self, name, started):
+        elapsed = time.perf_counter() - started
+        children = self._child_seconds.pop()
+        self.stacks[";".join(self._stack)] += elapsed - children
+        self._stack.pop()
+        if self._child_seconds:
+            self._child_seconds[-1] += elapsed
+        # Recursive calls only count once towards the stage total
+        if name not in self._stack:
+            self.seconds[name] += elapsed
+        self.calls[name] += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, value):
+        histogram = self.histograms[name]
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["min"] = min(histogram["min"], value)
+        histogram["max"] = max(histogram["max"], value)
+        histogram["buckets"][math.frexp(value)[1] if value > 0 else 0] += 1
+
+    def summary(self):
+        """
+        :return: Dict with "stages" (calls, seconds, mean_ms, share of the recorded time; slowest first),
+                 "counters" and "histograms" (count, mean, min, max and power-of-two buckets).
+        """
+        top_level = sum(seconds for stack, seconds in self.stacks.items()) or 1.0
+        stages = {name: {"calls": self.calls[name], "seconds": self.seconds[name],
+                         "mean_ms": 1000 * self.seconds[name] / self.calls[name],
+                         "share": self.seconds[name] / top_level}
+                  for name in sorted(self.seconds, key=self.seconds.get, reverse=True)}
+        histograms = {name: {"count": h["count"], "mean": h["sum"] / h["count"], "min": h["min"], "max": h["max"],
+                             "buckets": {f"<{2 ** b:g}": n for b, n in sorted(h["buckets"].items())}}
+                      for name, h in self.histograms.items()}
+        return {"stages": stages, "counters": dict(self.counters), "histograms": histograms}
+
+    def report(self):
+        """
+        :return: Human-readable per-stage table plus counters and histograms.
+        """
+        summary = self.summary()
+        lines = [f"{'stage':<40}{'calls':>10}{'total s':>12}{'mean ms':>12}{'share':>8}"]
+        for name, stage in summary["stages"].items():
+            lines.append(f"{name:<40}{stage['calls']:>10}{stage['seconds']:>12.4f}{stage['mean_ms']:>12.4f}"
+                         f"{stage['share']:>8.1%}")
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<40}{value:>10}")
+        for name, h in sorted(summary["histograms"].items()):
+            lines.append(f"{name:<40}{h['count']:>10}  mean {h['mean']:.3g}  min {h['min']:.3g}  max {h['max']:.3g}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+        """
+        Write stage self times as collapsed stacks (microseconds), e.g. for flamegraph.pl or speedscope.
+        """
+        with open(path, "w") as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                f.write(f"{stack} {max(int(seconds * 1e6), 0)}\n")
+
+
+RECORDER = Recorder()
+
+
+def timed(name):
+    """
+    Decorator recording calls and wall time of a function under a stage name.
+    Returns the function itself when instrumentation is disabled at decoration time.
+    """
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = RECORDER.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                RECORDER.exit(name, started)
+        return wrapper
+    return decorate
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = RECORDER.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        RECORDER.exit(self.name, self.started)
+        return False
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """
+    Context manager timing a block as a stage (a shared no-op when disabled).
+    """
+    return _Stage(name) if ENABLED else _NO_STAGE
+
+
+def count(name, amount=1):
+    if ENABLED:
+        RECORDER.count(name, amount)
+
+
+def observe(name, value):
+    if ENABLED:
+        RECORDER.observe(name, value)
+
+
+def profile_run(function, *args, output_dir=None, cprofile=False, **kwargs):
+    """
+    Run one simulation (any callable) with a fresh recorder and export its profile.
+    :param function: Callable to run, e.g. lambda: list(simulate(...)).
+    :param output_dir: Optional directory receiving summary.json, stages.collapsed and, with
+                       cprofile=True, run.prof (readable by pstats, snakeviz, flameprof...).
+    :param cprofile: Also run under cProfile (function-level, adds overhead).
+    :return: Tuple (function result, summary dict).
+    """
+    RECORDER.reset()
+    profiler = cProfile.Profile() if cprofile else None
+    with stage("run"):
+        if profiler is not None:
+            result = profiler.runcall(function, *args, **kwargs)
+        else:
+            result = function(*args, **kwargs)
+    summary = RECORDER.summary()
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=1)
+        RECORDER.write_collapsed(os.path.join(output_dir, "stages.collapsed"))
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(output_dir, "run.prof"))
+    return result, summary
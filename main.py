@@ -1,46 +1,10 @@
-import random
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-from users_information import user
-from session_information import session
-from satellites import fetch_multiple_tle_from_url, generate_satellite_positions
-
-def generate_sessions(num_sessions, max_users_per_session):
-    """
-    Generate a list of session objects with randomized users.
-    :param num_sessions: Number of sessions to generate.
-    :param max_users_per_session: Maximum number of users in a single session.
-    :return: A list of session instances.
-    """
-    sessions = []
-    user_id = 0  # Counter for unique user IDs
-
-    for session_id in range(num_sessions):
-        # Create a new session
-        new_session = session(session_id)
-
-        # Determine how many users are in this session
-        num_users = random.randint(1, max_users_per_session)
-
-        # Generate and add users to the session
-        for _ in range(num_users):
-            # Randomized user attributes
-            city = random.choice(["New York", "Los Angeles", "London", "Tokyo", "Paris"])
-            latitude = random.uniform(-90, 90)  # Latitude range
-            longitude = random.uniform(-180, 180)  # Longitude range
-            create_time = random.randint(1609459200, 1672444800)  # Random timestamp (2021-2023)
-            user_session_id = session_id  # Users inherit session ID
-
-            # Create a user and add them to the session
-            new_user = user(user_id, city, latitude, longitude, create_time, user_session_id)
-            new_session.add_user(new_user)
-
-            # Increment user ID counter
-            user_id += 1
-
-        sessions.append(new_session)
-
-    return sessions
+from scenario import generate_sessions
+from catalog import TLECatalog
+from ephemeris_cache import EphemerisCache, DEFAULT_CACHE_DIR
+from satellites import generate_satellite_positions, pinned_start_time
 
 if __name__ == "__main__":
     num_sessions = 10
@@ -49,11 +13,22 @@ if __name__ == "__main__":
     time_step = 60
     num_steps = 100
 
-    # Fetch TLE data for multiple satellites
+    # Keep a local copy of the TLE catalog and only apply upstream changes
     TLE_URL = "https://celestrak.com/NORAD/elements/stations.txt"
-    tle_data = fetch_multiple_tle_from_url(TLE_URL, num_satellites)
-
-    satellite_positions = generate_satellite_positions(tle_data, time_step, num_steps)
+    os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+    catalog = TLECatalog(os.path.join(DEFAULT_CACHE_DIR, "stations.txt"), TLE_URL)
+    try:
+        delta = catalog.refresh()
+        print(f"TLE catalog: {len(delta.changed)} updated, {len(delta.added)} added, "
+              f"{len(delta.removed)} removed upstream")
+    except (ValueError, OSError) as e:
+        if not len(catalog):
+            raise
+        print(f"Using cached TLE catalog: {e}")
+    tle_data = catalog.records[:num_satellites]
+
+    satellite_positions = generate_satellite_positions(tle_data, time_step, num_steps,
+                                                       start_time=pinned_start_time(), cache=EphemerisCache())
     generated_sessions = generate_sessions(num_sessions, max_users_per_session)
 
     for session in generated_sessions:
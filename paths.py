@@ -0,0 +1,255 @@
+import heapq
+import instrumentation
+
+DEFAULT_K_PATHS = 4
+
+
+def distances_to(adjacency, target):
+    """
+    Cost of the cheapest path from every node to target, ignoring transit restrictions (Dijkstra).
+    It never overestimates the cost of a path with nodes or links banned, so it is an exact-when-
+    unrestricted, consistent A* heuristic for every search towards target.
+    :return: Dict node -> cost, reachable nodes only.
+    """
+    neighbours, costs = adjacency
+    dist = {target: 0.0}
+    heap = [(0.0, target)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for v, cost in zip(neighbours[u], costs[u]):
+            nd = d + cost
+            if nd < dist.get(v, float("inf")):
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return dist
+
+
+def _shortest_path(adjacency, source, target, transit_limit, banned_nodes=(), banned_edges=(), heuristic=None):
+    """
+    A* (Dijkstra when heuristic is None) with early exit on list-of-lists adjacency.
+    Nodes >= transit_limit (ground nodes) may only appear as source or target.
+    :param heuristic: Optional distances_to(adjacency, target); nodes missing from it cannot reach target.
+    :return: Tuple (cost, path) or None when target is unreachable.
+    """
+    neighbours, costs = adjacency
+    if heuristic is not None and source not in heuristic:
+        return None
+    dist = {source: 0.0}
+    prev = {}
+    # Ties on f (common with hop counts) go to the node furthest along, i.e. closest to target
+    heap = [(heuristic[source] if heuristic is not None else 0.0, 0.0, source)]
+    while heap:
+        f, _, u = heapq.heappop(heap)
+        d = dist[u]
+        if u == target:
+            path = [u]
+            while u != source:
+                u = prev[u]
+                path.append(u)
+            return d, path[::-1]
+        if f > d + (heuristic[u] if heuristic is not None else 0.0):
+            continue
+        if u != source and transit_limit is not None and u >= transit_limit:
+            continue
+        for v, cost in zip(neighbours[u], costs[u]):
+            if v in banned_nodes or (u, v) in banned_edges:
+                continue
+            nd = d + cost
+            if nd < dist.get(v, float("inf")):
+                if heuristic is None:
+                    h = 0.0
+                elif v in heuristic:
+                    h = heuristic[v]
+                else:
+                    continue
+                dist[v] = nd
+                prev[v] = u
+                heapq.heappush(heap, (nd + h, -nd, v))
+    return None
+
+
+def _path_cost(adjacency, path):
+    neighbours, costs = adjacency
+    total = 0.0
+    for u, v in zip(path, path[1:]):
+        total += costs[u][neighbours[u].index(v)]
+    return total
+
+
+def adjacency_lists(snapshot, weighted=False):
+    """
+    Turn a TopologySnapshot's CSR arrays into per-node Python lists for fast scalar traversal.
+    :param weighted: Use link lengths as costs; otherwise every hop costs 1 (like nx.all_shortest_paths).
+    :return: Tuple (neighbours, costs), each a list of lists indexed by node.
+    """
+    indptr = snapshot.indptr.tolist()
+    indices = snapshot.indices.tolist()
+    weights = snapshot.weights.tolist() if weighted else [1.0] * len(indices)
+    neighbours = [indices[indptr[u]:indptr[u + 1]] for u in range(snapshot.num_nodes)]
+    costs = [weights[indptr[u]:indptr[u + 1]] for u in range(snapshot.num_nodes)]
+    return neighbours, costs
+
+
+def yen_k_shortest(adjacency, source, target, k=DEFAULT_K_PATHS, transit_limit=None, heuristic=None):
+    """
+    Yen's algorithm: the k cheapest loopless paths, cheapest first.
+    :param adjacency: Tuple returned by adjacency_lists.
+    :param source: Source node.
+    :param target: Target node.
+    :param k: Maximum number of paths returned.
+    :param transit_limit: Nodes >= this id cannot be intermediate hops (None: no restriction).
+    :param heuristic: Optional distances_to(adjacency, target), computed here if omitted.
+    :return: List of paths (lists of node ids); empty when target is unreachable.
+    """
+    if heuristic is None:
+        heuristic = distances_to(adjacency, target)
+    first = _shortest_path(adjacency, source, target, transit_limit, heuristic=heuristic)
+    if first is None:
+        return []
+    found = [first[1]]
+    seen = {tuple(first[1])}
+    candidates = []
+    while len(found) < k:
+        last = found[-1]
+        for i in range(len(last) - 1):
+            spur = last[i]
+            root = last[:i + 1]
+            banned_edges = set()
+            for path in found:
+                if path[:i + 1] == root and len(path) > i + 1:
+                    banned_edges.add((path[i], path[i + 1]))
+                    banned_edges.add((path[i + 1], path[i]))
+            result = _shortest_path(adjacency, spur, target, transit_limit, set(root[:-1]), banned_edges, heuristic)
+            if result is None:
+                continue
+            total = root[:-1] + result[1]
+            key = tuple(total)
+            if key not in seen:
+                seen.add(key)
+                heapq.heappush(candidates, (_path_cost(adjacency, total), key))
+        if not candidates:
+            break
+        found.append(list(heapq.heappop(candidates)[1]))
+    return found
+
+
+def edge_disjoint_paths(adjacency, source, target, k=DEFAULT_K_PATHS, transit_limit=None, heuristic=None):
+    """
+    Up to k pairwise edge-disjoint paths, found by repeatedly removing the links of the last path.
+    :return: List of paths, cheapest first; empty when target is unreachable.
+    """
+    if heuristic is None:
+        heuristic = distances_to(adjacency, target)
+    banned_edges = set()
+    found = []
+    while len(found) < k:
+        result = _shortest_path(adjacency, source, target, transit_limit, (), banned_edges, heuristic)
+        if result is None:
+            break
+        path = result[1]
+        found.append(path)
+        for u, v in zip(path, path[1:]):
+            banned_edges.add((u, v))
+            banned_edges.add((v, u))
+    return found
+
+
+class PathEngine:
+    """
+    Bounded k-shortest path search over one TopologySnapshot with a memo keyed by (source, target).
+    Sessions that share endpoints reuse the same path sets, and (target, source) is served by
+    reversing a cached (source, target) entry. update() moves the engine to the next step and
+    drops the entries whose paths use a removed link and, when links appear, the entries holding
+    fewer than k paths (unreachable pairs included), which the new links may complete. Full sets
+    stay valid across added links but may miss a newly shorter route; clear() forces a rebuild.
+    """
+
+    def __init__(self, snapshot, k=DEFAULT_K_PATHS, method="yen", num_satellites=None, weighted=False):
+        """
+        :param snapshot: TopologySnapshot to search.
+        :param k: Maximum number of paths per (source, target).
+        :param method: "yen" for k-shortest paths, "disjoint" for edge-disjoint paths.
+        :param num_satellites: Nodes >= this id (ground nodes) are never used as transit hops.
+        :param weighted: Use link lengths instead of hop counts as path cost.
+        """
+        if method not in ("yen", "disjoint"):
+            raise ValueError(f"Unknown path method {method!r}")
+        self.k = k
+        self.method = method
+        self.num_satellites = num_satellites
+        self.weighted = weighted
+        self.memo = {}
+        self.edge_users = {}  # (u, v) with u < v -> set of memo keys whose paths use it
+        self.hits = 0
+        self.misses = 0
+        self._load(snapshot)
+
+    def _load(self, snapshot):
+        self.snapshot = snapshot
+        self.adjacency = adjacency_lists(snapshot, self.weighted)
+        # target -> distances_to(target) of this snapshot, shared by every search towards it (relays)
+        self.heuristics = {}
+
+    @instrumentation.timed("PathEngine.paths")
+    def paths(self, source, target):
+        """
+        :return: List of up to k paths from source to target (empty if unreachable).
+        """
+        key = (source, target)
+        if key in self.memo:
+            self.hits += 1
+            return self.memo[key]
+        if (target, source) in self.memo:
+            self.hits += 1
+            return [path[::-1] for path in self.memo[(target, source)]]
+        self.misses += 1
+        search = yen_k_shortest if self.method == "yen" else edge_disjoint_paths
+        if target not in self.heuristics:
+            self.heuristics[target] = distances_to(self.adjacency, target)
+        result = search(self.adjacency, source, target, self.k, self.num_satellites, self.heuristics[target])
+        self.memo[key] = result
+        for path in result:
+            for u, v in zip(path, path[1:]):
+                self.edge_users.setdefault((min(u, v), max(u, v)), set()).add(key)
+        return result
+
+    def update(self, snapshot):
+        """
+        Switch to the next step's topology and invalidate the memo entries it may have changed.
+        :param snapshot: TopologySnapshot whose `removed` and `added` list the links changed since the current one.
+        :return: Number of memo entries dropped.
+        """
+        dropped = set()
+        for u, v in snapshot.removed.tolist():
+            dropped.update(self.edge_users.pop((min(u, v), max(u, v)), ()))
+        if len(snapshot.added):
+            dropped.update(key for key, result in self.memo.items() if len(result) < self.k)
+        for key in dropped:
+            for path in self.memo.pop(key, ()):
+                for u, v in zip(path, path[1:]):
+                    edge = (min(u, v), max(u, v))
+                    users = self.edge_users.get(edge)
+                    if users is not None:
+                        users.discard(key)
+                        if not users:
+                            del self.edge_users[edge]
+        self._load(snapshot)
+        return len(dropped)
+
+    def clear(self):
+        self.memo.clear()
+        self.edge_users.clear()
+        self.heuristics.clear()
+
+
+def session_path_set(engine, user_nodes, relays):
+    """
+    Build the all_path_set expected by session.find_best_relay.
+    :param engine: PathEngine of the current step.
+    :param user_nodes: Graph node of every user of the session.
+    :param relays: Candidate relay satellites (the session's cu_set).
+    :return: all_path_set[user_index][relay_index] = list of paths.
+    """
+    return [[engine.paths(user_node, relay) for relay in relays] for user_node in user_nodes]
@@ -0,0 +1,173 @@
+import datetime
+import numpy as np
+from geometry import EARTH_RADIUS_KM, latlon_to_unit, unit_to_latlon
+from propagation import ChebyshevEphemeris, ecef_at, parse_tle_elements, time_grid
+from satellites import DEFAULT_SATELLITE_ALTITUDE_KM
+from spatial_index import chord_to_angle
+
+# Upper bound on queries x satellites compared at once by nearest()
+CHUNK_DOTS = 1 << 22
+
+
+class PositionTensor:
+    """
+    Satellite positions as float32 Earth-fixed unit vectors plus altitude, time-major.
+    units is a contiguous [num_steps, num_satellites, 3] array and altitude [num_steps, num_satellites],
+    so the frame of one step is a contiguous block. Angular distances are dot products of unit vectors,
+    which have no longitude wrap or pole singularity; lat/lon in the legacy [num_satellites, num_steps, 2]
+    layout is only built, once, when something like plotting asks for it (see latlon).
+    float32 keeps about 0.5 m of precision on the unit sphere.
+    """
+
+    def __init__(self, units, altitude):
+        """
+        :param units: Array [num_steps, num_satellites, 3] of unit vectors.
+        :param altitude: Array [num_steps, num_satellites] in km (or a scalar for every position).
+        """
+        self.units = np.ascontiguousarray(units, dtype=np.float32)
+        if self.units.ndim != 3 or self.units.shape[-1] != 3:
+            raise ValueError(f"Expected unit vectors of shape [num_steps, num_satellites, 3], got {self.units.shape}")
+        self.altitude = np.ascontiguousarray(np.broadcast_to(np.asarray(altitude, dtype=np.float32),
+                                                             self.units.shape[:2]))
+        self._latlon = None
+
+    @classmethod
+    def from_ecef(cls, ecef):
+        """
+        :param ecef: Array [num_satellites, num_steps, 3] in km (e.g. propagation.generate_satellite_ecef).
+        :return: PositionTensor, altitude above the spherical Earth radius.
+        """
+        ecef = np.asarray(ecef, dtype=float)
+        radius = np.linalg.norm(ecef, axis=-1)
+        return cls((ecef / radius[..., None]).transpose(1, 0, 2), (radius - EARTH_RADIUS_KM).T)
+
+    @classmethod
+    def from_latlon(cls, satellite_positions, altitude=DEFAULT_SATELLITE_ALTITUDE_KM):
+        """
+        :param satellite_positions: Array [num_satellites, num_steps, 2 (lat, lon)].
+        :param altitude: Altitude in km, scalar or [num_satellites, num_steps].
+        :return: PositionTensor.
+        """
+        units = latlon_to_unit(satellite_positions[..., 0], satellite_positions[..., 1]).transpose(1, 0, 2)
+        return cls(units, np.asarray(altitude, dtype=float).T)
+
+    @classmethod
+    def propagate(cls, tle_data, time_step, num_steps, start_time=None, block_steps=64, backend="numpy"):
+        """
+        Propagate straight into the compact layout, block_steps at a time, without a float64 [S, T, 3] array.
+        :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+        :param time_step: Time interval between steps (in seconds).
+        :param num_steps: Number of time steps.
+        :param start_time: datetime of the first step (None means now, UTC).
+        :param backend: "numpy" (exact model) or "chebyshev" (interpolated, see propagation.ChebyshevEphemeris).
+        :return: PositionTensor.
+        """
+        if backend not in ("numpy", "chebyshev"):
+            raise ValueError(f"Backend {backend!r} has no Earth-fixed output, use 'numpy' or 'chebyshev'")
+        if start_time is None:
+            start_time = datetime.datetime.now(datetime.timezone.utc)
+        jd = time_grid(start_time, time_step, num_steps)
+        if backend == "chebyshev":
+            ephemeris = ChebyshevEphemeris(tle_data, start_time, max(num_steps - 1, 0) * time_step)
+            ecef_block = ephemeris.ecef
+        else:
+            elements = parse_tle_elements(tle_data)
+            ecef_block = lambda block: ecef_at(elements, block)
+        units = np.empty((num_steps, len(tle_data), 3), dtype=np.float32)
+        altitude = np.empty((num_steps, len(tle_data)), dtype=np.float32)
+        for begin in range(0, num_steps, block_steps):
+            ecef = ecef_block(jd[begin:begin + block_steps])
+            radius = np.linalg.norm(ecef, axis=-1)
+            units[begin:begin + ecef.shape[1]] = (ecef / radius[..., None]).transpose(1, 0, 2)
+            altitude[begin:begin + ecef.shape[1]] = (radius - EARTH_RADIUS_KM).T
+        return cls(units, altitude)
+
+    @property
+    def num_steps(self):
+        return self.units.shape[0]
+
+    @property
+    def num_satellites(self):
+        return self.units.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.units.nbytes + self.altitude.nbytes
+
+    def frame(self, time):
+        """
+        :return: Unit vectors [num_satellites, 3] of one step (a view; time None means the only step).
+        """
+        return self.units[self._step(time)]
+
+    def _step(self, time):
+        if time is None:
+            if self.num_steps != 1:
+                raise ValueError("time is required for a PositionTensor with more than one step")
+            return 0
+        return time
+
+    def ecef(self, time=None):
+        """
+        :param time: Step index, or None for every step.
+        :return: float64 Earth-fixed positions in km: [num_satellites, 3] for one step,
+                 [num_satellites, num_steps, 3] (the propagation layout) for every step.
+        """
+        if time is not None:
+            time = self._step(time)
+            return self.units[time] * (EARTH_RADIUS_KM + self.altitude[time].astype(float))[:, None]
+        return (self.units * (EARTH_RADIUS_KM + self.altitude.astype(float))[..., None]).transpose(1, 0, 2)
+
+    @property
+    def latlon(self):
+        """
+        Lazily derived lat/lon array [num_satellites, num_steps, 2] in degrees, the layout of
+        generate_satellite_positions, for plotting and legacy code. Built on first access and kept.
+        """
+        if self._latlon is None:
+            latlon = np.empty((self.num_satellites, self.num_steps, 2))
+            lat, lon = unit_to_latlon(self.units)
+            latlon[..., 0] = lat.T
+            latlon[..., 1] = lon.T
+            self._latlon = latlon
+        return self._latlon
+
+    def nearest(self, lat, lon, time, k, candidates=None):
+        """
+        The k satellites closest (great-circle) to each query location at one step, by dot product.
+        No index has to be built, which wins for a few queries per step (k_center); for tens of thousands
+        of queries at one step, SatelliteIndex.from_units(self.frame(time)) is faster.
+        :param lat: Latitude(s) in degrees.
+        :param lon: Longitude(s) in degrees.
+        :param time: Step index (None for a single-step tensor).
+        :param k: Number of satellites per query (clamped to the number of candidates).
+        :param candidates: Optional satellite indices to choose from.
+        :return: Tuple (indices, distances) of shape lat.shape + (k,), distances in degrees of arc,
+                 closest first (same as SatelliteIndex.query).
+        """
+        frame = self.frame(time)
+        if candidates is not None:
+            candidates = np.asarray(candidates, dtype=np.intp)
+            frame = frame[candidates]
+        points = latlon_to_unit(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+        shape = points.shape[:-1]
+        points = points.reshape(-1, 3)
+        queries = points.astype(np.float32)
+        k = min(k, len(frame))
+        indices = np.empty((len(points), k), dtype=np.intp)
+        chunk = max(1, CHUNK_DOTS // max(len(frame), 1))
+        for begin in range(0, len(points), chunk):
+            rows = slice(begin, begin + chunk)
+            similarity = queries[rows] @ frame.T
+            if k < len(frame):
+                top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(len(frame)), similarity.shape)
+            top_dots = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_dots, axis=1, kind="stable")
+            indices[rows] = np.take_along_axis(top, order, axis=1)
+        # arccos of a float32 dot is coarse near 0 degrees, the chord of the k winners is not
+        distances = chord_to_angle(np.linalg.norm(points[:, None] - frame[indices].astype(float), axis=-1))
+        if candidates is not None:
+            indices = candidates[indices]
+        return indices.reshape(shape + (k,)), distances.reshape(shape + (k,))
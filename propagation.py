@@ -0,0 +1,563 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import ephem
+from numpy.polynomial import chebyshev
+from geometry import datetime_to_jd, gmst, unit_to_latlon
+from tle import to_catalog, as_tuples
+
+# WGS72 constants, which is what TLE mean elements are fitted against
+WGS72_MU = 398600.8  # km^3 / s^2
+WGS72_RADIUS_KM = 6378.135
+WGS72_J2 = 0.001082616
+WGS72_J3_J2 = -0.00000253881 / WGS72_J2
+WGS72_J4 = -0.00000165597
+XKE = 60.0 / np.sqrt(WGS72_RADIUS_KM ** 3 / WGS72_MU)  # sqrt(mu) in earth radii^1.5 / min
+
+KEPLER_ITERATIONS = 10
+
+# Upper bound on satellites x steps evaluated at once, keeps temporaries small
+CHUNK_ELEMENTS = 1 << 20
+
+# Chebyshev ephemeris defaults: LEO tracks are smooth enough over 20 minutes for a degree-10 fit
+# to stay orders of magnitude below the tolerance, which only matters for higher orbits or drag
+DEFAULT_SEGMENT_SECONDS = 1200.0
+DEFAULT_CHEBYSHEV_DEGREE = 10
+DEFAULT_TOLERANCE_KM = 0.01
+
+
+def parse_tle_elements(tle_data):
+    """
+    Extract the mean elements needed by the vectorized propagator.
+    :param tle_data: Catalog array from tle.load_tle_catalog or list of (satellite_name, TLE line 1, TLE line 2).
+    :return: Dict of 1-D float arrays keyed by element name, angles in radians.
+    """
+    catalog = to_catalog(tle_data)
+    elements = {name: catalog[name].astype(np.float64) for name in
+                ("epoch_jd", "bstar", "eccentricity", "mean_motion")}
+    for name in ("inclination", "raan", "arg_perigee", "mean_anomaly"):
+        elements[name] = np.radians(catalog[name])
+    return elements
+
+
+def _secular_terms(elements):
+    """
+    Recover the Brouwer mean motion and the secular coefficients of near-earth SGP4: J2 / J2^2 / J4
+    rates of the angles and the B* drag polynomials of the semi-major axis, eccentricity and mean
+    anomaly (sgp4init in Vallado et al., "Revisiting Spacetrack Report #3", 2006).
+    :param elements: Dict returned by parse_tle_elements.
+    :return: Dict of 1-D arrays (rates in rad/min, lengths in earth radii).
+    """
+    n_kozai = elements["mean_motion"] * 2 * np.pi / 1440.0  # rev/day -> rad/min
+    e0 = elements["eccentricity"]
+    bstar = elements["bstar"]
+    cos_i = np.cos(elements["inclination"])
+    sin_i = np.sin(elements["inclination"])
+    cos_i2 = cos_i ** 2
+    beta2 = 1 - e0 ** 2
+    beta = np.sqrt(beta2)
+
+    # Un-Kozai the mean motion the same way SGP4 does
+    a1 = (XKE / n_kozai) ** (2.0 / 3.0)
+    d1 = 0.75 * WGS72_J2 * (3 * cos_i2 - 1) / (beta * beta2)
+    delta = d1 / a1 ** 2
+    a_del = a1 * (1 - delta * (1.0 / 3.0 + delta * (1 + 134.0 / 81.0 * delta)))
+    delta = d1 / a_del ** 2
+    n0 = n_kozai / (1 + delta)
+    a0 = (XKE / n0) ** (2.0 / 3.0)
+
+    # Atmosphere density parameters, lowered for perigees below 156 km
+    perigee_km = (a0 * (1 - e0) - 1) * WGS72_RADIUS_KM
+    s4 = np.where(perigee_km < 156, np.where(perigee_km < 98, 20.0, perigee_km - 78), 78.0)
+    qoms24 = ((120 - s4) / WGS72_RADIUS_KM) ** 4
+    s4 = s4 / WGS72_RADIUS_KM + 1
+
+    tsi = 1 / (a0 - s4)
+    eta = a0 * e0 * tsi
+    eta2 = eta ** 2
+    e_eta = e0 * eta
+    psi2 = np.abs(1 - eta2)
+    coef = qoms24 * tsi ** 4
+    coef1 = coef / psi2 ** 3.5
+    con41 = 3 * cos_i2 - 1
+    x1mth2 = 1 - cos_i2
+    c2 = coef1 * n0 * (a0 * (1 + 1.5 * eta2 + e_eta * (4 + eta2))
+                       + 0.375 * WGS72_J2 * tsi / psi2 * con41 * (8 + 3 * eta2 * (8 + eta2)))
+    c1 = bstar * c2
+    circular = e0 <= 1e-4
+    safe_e0 = np.where(circular, 1.0, e0)
+    c3 = np.where(circular, 0.0, -2 * coef * tsi * WGS72_J3_J2 * n0 * sin_i / safe_e0)
+    c4 = 2 * n0 * coef1 * a0 * beta2 * (
+        eta * (2 + 0.5 * eta2) + e0 * (0.5 + 2 * eta2)
+        - WGS72_J2 * tsi / (a0 * psi2) * (-3 * con41 * (1 - 2 * e_eta + eta2 * (1.5 - 0.5 * e_eta))
+                                          + 0.75 * x1mth2 * (2 * eta2 - e_eta * (1 + eta2))
+                                          * np.cos(2 * elements["arg_perigee"])))
+    c5 = 2 * coef1 * a0 * beta2 * (1 + 2.75 * (eta2 + e_eta) + e_eta * eta2)
+
+    p_inv2 = 1 / (a0 * beta2) ** 2
+    temp1 = 1.5 * WGS72_J2 * p_inv2 * n0
+    temp2 = 0.5 * temp1 * WGS72_J2 * p_inv2
+    temp3 = -0.46875 * WGS72_J4 * p_inv2 ** 2 * n0
+    raan_dot_j2 = -temp1 * cos_i
+    terms = {
+        "n0": n0, "a0": a0, "eta": eta, "c1": c1, "c4": bstar * c4, "c5": bstar * c5,
+        "m_dot": n0 + 0.5 * temp1 * beta * con41 + 0.0625 * temp2 * beta * (13 - 78 * cos_i2 + 137 * cos_i2 ** 2),
+        "argp_dot": (-0.5 * temp1 * (1 - 5 * cos_i2) + 0.0625 * temp2 * (7 - 114 * cos_i2 + 395 * cos_i2 ** 2)
+                     + temp3 * (3 - 36 * cos_i2 + 49 * cos_i2 ** 2)),
+        "raan_dot": raan_dot_j2 + (0.5 * temp2 * (4 - 19 * cos_i2) + 2 * temp3 * (3 - 7 * cos_i2)) * cos_i,
+        "raan_drag": 3.5 * beta2 * raan_dot_j2 * c1,
+        "argp_drag": bstar * c3 * np.cos(elements["arg_perigee"]),
+        "m_drag": np.where(circular, 0.0, -2.0 / 3.0 * coef * bstar / np.where(circular, 1.0, e_eta)),
+        "t2": 1.5 * c1,
+    }
+    # Higher drag orders, dropped by SGP4 for perigees below 220 km
+    full = a0 * (1 - e0) >= 220 / WGS72_RADIUS_KM + 1
+    c1_2 = c1 ** 2
+    d2 = 4 * a0 * tsi * c1_2
+    temp = d2 * tsi * c1 / 3
+    d3 = (17 * a0 + s4) * temp
+    d4 = 0.5 * temp * a0 * tsi * (221 * a0 + 31 * s4) * c1
+    terms.update({name: np.where(full, value, 0.0) for name, value in {
+        "d2": d2, "d3": d3, "d4": d4, "t3": d2 + 2 * c1_2,
+        "t4": 0.25 * (3 * d3 + c1 * (12 * d2 + 10 * c1_2)),
+        "t5": 0.2 * (3 * d4 + 12 * c1 * d3 + 6 * d2 ** 2 + 15 * c1_2 * (2 * d2 + c1_2)),
+    }.items()})
+    terms["full"] = full
+    return terms
+
+
+def propagate_ecef(elements, jd):
+    """
+    Propagate mean elements to the requested times with the secular part of near-earth SGP4:
+    J2 / J2^2 / J4 rates and B* drag, without SGP4's periodic terms.
+    Every satellite is evaluated at every time in array operations.
+    Accuracy: see propagate_numpy.
+    :param elements: Dict returned by parse_tle_elements (S satellites).
+    :param jd: 1-D array of T Julian dates (UTC).
+    :return: Array of shape [S, T, 3] with Earth-fixed positions in km.
+    """
+    jd = np.asarray(jd, dtype=float)
+    terms = {name: value[:, None] for name, value in _secular_terms(elements).items()}
+    e0 = elements["eccentricity"][:, None]
+    m0 = elements["mean_anomaly"][:, None]
+    inclination = elements["inclination"][:, None]
+
+    t = (jd[None, :] - elements["epoch_jd"][:, None]) * 1440.0  # minutes since epoch
+    t2 = t ** 2
+    t3 = t2 * t
+    t4 = t3 * t
+    mean_anomaly = m0 + terms["m_dot"] * t
+    raan = elements["raan"][:, None] + terms["raan_dot"] * t + terms["raan_drag"] * t2
+    arg_perigee = elements["arg_perigee"][:, None] + terms["argp_dot"] * t
+    # Drag: the orbit shrinks, circularizes, and the mean anomaly speeds up
+    delta = np.where(terms["full"], terms["argp_drag"] * t
+                     + terms["m_drag"] * ((1 + terms["eta"] * np.cos(mean_anomaly)) ** 3
+                                          - (1 + terms["eta"] * np.cos(m0)) ** 3), 0.0)
+    mean_anomaly = mean_anomaly + delta
+    arg_perigee = arg_perigee - delta
+    tempa = 1 - terms["c1"] * t - terms["d2"] * t2 - terms["d3"] * t3 - terms["d4"] * t4
+    tempe = terms["c4"] * t + np.where(terms["full"], terms["c5"] * (np.sin(mean_anomaly) - np.sin(m0)), 0.0)
+    templ = terms["t2"] * t2 + terms["t3"] * t3 + t4 * (terms["t4"] + t * terms["t5"])
+    a = terms["a0"] * tempa ** 2
+    e0 = np.clip(e0 - tempe, 1e-6, 1 - 1e-6)
+    mean_anomaly = mean_anomaly + terms["n0"] * templ
+
+    mean_anomaly = np.mod(mean_anomaly, 2 * np.pi)
+    eccentric = mean_anomaly + e0 * np.sin(mean_anomaly)
+    for _ in range(KEPLER_ITERATIONS):
+        eccentric = eccentric - (eccentric - e0 * np.sin(eccentric) - mean_anomaly) / (1 - e0 * np.cos(eccentric))
+
+    # Position in the perifocal frame, earth radii
+    x_pf = a * (np.cos(eccentric) - e0)
+    y_pf = a * np.sqrt(1 - e0 ** 2) * np.sin(eccentric)
+
+    cos_w, sin_w = np.cos(arg_perigee), np.sin(arg_perigee)
+    cos_o, sin_o = np.cos(raan), np.sin(raan)
+    cos_i, sin_i = np.cos(inclination), np.sin(inclination)
+    x_orb = x_pf * cos_w - y_pf * sin_w
+    y_orb = x_pf * sin_w + y_pf * cos_w
+    x_eci = x_orb * cos_o - y_orb * cos_i * sin_o
+    y_eci = x_orb * sin_o + y_orb * cos_i * cos_o
+    z_eci = y_orb * sin_i
+
+    # TEME -> Earth fixed, rotating by sidereal time only
+    theta = gmst(jd)[None, :]
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    x = (x_eci * cos_t + y_eci * sin_t) * WGS72_RADIUS_KM
+    y = (-x_eci * sin_t + y_eci * cos_t) * WGS72_RADIUS_KM
+    z = z_eci * WGS72_RADIUS_KM
+    return np.stack((x, y, z), axis=-1)
+
+
+def time_grid(start_time, time_step, num_steps):
+    """
+    Build the Julian dates of a regular time grid.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :return: 1-D array of Julian dates.
+    """
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+    return datetime_to_jd(start_time) + np.arange(num_steps) * (time_step / 86400.0)
+
+
+def positions_at(elements, jd):
+    """
+    Sub-satellite points of every satellite at every requested time, chunked over satellites.
+    :param elements: Dict returned by parse_tle_elements.
+    :param jd: 1-D array of Julian dates.
+    :return: NumPy array of shape [num_satellites, len(jd), 2 (lat, lon)].
+    """
+    num_satellites = len(elements["epoch_jd"])
+    num_steps = len(jd)
+    positions = np.zeros((num_satellites, num_steps, 2))
+    chunk = max(1, CHUNK_ELEMENTS // max(num_steps, 1))
+    for begin in range(0, num_satellites, chunk):
+        rows = slice(begin, min(begin + chunk, num_satellites))
+        ecef = propagate_ecef({name: value[rows] for name, value in elements.items()}, jd)
+        # Geocentric latitude, same convention as ephem's sublat
+        positions[rows, :, 0], positions[rows, :, 1] = unit_to_latlon(ecef)
+    return positions
+
+
+def propagate_numpy(tle_data, time_step, num_steps, start_time=None):
+    """
+    Vectorized backend for generate_satellite_positions.
+    Against the ephem backend (full SGP4) it stays within about 0.1 deg in latitude and longitude,
+    the size of the SGP4 periodic terms it leaves out, as long as drag has lowered the orbit by less
+    than about 50 km since epoch. Past that the error grows quickly (a reentering object a week
+    after epoch is off by degrees). Orbits with periods above 225 minutes, which SGP4 propagates
+    with its deep-space terms, are not covered. Check with backend_error.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :return: NumPy array of shape [num_satellites, num_steps, 2 (lat, lon)].
+    """
+    return positions_at(parse_tle_elements(tle_data), time_grid(start_time, time_step, num_steps))
+
+
+def generate_satellite_ecef(tle_data, time_step, num_steps, start_time=None):
+    """
+    Earth-fixed satellite positions over a regular time grid (needed for ranges, e.g. ISLs).
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :return: NumPy array of shape [num_satellites, num_steps, 3 (x, y, z)] in km.
+    """
+    return propagate_ecef(parse_tle_elements(tle_data), time_grid(start_time, time_step, num_steps))
+
+
+def iter_positions(tle_data, time_step, num_steps, start_time=None, block_steps=64):
+    """
+    Stream positions one timestep at a time instead of materializing [num_satellites, num_steps, 2].
+    Steps are propagated in blocks of block_steps to keep the math vectorized; peak memory is
+    one block. Values are identical to propagate_numpy on the same grid.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :param block_steps: Number of steps propagated together.
+    :return: Generator of (step, jd, positions [num_satellites, 2 (lat, lon)]).
+    """
+    jd = time_grid(start_time, time_step, num_steps)
+    elements = parse_tle_elements(tle_data)
+    for begin in range(0, num_steps, block_steps):
+        block = positions_at(elements, jd[begin:begin + block_steps])
+        for offset in range(block.shape[1]):
+            yield begin + offset, jd[begin + offset], block[:, offset]
+
+
+def ecef_at(elements, jd):
+    """
+    propagate_ecef chunked over satellites, so that temporaries stay within CHUNK_ELEMENTS.
+    :return: Array of shape [num_satellites, len(jd), 3] in km.
+    """
+    num_satellites = len(elements["epoch_jd"])
+    ecef = np.zeros((num_satellites, len(jd), 3))
+    chunk = max(1, CHUNK_ELEMENTS // max(len(jd), 1))
+    for begin in range(0, num_satellites, chunk):
+        rows = slice(begin, min(begin + chunk, num_satellites))
+        ecef[rows] = propagate_ecef({name: value[rows] for name, value in elements.items()}, jd)
+    return ecef
+
+
+class ChebyshevEphemeris:
+    """
+    Propagate coarsely, then interpolate: every satellite's Earth-fixed track is split into segments of equal
+    length and each segment is fitted with a Chebyshev polynomial per axis, interpolating the exact propagator at
+    degree + 1 Chebyshev nodes. Positions at any times inside the span, on or off a grid, are then polynomial
+    evaluations. The fit is checked against the exact model between the nodes (and at the segment ends, where the
+    error peaks) and the segments are halved until the error is within tolerance_km.
+    """
+
+    def __init__(self, tle_data, start_time, duration, segment=DEFAULT_SEGMENT_SECONDS,
+                 degree=DEFAULT_CHEBYSHEV_DEGREE, tolerance_km=DEFAULT_TOLERANCE_KM, max_refinements=4, check=True):
+        """
+        :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+        :param start_time: datetime where the fitted span starts (None means now, UTC).
+        :param duration: Length of the span in seconds.
+        :param segment: Initial segment length in seconds.
+        :param degree: Degree of the Chebyshev polynomials.
+        :param tolerance_km: Largest accepted distance between fitted and exact positions.
+        :param max_refinements: Number of times the segment length may be halved to meet the tolerance.
+        :param check: Verify the fit against the exact model; without it max_error_km is None.
+        """
+        if start_time is None:
+            start_time = datetime.datetime.now(datetime.timezone.utc)
+        if duration < 0:
+            raise ValueError(f"Ephemeris duration must be non-negative, got {duration}")
+        self.elements = parse_tle_elements(tle_data)
+        self.start_jd = datetime_to_jd(start_time)
+        self.duration = float(duration)
+        self.degree = degree
+        self.tolerance_km = tolerance_km
+        # Nodes on [-1, 1] and the matrix turning samples at them into coefficients
+        nodes = np.cos(np.pi * (np.arange(degree + 1) + 0.5) / (degree + 1))
+        self._nodes = nodes
+        self._from_samples = np.linalg.inv(chebyshev.chebvander(nodes, degree))
+
+        for refinement in range(max_refinements + 1):
+            self._fit(segment)
+            self.max_error_km = self.error(self._check_offsets()) if check else None
+            if self.max_error_km is None or self.max_error_km <= tolerance_km:
+                break
+            segment /= 2
+        else:
+            raise ValueError(f"Chebyshev fit error {self.max_error_km:.3g} km exceeds {tolerance_km} km "
+                             f"with {self.segment:g} s segments")
+
+    def _fit(self, segment):
+        self.segment = float(segment)
+        self.num_segments = max(1, int(np.ceil(self.duration / self.segment)))
+        starts = np.arange(self.num_segments) * self.segment
+        offsets = (starts[:, None] + (self._nodes[None, :] + 1) * self.segment / 2).ravel()
+        samples = ecef_at(self.elements, self.start_jd + offsets / 86400.0)
+        samples = samples.reshape(len(samples), self.num_segments, self.degree + 1, 3)
+        # coefficients [num_satellites, num_segments, degree + 1, 3 (x, y, z)]
+        self.coefficients = np.einsum("kj,sgjc->sgkc", self._from_samples, samples)
+
+    def _check_offsets(self):
+        # Segment ends and midpoints between consecutive nodes
+        points = np.concatenate(([-1.0, 1.0], (self._nodes[1:] + self._nodes[:-1]) / 2))
+        starts = np.arange(self.num_segments) * self.segment
+        offsets = (starts[:, None] + (points[None, :] + 1) * self.segment / 2).ravel()
+        return offsets[offsets <= self.duration]
+
+    def _offsets(self, jd):
+        offsets = (np.atleast_1d(np.asarray(jd, dtype=float)) - self.start_jd) * 86400.0
+        # Allow rounding noise from the Julian date conversion at both ends
+        if len(offsets) and (offsets.min() < -1e-3 or offsets.max() > self.duration + 1e-3):
+            raise ValueError(f"Requested times fall outside the fitted span of {self.duration:g} s")
+        return np.clip(offsets, 0.0, self.duration)
+
+    def ecef_offsets(self, offsets):
+        """
+        :param offsets: 1-D array of seconds since start_time, any order and spacing.
+        :return: Array [num_satellites, len(offsets), 3] of Earth-fixed positions in km.
+        """
+        offsets = np.asarray(offsets, dtype=float)
+        segment = np.minimum((offsets // self.segment).astype(np.intp), self.num_segments - 1)
+        basis = chebyshev.chebvander(2 * (offsets - segment * self.segment) / self.segment - 1, self.degree)
+        ecef = np.empty((len(self.coefficients), len(offsets), 3))
+        # Grids are sorted in time, so each segment is usually one contiguous block of columns
+        order = np.argsort(segment, kind="stable")
+        bounds = np.searchsorted(segment[order], np.arange(self.num_segments + 1))
+        for g in range(self.num_segments):
+            columns = order[bounds[g]:bounds[g + 1]]
+            if len(columns):
+                ecef[:, columns] = np.einsum("skc,tk->stc", self.coefficients[:, g], basis[columns])
+        return ecef
+
+    def ecef(self, jd):
+        """
+        :param jd: Julian dates (scalar or 1-D) inside the fitted span.
+        :return: Array [num_satellites, len(jd), 3] of Earth-fixed positions in km.
+        """
+        return self.ecef_offsets(self._offsets(jd))
+
+    def positions(self, jd):
+        """
+        Sub-satellite points, same convention as positions_at.
+        :param jd: Julian dates (scalar or 1-D) inside the fitted span.
+        :return: Array [num_satellites, len(jd), 2 (lat, lon)].
+        """
+        ecef = self.ecef(jd)
+        positions = np.zeros(ecef.shape[:2] + (2,))
+        positions[..., 0], positions[..., 1] = unit_to_latlon(ecef)
+        return positions
+
+    def at(self, when):
+        """
+        :param when: datetime, or a list of them.
+        :return: Array [num_satellites, 2 (lat, lon)] for one datetime, [num_satellites, len(when), 2] for a list.
+        """
+        if isinstance(when, datetime.datetime):
+            return self.positions(datetime_to_jd(when))[:, 0]
+        return self.positions([datetime_to_jd(moment) for moment in when])
+
+    def error(self, offsets):
+        """
+        :param offsets: Seconds since start_time to compare at.
+        :return: Largest distance in km between the fitted and the exact positions.
+        """
+        offsets = np.asarray(offsets, dtype=float)
+        if len(offsets) == 0:
+            return 0.0
+        exact = ecef_at(self.elements, self.start_jd + offsets / 86400.0)
+        return float(np.linalg.norm(self.ecef_offsets(offsets) - exact, axis=-1).max(initial=0.0))
+
+
+def propagate_chebyshev(tle_data, time_step, num_steps, start_time=None):
+    """
+    Interpolating backend for generate_satellite_positions: ChebyshevEphemeris with the default segments
+    and tolerance, evaluated on the grid. Worth it for fine time steps (a few seconds), where the exact
+    model would be evaluated many times per segment.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :return: NumPy array of shape [num_satellites, num_steps, 2 (lat, lon)].
+    """
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+    ephemeris = ChebyshevEphemeris(tle_data, start_time, max(num_steps - 1, 0) * time_step)
+    return ephemeris.positions(time_grid(start_time, time_step, num_steps))
+
+
+# Shared output buffer, attached once per worker process by _attach_positions
+_worker_positions = None
+
+
+def _attach_positions(shm_name, shape):
+    global _worker_positions
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_positions = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+
+
+def _propagate_shard(elements, jd, rows, cols):
+    """
+    Propagate one (satellite block, time window) shard straight into the shared positions array.
+    """
+    positions = _worker_positions[1]
+    ecef = propagate_ecef(elements, jd)
+    positions[rows, cols, 0], positions[rows, cols, 1] = unit_to_latlon(ecef)
+    return rows.start, cols.start
+
+
+def _shards(num_satellites, num_steps, workers):
+    """
+    Split the satellites x steps grid into a few blocks per worker.
+    Satellites are split first, time windows only once each worker would get too few satellites.
+    :return: List of (rows, cols) slice pairs covering the grid.
+    """
+    target = workers * 4
+    sat_blocks = min(num_satellites, target)
+    time_blocks = min(num_steps, -(-target // sat_blocks))
+    # Keep each shard within the serial chunk size so temporaries stay bounded
+    steps_per_block = -(-num_steps // time_blocks)
+    sat_blocks = max(sat_blocks, min(num_satellites, -(-num_satellites * steps_per_block // CHUNK_ELEMENTS)))
+    sat_edges = np.linspace(0, num_satellites, sat_blocks + 1).astype(int)
+    time_edges = np.linspace(0, num_steps, time_blocks + 1).astype(int)
+    return [(slice(sat_edges[i], sat_edges[i + 1]), slice(time_edges[j], time_edges[j + 1]))
+            for i in range(sat_blocks) for j in range(time_blocks)
+            if sat_edges[i] < sat_edges[i + 1] and time_edges[j] < time_edges[j + 1]]
+
+
+def propagate_parallel(tle_data, time_step, num_steps, start_time=None, workers=None):
+    """
+    Parallel version of propagate_numpy. Satellites and time windows are sharded across a
+    process pool and every worker writes its block into one shared-memory positions array,
+    so only the (small) element arrays are pickled.
+    Elementwise math does not depend on the shard layout, so the result is bit-identical to
+    propagate_numpy for the same start_time.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :param workers: Number of worker processes (None means os.cpu_count()).
+    :return: NumPy array of shape [num_satellites, num_steps, 2 (lat, lon)].
+    """
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+    workers = workers or os.cpu_count() or 1
+    num_satellites = len(tle_data)
+    if workers == 1 or num_satellites == 0 or num_steps == 0:
+        return propagate_numpy(tle_data, time_step, num_steps, start_time)
+
+    jd = time_grid(start_time, time_step, num_steps)
+    elements = parse_tle_elements(tle_data)
+    shape = (num_satellites, num_steps, 2)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_positions,
+                                 initargs=(shm.name, shape)) as pool:
+            futures = [pool.submit(_propagate_shard, {name: value[rows] for name, value in elements.items()},
+                                   jd[cols], rows, cols)
+                       for rows, cols in _shards(num_satellites, num_steps, workers)]
+            for future in futures:
+                future.result()
+        positions = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return positions
+
+
+def propagate_ephem(tle_data, time_step, num_steps, start_time=None):
+    """
+    Reference backend for generate_satellite_positions, one ephem call per satellite per step.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :return: NumPy array of shape [num_satellites, num_steps, 2 (lat, lon)].
+    """
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    start = ephem.Date(start_time)
+
+    num_satellites = len(tle_data)
+    positions = np.zeros((num_satellites, num_steps, 2))
+    for sat_index, (name, tle_line1, tle_line2) in enumerate(as_tuples(tle_data)):
+        sat = ephem.readtle(name, tle_line1, tle_line2)
+        for step in range(num_steps):
+            sat.compute(ephem.Date(start + ephem.second * step * time_step))
+            positions[sat_index, step, 0] = np.degrees(sat.sublat)
+            positions[sat_index, step, 1] = np.degrees(sat.sublong)
+    return positions
+
+
+BACKENDS = {
+    "numpy": propagate_numpy,
+    "ephem": propagate_ephem,
+    "chebyshev": propagate_chebyshev,
+}
+
+
+def backend_error(tle_data, time_step, num_steps, start_time=None, backend="numpy", reference="ephem"):
+    """
+    Cross-check a backend against the reference one on the same pinned time grid.
+    Expect up to about 0.1 deg for "numpy" against "ephem" on LEO elements that drag has lowered by
+    less than about 50 km since epoch (see propagate_numpy). Larger errors flag elements outside
+    that range, e.g. objects close to reentry or far from their epoch.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :param backend: Name of the backend under test.
+    :param reference: Name of the backend treated as ground truth.
+    :return: Array of shape [num_satellites, 2] with the max |error| in lat and lon (degrees).
+    """
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+    error = (BACKENDS[backend](tle_data, time_step, num_steps, start_time)
+             - BACKENDS[reference](tle_data, time_step, num_steps, start_time))
+    error[..., 1] = (error[..., 1] + 180) % 360 - 180
+    return np.abs(error).max(axis=1)
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+from matplotlib.collections import LineCollection
+from assignment import assign_users
+from positions import PositionTensor
+
+
+def link_segments(user_lats, user_lons, sat_lats, sat_lons):
+    """
+    Map segments of user-satellite links on a plate carree (lon, lat) plot.
+    A link whose longitude difference exceeds 180 degrees takes the short way across the antimeridian:
+    it is split into two segments that end on the map edges; every other link has a NaN second segment,
+    which matplotlib skips, so the output shape only depends on the number of links.
+    :param user_lats: Array [num_links] of user latitudes.
+    :param user_lons: Array [num_links] of user longitudes.
+    :param sat_lats: Array [num_links] of latitudes of the satellite each user is linked to.
+    :param sat_lons: Array [num_links] of longitudes of the satellite each user is linked to.
+    :return: Array [2 * num_links, 2 (ends), 2 (lon, lat)].
+    """
+    x0 = np.asarray(user_lons, dtype=float)
+    y0 = np.asarray(user_lats, dtype=float)
+    x1 = np.asarray(sat_lons, dtype=float)
+    y1 = np.asarray(sat_lats, dtype=float)
+    dx = x1 - x0
+    crosses = np.abs(dx) > 180
+    # Satellite longitude continued past the edge, and the edge the link leaves through
+    x1_wrapped = x1 - 360 * np.sign(dx) * crosses
+    edge = np.where(x1_wrapped < x0, -180.0, 180.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(crosses, (edge - x0) / (x1_wrapped - x0), 1.0)
+    y_edge = y0 + t * (y1 - y0)
+
+    segments = np.full((2, len(x0), 2, 2), np.nan)
+    segments[0, :, 0] = np.stack((x0, y0), axis=-1)
+    segments[0, :, 1] = np.where(crosses[:, None], np.stack((edge, y_edge), axis=-1), np.stack((x1, y1), axis=-1))
+    segments[1, crosses, 0] = np.stack((-edge, y_edge), axis=-1)[crosses]
+    segments[1, crosses, 1] = np.stack((x1, y1), axis=-1)[crosses]
+    return segments.reshape(-1, 2, 2)
+
+
+class LinkRenderer:
+    """
+    Animation of users linked to their satellite over time, sized for thousands of users.
+    All assignments are computed up front (assignment.assign_users, or passed in), every link is part of
+    a single LineCollection whose segments are swapped each frame, and only the moving artists (satellites
+    and links) are redrawn on screen thanks to blitting. save() renders headlessly to a video or PNG frames.
+    """
+
+    def __init__(self, user_locations, satellite_positions, assignments=None, k=3,
+                 title="Satellite and User Positions Over Time", figsize=(10, 6), link_color="green", link_width=0.5,
+                 link_alpha=0.7):
+        """
+        :param user_locations: Array [num_users, 2 (lat, lon)].
+        :param satellite_positions: Array [num_satellites, num_steps, 2 (lat, lon)], or a PositionTensor
+                                    (its lat/lon view is derived here).
+        :param assignments: Optional array [num_users, num_steps] of satellite indices (user -> satellite per frame);
+                            computed with assign_users(user_locations, satellite_positions, k) if omitted.
+        :param k: Nearest satellites scored per user when computing the assignments (k=1 links to the nearest).
+        :param title: Axes title.
+        """
+        self.users = np.asarray(user_locations, dtype=float).reshape(-1, 2)
+        if isinstance(satellite_positions, PositionTensor):
+            satellite_positions = satellite_positions.latlon
+        self.satellite_positions = satellite_positions
+        if assignments is None:
+            assignments, _ = assign_users(self.users, satellite_positions, k)
+        self.assignments = np.asarray(assignments)
+        self.num_frames = satellite_positions.shape[1]
+
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        ax = self.ax
+        self.satellite_scatter = ax.scatter([], [], color="red", label="Satellites", alpha=0.6, animated=True)
+        self.user_scatter = ax.scatter(self.users[:, 1], self.users[:, 0], color="blue", label="Users", alpha=0.6)
+        self.links = LineCollection([], colors=link_color, linewidths=link_width, alpha=link_alpha, zorder=2,
+                                    animated=True)
+        ax.add_collection(self.links)
+        ax.set_xlim(-180, 180)
+        ax.set_ylim(-90, 90)
+        ax.set_xlabel("Longitude")
+        ax.set_ylabel("Latitude")
+        ax.set_title(title)
+        ax.legend(loc="upper left")
+        ax.grid(True)
+
+    def segments(self, frame):
+        """
+        :return: Link segments of a frame, see link_segments.
+        """
+        satellites = self.satellite_positions[self.assignments[:, frame], frame]
+        return link_segments(self.users[:, 0], self.users[:, 1], satellites[:, 0], satellites[:, 1])
+
+    def _init(self):
+        self.satellite_scatter.set_offsets(np.empty((0, 2)))
+        self.links.set_segments([])
+        return self.satellite_scatter, self.links
+
+    def update(self, frame):
+        """
+        Move the satellites and links to a frame.
+        :return: Tuple of the artists that changed (for blitting).
+        """
+        frame_positions = self.satellite_positions[:, frame]
+        self.satellite_scatter.set_offsets(frame_positions[:, ::-1])
+        self.links.set_segments(self.segments(frame))
+        return self.satellite_scatter, self.links
+
+    def animate(self, interval=500, frames=None):
+        """
+        Blitted FuncAnimation over the frames (keep a reference to it while it is shown).
+        :param interval: Delay between frames in milliseconds.
+        :param frames: Frames to show (default: every step).
+        """
+        frames = range(self.num_frames) if frames is None else frames
+        return FuncAnimation(self.fig, self.update, frames=frames, init_func=self._init, interval=interval, blit=True)
+
+    def save(self, path, fps=10, dpi=100, frames=None):
+        """
+        Render without a window.
+        :param path: Video or GIF file (any format matplotlib has a writer for, e.g. .mp4 with ffmpeg, .gif with
+                     Pillow), or PNG frames: a .png path with a %-format for the frame number
+                     (e.g. "frames/links_%05d.png"), or a plain .png path that gets _00000, _00001... appended.
+        :param fps: Frames per second of the video.
+        :param dpi: Resolution.
+        :param frames: Frames to render (default: every step).
+        :return: List of written PNG paths, or [path] for a video.
+        """
+        frames = range(self.num_frames) if frames is None else frames
+        # Animated artists are left out of regular draws, which is all a headless render does
+        moving = self._init()
+        for artist in moving:
+            artist.set_animated(False)
+        try:
+            return self._save(path, fps, dpi, frames)
+        finally:
+            for artist in moving:
+                artist.set_animated(True)
+
+    def _save(self, path, fps, dpi, frames):
+        if not path.lower().endswith(".png"):
+            animation = FuncAnimation(self.fig, self.update, frames=frames, init_func=self._init, blit=False)
+            animation.save(path, fps=fps, dpi=dpi)
+            return [path]
+        if "%" not in path:
+            root, extension = os.path.splitext(path)
+            path = root + "_%05d" + extension
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        written = []
+        for frame in frames:
+            self.update(frame)
+            self.fig.savefig(path % frame, dpi=dpi)
+            written.append(path % frame)
+        return written
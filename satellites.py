@@ -1,55 +1,68 @@
-import requests
-import ephem
-import numpy as np
 import datetime
+import numpy as np
+import instrumentation
+import propagation
+import tle
+from ephemeris_cache import cache_key
+from geometry import EARTH_RADIUS_KM, SPEED_OF_LIGHT_KM_S, haversine, look_geometry, look_geometry_ecef, unit_to_latlon
+
+DEFAULT_SATELLITE_ALTITUDE_KM = 550.0
+
 
 def fetch_multiple_tle_from_url(tle_url, num_satellites=10):
     """
     Fetch TLE lines for the first N satellites in a TLE file.
-    :param tle_url: URL of the TLE file.
+    :param tle_url: URL or local path (e.g. stations.txt) of the TLE file.
     :param num_satellites: Number of satellites to fetch TLE data for.
     :return: List of tuples, each containing (satellite name, TLE line 1, TLE line 2).
     """
-    response = requests.get(tle_url)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch TLE data from {tle_url}")
+    return tle.fetch_multiple_tle_from_url(tle_url, num_satellites)
 
-    lines = response.text.splitlines()
-    satellites_data = []
-    i = 0
-    while i < len(lines) and len(satellites_data) < num_satellites:
-        name = lines[i].strip()
-        if i + 2 < len(lines):  # Ensure there are two more lines for TLE data
-            tle_line1 = lines[i + 1].strip()
-            tle_line2 = lines[i + 2].strip()
-            satellites_data.append((name, tle_line1, tle_line2))
-        i += 3  # Move to the next satellite (name + 2 TLE lines)
-    return satellites_data
+
+def pinned_start_time(resolution=3600):
+    """
+    Current UTC time floored to a multiple of resolution, so repeated runs share a cache key.
+    :param resolution: Granularity in seconds.
+    :return: Timezone-aware datetime.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    return datetime.datetime.fromtimestamp(now - now % resolution, datetime.timezone.utc)
 
 
-def generate_satellite_positions(tle_data, time_step, num_steps):
+@instrumentation.timed("satellites.generate_satellite_positions")
+def generate_satellite_positions(tle_data, time_step, num_steps, start_time=None, backend="numpy", workers=None,
+                                 cache=None):
     """
     Generate positions for satellites over time.
-    :param tle_data: List of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param tle_data: Catalog array (tle.load_tle_catalog) or list of tuples (satellite_name, TLE line 1, TLE line 2).
     :param time_step: Time interval between steps (in seconds).
     :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step, pin it to make runs reproducible (None means now, UTC).
+    :param backend: "numpy" for the vectorized propagator, "ephem" for the reference implementation,
+                    "chebyshev" for the numpy model interpolated from coarse segments (fine time steps).
+    :param workers: Number of processes for the numpy backend (None or 1 runs serially, 0 uses every core).
+    :param cache: Optional EphemerisCache. Hits are returned as read-only memory maps shared with other
+                  processes (copy one to modify it); misses and cache=None return a new writable array.
     :return: NumPy array of shape [num_satellites, num_steps, 2 (lat, lon)].
     """
-    observer = ephem.Observer()
-    observer.lat, observer.lon = '0', '0'  # Example location (Equator)
-
-    num_satellites = len(tle_data)
-    positions = np.zeros((num_satellites, num_steps, 2))  # [num_satellites, num_steps, 2 (lat, lon)]
-
-    for sat_index, (name, tle_line1, tle_line2) in enumerate(tle_data):
-        sat = ephem.readtle(name, tle_line1, tle_line2)
-        for step in range(num_steps):
-            time_offset = datetime.timedelta(seconds=step * time_step)
-            observer.date = datetime.datetime.now(datetime.timezone.utc) + time_offset
-            sat.compute(observer)
-            positions[sat_index, step, 0] = np.degrees(sat.sublat)  # Latitude
-            positions[sat_index, step, 1] = np.degrees(sat.sublong)  # Longitude
-
+    if backend not in propagation.BACKENDS:
+        raise ValueError(f"Unknown propagation backend {backend!r}")
+    if start_time is None:
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+
+    if cache is not None:
+        key = cache_key(tle_data, start_time, time_step, num_steps, backend)
+        positions = cache.load(key)
+        if positions is not None:
+            return positions
+
+    if backend == "numpy" and workers is not None and workers != 1:
+        positions = propagation.propagate_parallel(tle_data, time_step, num_steps, start_time, workers or None)
+    else:
+        positions = propagation.BACKENDS[backend](tle_data, time_step, num_steps, start_time)
+
+    if cache is not None:
+        cache.store(key, positions)
     return positions
 
 
@@ -79,6 +92,66 @@ def calculate_synchronization(user_lat, user_lon, sat_lat, sat_lon):
     return np.abs(user_lat - sat_lat) + np.abs(user_lon - sat_lon)
 
 
+@instrumentation.timed("satellites.calculate_propagation_latency")
+def calculate_propagation_latency(user_lat, user_lon, sat_lat=None, sat_lon=None, sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM,
+                                  model="slant", base_latency=0, elevation_mask=None, sat_ecef=None):
+    """
+    Physical one-way latency between users and satellites. All arguments broadcast, so a full
+    [num_users, num_satellites] matrix can be scored in one call (e.g. user_lat[:, None], sat_lat[None, :]).
+    Satellites are given either as sub-satellite points with their altitude, or directly as Earth-fixed
+    positions (sat_ecef), which carry the real altitude of every satellite.
+    :param user_lat: User latitude(s) in degrees.
+    :param user_lon: User longitude(s) in degrees.
+    :param sat_lat: Satellite latitude(s) in degrees (unused with sat_ecef).
+    :param sat_lon: Satellite longitude(s) in degrees (unused with sat_ecef).
+    :param sat_alt: Satellite altitude(s) in km, e.g. PositionTensor.altitude[time] (unused with sat_ecef).
+    :param model: "slant" for the straight-line range from the ground to the satellite (ECEF),
+                  "haversine" for the great-circle ground distance to the sub-satellite point.
+    :param base_latency: Fixed processing latency added on top, in ms.
+    :param elevation_mask: Minimum elevation in degrees; satellites below it get an infinite latency.
+    :param sat_ecef: Optional satellite position(s) in km, shape [..., 3], e.g. PositionTensor.ecef(time)
+                     or propagation.generate_satellite_ecef (user_lat[:, None] against sat_ecef[None, :]).
+    :return: Latency in ms.
+    """
+    if sat_ecef is not None:
+        sat_ecef = np.asarray(sat_ecef, dtype=float)
+        sat_lat, sat_lon = unit_to_latlon(sat_ecef)
+    elif sat_lat is None or sat_lon is None:
+        raise ValueError("Satellites need sat_lat and sat_lon, or sat_ecef")
+    if model == "slant" or elevation_mask is not None:
+        if sat_ecef is not None:
+            slant_range, elevation = look_geometry_ecef(user_lat, user_lon, sat_ecef)
+        else:
+            slant_range, elevation = look_geometry(user_lat, user_lon, sat_lat, sat_lon, sat_alt)
+    if model == "slant":
+        distance = slant_range
+    elif model == "haversine":
+        distance = haversine(user_lat, user_lon, sat_lat, sat_lon) * EARTH_RADIUS_KM
+    else:
+        raise ValueError(f"Unknown latency model {model!r}")
+
+    latency = base_latency + distance / SPEED_OF_LIGHT_KM_S * 1000
+    if elevation_mask is not None:
+        latency = np.where(elevation >= elevation_mask, latency, np.inf)
+    return latency
+
+
+def _slant_latency(user_lat, user_lon, sat_lat, sat_lon):
+    return calculate_propagation_latency(user_lat, user_lon, sat_lat, sat_lon, model="slant")
+
+
+def _haversine_latency(user_lat, user_lon, sat_lat, sat_lon):
+    return calculate_propagation_latency(user_lat, user_lon, sat_lat, sat_lon, model="haversine")
+
+
+# Latency models selectable by name, all with the calculate_latency signature
+LATENCY_MODELS = {
+    "flat": calculate_latency,
+    "slant": _slant_latency,
+    "haversine": _haversine_latency,
+}
+
+
 if __name__ == "__main__":
     # Fetch TLE data
     TLE_URL = "https://celestrak.com/NORAD/elements/stations.txt"
@@ -105,50 +178,24 @@ if __name__ == "__main__":
 def fetch_tle_data(tle_url, num_satellites=10):
     """
     Fetch real TLE data for satellites from Celestrak.
-    :param tle_url: URL of the TLE file.
+    :param tle_url: URL or local path of the TLE file.
     :param num_satellites: Number of satellites to fetch.
     :return: List of (satellite name, TLE line 1, TLE line 2).
     """
-    response = requests.get(tle_url)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch TLE data from {tle_url}")
-
-    lines = response.text.splitlines()
-    tle_data = []
-
-    # Parsing TLE data
-    for i in range(0, len(lines), 3):
-        if i + 2 < len(lines):
-            satellite_name = lines[i].strip()
-            tle_line1 = lines[i + 1].strip()
-            tle_line2 = lines[i + 2].strip()
-            tle_data.append((satellite_name, tle_line1, tle_line2))
+    return tle.fetch_multiple_tle_from_url(tle_url, num_satellites)
 
-        if len(tle_data) >= num_satellites:
-            break
 
-    return tle_data
-def generate_dynamic_satellite_positions(tle_data, num_steps, time_step=60):
+@instrumentation.timed("satellites.generate_dynamic_satellite_positions")
+def generate_dynamic_satellite_positions(tle_data, num_steps, time_step=60, start_time=None, backend="numpy",
+                                         cache=None):
     """
-    Generate positions for satellites over time using pyephem and real TLE data.
+    Generate positions for satellites over time using real TLE data.
     :param tle_data: List of (satellite_name, TLE line 1, TLE line 2).
     :param num_steps: Number of time steps to simulate.
     :param time_step: Time interval between each step (in seconds).
+    :param start_time: datetime of the first step (None means now, UTC).
+    :param backend: Propagation backend, see generate_satellite_positions.
+    :param cache: Optional EphemerisCache (hits are read-only, see generate_satellite_positions).
     :return: NumPy array of shape [num_satellites, num_steps, 2 (lat, lon)].
     """
-    observer = ephem.Observer()
-    observer.lat, observer.lon = '0', '0'  # Set observer at equator for simplicity
-    observer.elevation = 0  # Sea level
-
-    num_satellites = len(tle_data)
-    positions = np.zeros((num_satellites, num_steps, 2))  # [num_satellites, num_steps, 2 (lat, lon)]
-
-    for sat_index, (sat_name, tle_line1, tle_line2) in enumerate(tle_data):
-        sat = ephem.readtle(sat_name, tle_line1, tle_line2)
-        for step in range(num_steps):
-            observer.date = ephem.now() + ephem.second * step * time_step
-            sat.compute(observer)
-            positions[sat_index, step, 0] = np.degrees(sat.sublat)  # Latitude
-            positions[sat_index, step, 1] = np.degrees(sat.sublong)  # Longitude
-
-    return positions
\ No newline at end of file
+    return generate_satellite_positions(tle_data, time_step, num_steps, start_time, backend, cache=cache)
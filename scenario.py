@@ -0,0 +1,158 @@
+import datetime
+import numpy as np
+from geometry import EARTH_RADIUS_KM
+from session_information import SessionTable
+from tle import TLE_DTYPE, parse_tle_record, tle_checksum
+from users_information import UserTable
+
+# City: (latitude, longitude, metro population in millions)
+CITIES = {
+    "New York": (40.7128, -74.0060, 18.8),
+    "Los Angeles": (34.0522, -118.2437, 12.5),
+    "London": (51.5074, -0.1278, 9.5),
+    "Tokyo": (35.6762, 139.6503, 37.4),
+    "Paris": (48.8566, 2.3522, 11.1),
+}
+# Default arrival window: 2021-01-01 to 2022-12-31 (UTC timestamps)
+DEFAULT_START_TIME = 1609459200
+DEFAULT_END_TIME = 1672444800
+SCENARIO_FORMAT_VERSION = 1
+
+
+def walker_catalog(num_satellites, planes=None, inclination=53.0, mean_motion=15.05,
+                   epoch=datetime.datetime(2024, 11, 27), first_norad_id=50000):
+    """
+    Synthetic Walker-delta constellation as a TLE catalog, for offline runs at any scale.
+    Satellites are spread evenly over `planes` planes (about sqrt(num_satellites / 2) by default)
+    with a one-slot phase offset between neighbouring planes; the TLE lines are well formed.
+    :param num_satellites: Number of satellites.
+    :param planes: Number of orbital planes.
+    :param inclination: Inclination in degrees.
+    :param mean_motion: Revolutions per day (15.05 is about 550 km).
+    :param epoch: datetime of the element set.
+    :param first_norad_id: NORAD id of the first satellite.
+    :return: Catalog array of TLE_DTYPE.
+    """
+    if planes is None:
+        planes = max(1, int(round(np.sqrt(num_satellites / 2))))
+    per_plane = -(-num_satellites // planes)
+    day_of_year = (epoch - datetime.datetime(epoch.year, 1, 1)) / datetime.timedelta(days=1) + 1
+    records = []
+    for n in range(num_satellites):
+        plane, slot = divmod(n, per_plane)
+        norad_id = first_norad_id + n
+        raan = 360.0 * plane / planes
+        mean_anomaly = (360.0 * slot / per_plane + 360.0 * plane / (planes * per_plane)) % 360
+        line1 = (f"1 {norad_id:05d}U 24001A   {epoch.year % 100:02d}{day_of_year:012.8f} "
+                 f" .00000000  00000+0  00000+0 0  999")
+        line2 = (f"2 {norad_id:05d} {inclination:8.4f} {raan:8.4f} 0001000 {0.0:8.4f} {mean_anomaly:8.4f} "
+                 f"{mean_motion:11.8f}{1:5d}")
+        records.append(parse_tle_record(f"WALKER-{n}", line1 + str(tle_checksum(line1)),
+                                        line2 + str(tle_checksum(line2))))
+    return np.array(records, dtype=TLE_DTYPE)
+
+
+def place_users(rng, num_users, cities=CITIES, spread_km=50.0):
+    """
+    Draw user locations around cities, each city chosen with probability proportional to its population.
+    Offsets from the city centre are Gaussian with standard deviation spread_km in each direction.
+    :param rng: numpy.random.Generator.
+    :param num_users: Number of users.
+    :param cities: Dict name -> (lat, lon, population).
+    :param spread_km: Standard deviation of the distance to the city centre along each axis.
+    :return: Tuple (city codes [num_users], latitudes, longitudes, city names).
+    """
+    names = list(cities)
+    centres = np.array([cities[name] for name in names], dtype=float)
+    city = rng.choice(len(names), size=num_users, p=centres[:, 2] / centres[:, 2].sum())
+    north, east = rng.normal(0.0, spread_km, (2, num_users))
+    latitude = np.clip(centres[city, 0] + np.degrees(north / EARTH_RADIUS_KM), -90, 90)
+    longitude = centres[city, 1] + np.degrees(east / (EARTH_RADIUS_KM * np.cos(np.radians(latitude))))
+    longitude = (longitude + 180) % 360 - 180
+    return city, latitude, longitude, np.array(names)
+
+
+def session_sizes(rng, num_sessions, max_users_per_session, distribution="uniform"):
+    """
+    Draw the number of users of every session.
+    :param distribution: "uniform" on 1..max_users_per_session, or "geometric" (mean ~2, capped at the max):
+                         mostly pairs and small groups with a few large ones.
+    :return: Array [num_sessions] of sizes >= 1.
+    """
+    if distribution == "uniform":
+        return rng.integers(1, max_users_per_session + 1, num_sessions)
+    if distribution == "geometric":
+        return np.minimum(rng.geometric(0.5, num_sessions), max_users_per_session)
+    raise ValueError(f"Unknown session size distribution {distribution!r}")
+
+
+def generate_scenario(num_sessions, max_users_per_session, seed=None, cities=CITIES, spread_km=50.0,
+                      size_distribution="uniform", start_time=DEFAULT_START_TIME, end_time=DEFAULT_END_TIME,
+                      join_delay=60.0):
+    """
+    Generate sessions and their users in one shot, reproducibly.
+    Sessions arrive as a Poisson process over [start_time, end_time) (sorted uniform arrival times);
+    each user joins its session an exponential delay (mean join_delay seconds) after it arrives.
+    :param num_sessions: Number of sessions.
+    :param max_users_per_session: Maximum number of users in a single session.
+    :param seed: Seed of the numpy.random.Generator; the same seed gives the same scenario.
+    :param cities: Dict name -> (lat, lon, population) users are placed around.
+    :param spread_km: Spread of users around their city (see place_users).
+    :param size_distribution: See session_sizes.
+    :param start_time: First possible arrival (UTC timestamp).
+    :param end_time: End of the arrival window (UTC timestamp).
+    :param join_delay: Mean delay in seconds between a session's arrival and each user's create_time.
+    :return: SessionTable (session ids 0..num_sessions-1, user ids 0..num_users-1).
+    """
+    rng = np.random.default_rng(seed)
+    sizes = session_sizes(rng, num_sessions, max_users_per_session, size_distribution)
+    num_users = int(sizes.sum())
+    arrival = np.sort(rng.uniform(start_time, end_time, num_sessions))
+    session_id = np.repeat(np.arange(num_sessions), sizes)
+    create_time = arrival[session_id] + rng.exponential(join_delay, num_users)
+    city, latitude, longitude, names = place_users(rng, num_users, cities, spread_km)
+    bandwidth = rng.integers(2, 5, num_sessions)
+
+    users = UserTable(np.arange(num_users), latitude, longitude, create_time.astype(np.int64), session_id,
+                      city, names)
+    offsets = np.zeros(num_sessions + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return SessionTable(np.arange(num_sessions), offsets, users, bandwidth)
+
+
+def generate_sessions(num_sessions, max_users_per_session, seed=None):
+    """
+    Generate a list of session objects with randomized users.
+    :param num_sessions: Number of sessions to generate.
+    :param max_users_per_session: Maximum number of users in a single session.
+    :param seed: Optional seed for a reproducible list.
+    :return: A list of session instances (views of one SessionTable).
+    """
+    return list(generate_scenario(num_sessions, max_users_per_session, seed))
+
+
+def save_scenario(path, sessions):
+    """
+    Write a SessionTable to a compressed .npz file (relay state is not saved).
+    :param path: Destination path.
+    :param sessions: SessionTable.
+    """
+    users = sessions.users
+    np.savez_compressed(path, version=SCENARIO_FORMAT_VERSION, session_ids=sessions.ids, offsets=sessions.offsets,
+                        bandwidth=sessions.bandwidth, user_ids=users.ids, latitude=users.latitude,
+                        longitude=users.longitude, create_time=users.create_time, session_id=users.session_id,
+                        city=users.city, city_names=users.city_names)
+
+
+def load_scenario(path):
+    """
+    Read a scenario written by save_scenario.
+    :param path: .npz path.
+    :return: SessionTable.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        if int(data["version"]) != SCENARIO_FORMAT_VERSION:
+            raise ValueError(f"Unsupported scenario format version {int(data['version'])} in {path}")
+        users = UserTable(data["user_ids"], data["latitude"], data["longitude"], data["create_time"],
+                          data["session_id"], data["city"], data["city_names"])
+        return SessionTable(data["session_ids"], data["offsets"], users, data["bandwidth"])
@@ -1,4 +1,7 @@
+import numpy as np
+import instrumentation
 import users_information
+from geometry import latlon_to_unit, unit_to_latlon
 import allocation
 import random
 
@@ -32,21 +35,37 @@ class session:
     def add_user(self, to_add):
         self.user.append(to_add)
 
-    def find_k_central(self, satellite_positions, time, k):
+    @instrumentation.timed("session.find_k_central")
+    def find_k_central(self, satellite_positions, time, k, candidates=None):
         """
         Find the k-central satellites based on user locations.
-        :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)].
-        :param time: Time index to consider for satellite positions.
+        :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)],
+                                    or one simulation frame [num_satellites, 2] when time is None,
+                                    or a PositionTensor.
+        :param time: Time index to consider for satellite positions (None for a single frame).
         :param k: Number of central satellites to find.
+        :param candidates: Optional satellite indices to restrict the search to (e.g. the visible ones).
         """
-        self.cu_set = users_information.k_center(self.user, satellite_positions, time, k)
+        self.cu_set = users_information.k_center(self.user, satellite_positions, time, k, candidates=candidates)
 
-    def find_best_relay(self, all_path_set, satellite_num, bandwidth, isl_capacity, isl_max, antenna):
+    @instrumentation.timed("session.find_best_relay")
+    def find_best_relay(self, all_path_set, satellite_num, bandwidth, isl_capacity, isl_max, antenna, visible=None,
+                        gateways=None):
         # TODO:
         self.best_user_relay_path = []
         set_num = len(self.cu_set)
+        if set_num == 0:
+            # No central satellite at all (e.g. none visible), same outcome as no feasible relay
+            instrumentation.count("session.no_relay")
+            self.best_relay = None
+            return 0
         delay_set = [99999 for i in range(set_num)]
+        # Path allocate picked for every user, per relay, reused when committing the best relay
+        chosen_paths = [[] for i in range(set_num)]
         for i in range(set_num):
+            # A relay nobody can see is hopeless, skip its allocation attempts
+            if visible is not None and self.cu_set[i] not in visible:
+                continue
             flag = True
             hop = 0
             for user_index in range(len(self.user)):
@@ -54,37 +73,233 @@ class session:
                     flag = False
                     break
                 current_path = allocation.allocate(all_path_set[user_index][i], satellite_num, bandwidth, isl_capacity,
-                                                   isl_max, antenna)
+                                                   isl_max, antenna, gateways)
                 if current_path == 0:
                     flag = False
                     break
+                chosen_paths[i].append(current_path)
                 hop += (len(current_path) - 1)
             if flag:
                 delay_set[i] = hop
             else:
                 delay_set[i] = 99999
         if min(delay_set) == 99999:
+            instrumentation.count("session.no_relay")
             self.best_relay = None
             return 0
+        # Spread of the users' hop counts around their mean (the batch_allocation score)
         variation = [99999 for i in range(set_num)]
         for i in range(set_num):
             if delay_set[i] == 99999:
-                variation[i] = 99999
                 continue
             ave = delay_set[i] / (len(self.user))
+            variation[i] = 0
             for user_index in range(len(self.user)):
-                variation[i] += abs(delay_set[i] - ave)
+                variation[i] += abs((len(chosen_paths[i][user_index]) - 1) - ave)
         total_set = [99999 for i in range(set_num)]
         for i in range(set_num):
             total_set[i] = delay_set[i] / len(self.user) + 50 * variation[i]
-        self.best_relay = self.cu_set[total_set.index(min(total_set))]
+        best_index = total_set.index(min(total_set))
+        self.best_relay = self.cu_set[best_index]
         for user_index in range(len(self.user)):
-            self.best_user_relay_path.append(
-                allocation.allocate(all_path_set[user_index][i], satellite_num, bandwidth, isl_capacity, isl_max,
-                                    antenna))
-            self.user[user_index].path = allocation.allocate(all_path_set[user_index][i], satellite_num, bandwidth,
-                                                             isl_capacity, isl_max, antenna)
+            self.best_user_relay_path.append(chosen_paths[best_index][user_index])
+            self.user[user_index].path = chosen_paths[best_index][user_index]
 
     def switch_relay(self):
         self.current_relay = self.best_relay
-        self.current_user_relay_path = self.best_user_relay_path
\ No newline at end of file
+        self.current_user_relay_path = self.best_user_relay_path
+
+def _relay_column(name):
+    """
+    Property mapping a relay attribute to the int column `name` of the table (-1 stands for None).
+    """
+    def get(self):
+        value = getattr(self.table, name)[self.row]
+        return None if value < 0 else int(value)
+
+    def set(self, value):
+        getattr(self.table, name)[self.row] = -1 if value is None else value
+    return property(get, set)
+
+
+def _state_column(name, factory=None):
+    """
+    Property mapping an attribute to the dict `name` of the table, keyed by row.
+    Rows without a value read as None, or as a new factory() stored for the row.
+    """
+    def get(self):
+        values = getattr(self.table, name)
+        if factory is None:
+            return values.get(self.row)
+        return values.setdefault(self.row, factory())
+
+    def set(self, value):
+        getattr(self.table, name)[self.row] = value
+    return property(get, set)
+
+
+class SessionView(session):
+    """
+    A row of a SessionTable with the session API: its users are a UserRange of the table's users,
+    and the relay state read and written by find_k_central / find_best_relay / switch_relay goes
+    to the table.
+    """
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    id = property(lambda self: int(self.table.ids[self.row]))
+
+    @property
+    def user(self):
+        return users_information.UserRange(self.table.users, self.table.offsets[self.row],
+                                           self.table.offsets[self.row + 1])
+
+    @property
+    def bandwidth(self):
+        return int(self.table.bandwidth[self.row])
+
+    @bandwidth.setter
+    def bandwidth(self, value):
+        self.table.bandwidth[self.row] = value
+
+    def add_user(self, to_add):
+        raise ValueError("Users of a SessionTable are fixed, build a new table to add users")
+
+    best_relay = _relay_column("best_relay")
+    current_relay = _relay_column("current_relay")
+    cu_set = _state_column("cu_set")
+    best_user_relay_path = _state_column("best_paths", list)
+    current_user_relay_path = _state_column("current_paths", list)
+
+
+class SessionTable:
+    """
+    Columnar store of sessions over a UserTable sorted by session: the users of session i are rows
+    offsets[i]:offsets[i + 1] of `users`. Relays are int arrays (-1 for none); candidate sets and
+    paths are kept in dicts filled on demand. table[i] is a SessionView usable wherever a session is.
+    """
+
+    def __init__(self, ids, offsets, users, bandwidth=None):
+        """
+        :param ids: Array [num_sessions] of session ids.
+        :param offsets: Array [num_sessions + 1] of user row offsets.
+        :param users: UserTable sorted by session.
+        :param bandwidth: Array [num_sessions] of bandwidths (random 2-4 like session() if omitted).
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.users = users
+        if bandwidth is None:
+            bandwidth = np.random.default_rng().integers(2, 5, len(self.ids))
+        self.bandwidth = np.asarray(bandwidth, dtype=np.int64)
+        self.best_relay = np.full(len(self.ids), -1, dtype=np.int64)
+        self.current_relay = np.full(len(self.ids), -1, dtype=np.int64)
+        self.cu_set = {}
+        self.best_paths = {}
+        self.current_paths = {}
+
+    @classmethod
+    def from_users(cls, users, bandwidth=None):
+        """
+        Group a UserTable by session_id.
+        :param users: UserTable in any order.
+        :param bandwidth: Optional array of bandwidths, one per distinct session id (ascending).
+        """
+        order = np.argsort(users.session_id, kind="stable")
+        users = users.take(order)
+        ids, counts = np.unique(users.session_id, return_counts=True)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(ids, offsets, users, bandwidth)
+
+    @classmethod
+    def from_sessions(cls, session_list):
+        """
+        Build a table from session objects (their relay state is not copied).
+        """
+        user_list = [u for s in session_list for u in s.get_user()]
+        counts = [len(s.get_user()) for s in session_list]
+        offsets = np.zeros(len(session_list) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls([s.id for s in session_list], offsets, users_information.UserTable.from_users(user_list),
+                   [s.bandwidth for s in session_list])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        return SessionView(self, row)
+
+    def __iter__(self):
+        return (SessionView(self, row) for row in range(len(self)))
+
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def reduce(self, ufunc, values, empty):
+        """
+        Reduce a per-user column over the users of every session, e.g. reduce(np.minimum, create_time, inf).
+        Only the starts of non-empty sessions go to ufunc.reduceat, which would otherwise cut the
+        preceding session short (or read past the end) at an empty one.
+        :param ufunc: Binary NumPy ufunc (np.add, np.minimum, ...).
+        :param values: Array [num_users, ...] in table user order.
+        :param empty: Value of sessions without users.
+        :return: Array [num_sessions, ...].
+        """
+        values = np.asarray(values)
+        nonempty = self.sizes() > 0
+        result = np.full((len(self),) + values.shape[1:], empty,
+                         dtype=np.result_type(values, empty))
+        if nonempty.any():
+            result[nonempty] = ufunc.reduceat(values, self.offsets[:-1][nonempty], axis=0)
+        return result
+
+    def centers(self):
+        """
+        Spherical centroid of every session (find_user_center for all sessions at once).
+        :return: Array [num_sessions, 2 (lat, lon)], NaN for sessions without users.
+        """
+        sums = self.reduce(np.add, latlon_to_unit(self.users.latitude, self.users.longitude).reshape(-1, 3), np.nan)
+        return np.column_stack(unit_to_latlon(sums))
+
+    @instrumentation.timed("session.SessionTable.find_k_central")
+    def find_k_central(self, satellite_positions, time, k, rows=None):
+        """
+        session.find_k_central for every session (or the given rows) in one batch, see users_information.k_center_batch.
+        Sessions without users get an empty cu_set.
+        :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)],
+                                    or one simulation frame [num_satellites, 2] when time is None,
+                                    or a PositionTensor.
+        :param time: Time index to consider for satellite positions (None for a single frame).
+        :param k: Number of central satellites per session.
+        :param rows: Optional session rows to update (default: all).
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.intp)
+        indices = users_information.k_center_batch(self.centers()[rows], satellite_positions, time, k)
+        for row, central in zip(rows.tolist(), indices.tolist()):
+            self.cu_set[row] = [index for index in central if index >= 0]
+
+
+def find_k_central_all(session_list, satellite_positions, time, k):
+    """
+    Refresh the cu_set of many sessions with one batched nearest-satellite search instead of a
+    find_k_central call per session.
+    :param session_list: SessionTable, or list of session objects (SessionViews included).
+    :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)],
+                                or one simulation frame [num_satellites, 2] when time is None,
+                                or a PositionTensor.
+    :param time: Time index to consider for satellite positions (None for a single frame).
+    :param k: Number of central satellites per session.
+    """
+    if isinstance(session_list, SessionTable):
+        session_list.find_k_central(satellite_positions, time, k)
+        return
+    centers = np.full((len(session_list), 2), np.nan)
+    for row, s in enumerate(session_list):
+        if s.user:
+            centers[row] = users_information.find_user_center(s.user)
+    indices = users_information.k_center_batch(centers, satellite_positions, time, k)
+    for s, central in zip(session_list, indices.tolist()):
+        s.cu_set = [index for index in central if index >= 0]
@@ -0,0 +1,59 @@
+from collections import namedtuple
+import numpy as np
+from assignment import assign_step
+from geometry import look_geometry
+from propagation import iter_positions
+from satellites import DEFAULT_SATELLITE_ALTITUDE_KM
+from session_information import find_k_central_all
+from spatial_index import SatelliteIndex
+
+# One timestep of a simulation run
+# positions:   [num_satellites, 2 (lat, lon)]
+# candidates:  [num_users, k] nearest satellites per user (None without users)
+# visibility:  [num_users, k] candidate above the elevation mask (None without users)
+# assignments: [num_users] chosen satellite per user (None without users)
+# costs:       [num_users] cost of the chosen satellite (None without users)
+Frame = namedtuple("Frame", ["step", "jd", "positions", "candidates", "visibility", "assignments", "costs"])
+
+
+def simulate(tle_data, time_step, num_steps, start_time=None, users=None, sessions=None, k=3,
+             elevation_mask=None, sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM, block_steps=64, latency_model="flat"):
+    """
+    Run the time-stepped simulation lazily, one frame per step.
+    Nothing of size num_steps is kept: satellites are propagated block_steps at a time and every
+    per-user array covers a single step, so peak memory depends on one step, not on the horizon.
+    Sessions get their k-central set refreshed in place (find_k_central_all, one batch) before their frame is yielded.
+    :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+    :param time_step: Time interval between steps (in seconds).
+    :param num_steps: Number of time steps.
+    :param start_time: datetime of the first step (None means now, UTC).
+    :param users: Optional array of user locations [num_users, 2 (lat, lon)] to assign every step.
+    :param sessions: Optional SessionTable or list of session objects whose k-central set is refreshed every step.
+    :param k: Number of candidate / central satellites.
+    :param elevation_mask: Minimum elevation in degrees for a candidate to count as visible (None: all visible).
+    :param sat_alt: Satellite altitude in km used for the visibility test.
+    :param block_steps: Steps propagated together.
+    :param latency_model: Name in satellites.LATENCY_MODELS used to score candidates.
+    :return: Generator of Frame.
+    """
+    if users is not None:
+        users = np.asarray(users, dtype=float).reshape(-1, 2)
+
+    for step, jd, positions in iter_positions(tle_data, time_step, num_steps, start_time, block_steps):
+        candidates = visibility = assignments = costs = None
+        # One index per frame, shared by the user assignment and every session
+        index = SatelliteIndex.for_step(positions, None)
+        if users is not None:
+            assignments, costs, candidates = assign_step(users, positions[:, 0], positions[:, 1], k, index,
+                                                         latency_model=latency_model)
+            if elevation_mask is None:
+                visibility = np.ones(candidates.shape, dtype=bool)
+            else:
+                _, elevation = look_geometry(users[:, 0:1], users[:, 1:2], positions[candidates, 0],
+                                             positions[candidates, 1], sat_alt)
+                visibility = elevation >= elevation_mask
+
+        if sessions is not None:
+            find_k_central_all(sessions, positions, None, k)
+
+        yield Frame(step, jd, positions, candidates, visibility, assignments, costs)
@@ -0,0 +1,96 @@
+import weakref
+import numpy as np
+from scipy.spatial import cKDTree
+from geometry import latlon_to_unit
+
+
+def chord_to_angle(chord):
+    """
+    Convert a chord length on the unit sphere to the central angle in degrees.
+    """
+    return np.degrees(2 * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1)))
+
+
+def angle_to_chord(angle):
+    """
+    Convert a central angle in degrees to a chord length on the unit sphere.
+    """
+    return 2 * np.sin(np.radians(np.asarray(angle, dtype=float)) / 2)
+
+
+class SatelliteIndex:
+    """
+    k-d tree over the sub-satellite points of one timestep.
+    Points are stored as unit vectors, so the chord distance the tree works with is monotonic in
+    great-circle distance: no special casing of the antimeridian or the poles is needed.
+    Queries are O(log n) per point and accept arrays of query locations.
+    """
+
+    # Last index built per positions array, so every caller at the same step shares one tree
+    _step_cache = {}
+
+    def __init__(self, sat_lats, sat_lons):
+        self.vectors = latlon_to_unit(np.asarray(sat_lats, dtype=float), np.asarray(sat_lons, dtype=float))
+        self.tree = cKDTree(self.vectors)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def from_units(cls, vectors):
+        """
+        Index over unit vectors [num_satellites, 3] directly, e.g. PositionTensor.frame(time).
+        """
+        index = cls.__new__(cls)
+        index.vectors = np.asarray(vectors, dtype=float)
+        index.tree = cKDTree(index.vectors)
+        return index
+
+    @classmethod
+    def for_step(cls, satellite_positions, time):
+        """
+        Index of satellite_positions[:, time], built once and reused for the same array and step.
+        :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)],
+                                    or a single frame [num_satellites, 2] when time is None.
+        :param time: Time index (None for a single frame).
+        :return: SatelliteIndex.
+        """
+        key = id(satellite_positions)
+        cached = cls._step_cache.get(key)
+        if cached is not None and cached[0]() is satellite_positions and cached[1] == time:
+            return cached[2]
+        frame = satellite_positions if time is None else satellite_positions[:, time]
+        index = cls(frame[:, 0], frame[:, 1])
+        try:
+            ref = weakref.ref(satellite_positions)
+        except TypeError:
+            return index
+        cls._step_cache.clear()
+        cls._step_cache[key] = (ref, time, index)
+        return index
+
+    def query(self, lat, lon, k):
+        """
+        Find the k nearest satellites (great-circle distance) to each query location.
+        :param lat: Latitude(s) in degrees.
+        :param lon: Longitude(s) in degrees.
+        :param k: Number of satellites per query (clamped to the number of satellites).
+        :return: Tuple (indices, distances) of shape lat.shape + (k,), distances in degrees of arc.
+        """
+        k = min(k, len(self))
+        points = latlon_to_unit(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+        chord, indices = self.tree.query(points, k=k)
+        chord = np.asarray(chord).reshape(points.shape[:-1] + (k,))
+        indices = np.asarray(indices).reshape(points.shape[:-1] + (k,))
+        return indices, chord_to_angle(chord)
+
+    def query_radius(self, lat, lon, radius):
+        """
+        Find every satellite within a great-circle radius of a location.
+        :param lat: Latitude in degrees.
+        :param lon: Longitude in degrees.
+        :param radius: Radius in degrees of arc.
+        :return: Sorted array of satellite indices.
+        """
+        point = latlon_to_unit(float(lat), float(lon))
+        return np.array(sorted(self.tree.query_ball_point(point, float(angle_to_chord(radius)))), dtype=int)
@@ -1,41 +1,17 @@
-import random
 import numpy as np
-from users_information import user
-from session_information import session
-from satellites import fetch_multiple_tle_from_url, generate_satellite_positions, calculate_latency, calculate_synchronization
+from scenario import generate_sessions
+from ephemeris_cache import EphemerisCache
+from spatial_index import SatelliteIndex
+from assignment import assign_users, session_user_locations
+from satellites import fetch_multiple_tle_from_url, generate_satellite_positions, pinned_start_time, calculate_latency, calculate_synchronization
 
-def generate_sessions(num_sessions, max_users_per_session):
-    """
-    Generate a list of session objects with randomized users.
-    """
-    sessions = []
-    user_id = 0
-
-    for session_id in range(num_sessions):
-        new_session = session(session_id)
-        num_users = random.randint(1, max_users_per_session)
-
-        for _ in range(num_users):
-            city = random.choice(["New York", "Los Angeles", "London", "Tokyo", "Paris"])
-            latitude = random.uniform(-90, 90)
-            longitude = random.uniform(-180, 180)
-            create_time = random.randint(1609459200, 1672444800)
-
-            new_user = user(user_id, city, latitude, longitude, create_time, session_id)
-            new_session.add_user(new_user)
-            user_id += 1
-
-        sessions.append(new_session)
-
-    return sessions
-
-
-def find_best_satellite(user_lat, user_lon, sat_lats, sat_longs, k=3):
+def find_best_satellite(user_lat, user_lon, sat_lats, sat_longs, k=3, index=None):
     """
     Find the best satellite for a user based on latency and synchronization.
     """
-    distances = np.sqrt((sat_lats - user_lat) ** 2 + (sat_longs - user_lon) ** 2)
-    closest_indices = np.argsort(distances)[:k]
+    if index is None:
+        index = SatelliteIndex(sat_lats, sat_longs)
+    closest_indices, _ = index.query(user_lat, user_lon, k)
 
     best_satellite = None
     min_cost = float('inf')
@@ -61,19 +37,18 @@ if __name__ == "__main__":
 
     TLE_URL = "https://celestrak.com/NORAD/elements/stations.txt"
     tle_data = fetch_multiple_tle_from_url(TLE_URL, num_satellites)
-    satellite_positions = generate_satellite_positions(tle_data, time_step, num_steps)
+    satellite_positions = generate_satellite_positions(tle_data, time_step, num_steps,
+                                                       start_time=pinned_start_time(), cache=EphemerisCache())
     generated_sessions = generate_sessions(num_sessions, max_users_per_session)
 
+    # Every (user, time slot) is assigned in one batch call
+    user_locations, users = session_user_locations(generated_sessions)
+    best_satellites, _ = assign_users(user_locations, satellite_positions, k)
+
     # Allocation results
     print("User-Satellite Allocation Results:")
     for time in range(num_steps):
         print(f"Time slot: {time + 1}")
-        sat_lats = satellite_positions[:, time, 0]
-        sat_longs = satellite_positions[:, time, 1]
-
-        for session in generated_sessions:
-            for user_obj in session.get_user():
-                user_lat, user_lon = user_obj.get_location()
-                best_satellite = find_best_satellite(user_lat, user_lon, sat_lats, sat_longs, k)
-
-                print(f"  Satellite {best_satellite} assigned to User {user_obj.get_id()} (Session {session.id})")
+        for user_index, user_obj in enumerate(users):
+            best_satellite = best_satellites[user_index, time]
+            print(f"  Satellite {best_satellite} assigned to User {user_obj.get_id()} (Session {user_obj.session})")
@@ -1,42 +1,212 @@
+import datetime
+import functools
+import os
+import numpy as np
 import requests
+from geometry import datetime_to_jd
+
+# One row per satellite; angles are kept in degrees as they appear in the TLE
+TLE_DTYPE = np.dtype([
+    ("norad_id", np.int32),
+    ("epoch_jd", np.float64),
+    ("inclination", np.float64),
+    ("raan", np.float64),
+    ("eccentricity", np.float64),
+    ("arg_perigee", np.float64),
+    ("mean_anomaly", np.float64),
+    ("mean_motion", np.float64),
+    ("bstar", np.float64),
+    ("ndot", np.float64),
+    ("name", "U24"),
+    ("line1", "S69"),
+    ("line2", "S69"),
+])
+
+
+# Byte -> checksum weight: digits count as their value, '-' as 1, everything else as 0
+_CHECKSUM_TABLE = bytes((b - 48) if 48 <= b <= 57 else (1 if b == 45 else 0) for b in range(256))
+
+
+def tle_checksum(line):
+    """
+    Modulo-10 checksum of a TLE line: digits count as their value, '-' counts as 1.
+    :param line: TLE line (at least 68 characters).
+    :return: Expected value of the last column.
+    """
+    return sum(line[:68].encode("ascii", "replace").translate(_CHECKSUM_TABLE)) % 10
+
+
+def valid_tle_line(line, line_number):
+    return (len(line) >= 69 and line[0] == str(line_number) and line[68].isdigit()
+            and tle_checksum(line) == ord(line[68]) - 48)
+
+
+def tle_epoch_to_jd(epoch_field):
+    """
+    Convert the TLE epoch field (YYDDD.DDDDDDDD) to a Julian date.
+    :param epoch_field: Epoch string or float as it appears in TLE line 1.
+    :return: Julian date as float.
+    """
+    epoch_field = float(epoch_field)
+    year = int(epoch_field // 1000)
+    day_of_year = epoch_field - year * 1000
+    return _year_start_jd(year) + day_of_year - 1
+
+
+@functools.lru_cache(maxsize=None)
+def _year_start_jd(two_digit_year):
+    year = two_digit_year + (2000 if two_digit_year < 57 else 1900)
+    return datetime_to_jd(datetime.datetime(year, 1, 1))
+
+
+def _implied_decimal(field):
+    """
+    Parse the TLE "assumed decimal point" exponent notation, e.g. ' 48999-3' -> 0.48999e-3.
+    """
+    field = field.strip()
+    if not field:
+        return 0.0
+    sign = -1.0 if field[0] == "-" else 1.0
+    field = field.lstrip("+-")
+    mantissa, exponent = field[:-2], field[-2:]
+    return sign * float("0." + mantissa) * 10.0 ** int(exponent)
+
+
+def _open_lines(source):
+    """
+    Yield text lines from a path, an http(s) URL, an open file object or any iterable of lines,
+    without reading it all at once.
+    """
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        with requests.get(source, stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                raise ValueError(f"Failed to fetch TLE data from {source}")
+            for line in response.iter_lines(decode_unicode=True):
+                yield line.decode() if isinstance(line, bytes) else line
+    elif isinstance(source, (str, os.PathLike)):
+        with open(os.fspath(source), "r") as f:
+            yield from f
+    else:
+        for line in source:
+            yield line.decode() if isinstance(line, bytes) else line
+
+
+def iter_tle(source, strict=True, validate=True):
+    """
+    Stream (name, TLE line 1, TLE line 2) tuples from a 2- or 3-line element source.
+    :param source: Local path, http(s) URL, file object or iterable of lines.
+    :param strict: Raise ValueError on a bad checksum; otherwise the entry is skipped.
+    :param validate: Check checksums here; turn off when the caller validates selectively.
+    :return: Generator of (satellite name, TLE line 1, TLE line 2).
+    """
+    name = ""
+    line1 = None
+    for raw in _open_lines(source):
+        line = raw.rstrip("\r\n")
+        if not line.strip():
+            continue
+        if line1 is None:
+            if line.startswith("1 ") and len(line.rstrip()) >= 69:
+                line1 = line.rstrip()
+            else:
+                name = line.strip()
+            continue
+        line2 = line.rstrip()
+        if not validate or (valid_tle_line(line1, 1) and valid_tle_line(line2, 2) and line1[2:7] == line2[2:7]):
+            yield name, line1, line2
+        elif strict:
+            raise ValueError(f"Invalid TLE for {name or line1[2:7]!r}")
+        name = ""
+        line1 = None
+
+
+def parse_tle_record(name, tle_line1, tle_line2):
+    """
+    Decode one TLE into a tuple matching TLE_DTYPE.
+    """
+    return (
+        int(tle_line1[2:7]),
+        tle_epoch_to_jd(tle_line1[18:32]),
+        float(tle_line2[8:16]),
+        float(tle_line2[17:25]),
+        float("0." + tle_line2[26:33].strip()),
+        float(tle_line2[34:42]),
+        float(tle_line2[43:51]),
+        float(tle_line2[52:63]),
+        _implied_decimal(tle_line1[53:61]),
+        float(tle_line1[33:43]),
+        name[:24],
+        tle_line1[:69].encode(),
+        tle_line2[:69].encode(),
+    )
+
+
+def load_tle_catalog(source, num_satellites=None, strict=True):
+    """
+    Load a TLE catalog into a structured NumPy array (see TLE_DTYPE).
+    :param source: Local path (e.g. the bundled stations.txt), file object, or http(s) URL.
+    :param num_satellites: Stop after this many satellites (None reads everything).
+    :param strict: Raise ValueError on a bad checksum; otherwise the entry is skipped.
+    :return: Structured array with one row per satellite.
+    """
+    records = []
+    for entry in iter_tle(source, strict):
+        records.append(parse_tle_record(*entry))
+        if num_satellites is not None and len(records) >= num_satellites:
+            break
+    return np.array(records, dtype=TLE_DTYPE)
+
+
+def to_catalog(tle_data):
+    """
+    Accept either a catalog array or a list of (name, line 1, line 2) tuples and return a catalog array.
+    """
+    if isinstance(tle_data, np.ndarray) and tle_data.dtype.names is not None:
+        return tle_data
+    return np.array([parse_tle_record(*entry) for entry in tle_data], dtype=TLE_DTYPE)
+
+
+def as_tuples(tle_data):
+    """
+    Accept either a catalog array or a list of tuples and return a list of (name, line 1, line 2).
+    """
+    if isinstance(tle_data, np.ndarray) and tle_data.dtype.names is not None:
+        return [(str(row["name"]), row["line1"].decode(), row["line2"].decode()) for row in tle_data]
+    return list(tle_data)
+
+
+def tle_lines(tle_data):
+    """
+    Iterate over (TLE line 1, TLE line 2) for a catalog array or a list of tuples.
+    """
+    if isinstance(tle_data, np.ndarray) and tle_data.dtype.names is not None:
+        return zip((line.decode() for line in tle_data["line1"]), (line.decode() for line in tle_data["line2"]))
+    return ((tle_line1, tle_line2) for _, tle_line1, tle_line2 in tle_data)
 
 
 def fetch_multiple_tle_from_url(tle_url, num_satellites=10):
     """
     Fetch TLE lines for the first N satellites in a TLE file.
-    :param tle_url: URL of the TLE file.
+    :param tle_url: URL or local path of the TLE file.
     :param num_satellites: Number of satellites to fetch TLE data for.
     :return: List of tuples, each containing (satellite name, TLE line 1, TLE line 2).
     """
-    # Download the TLE file
-    response = requests.get(tle_url)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to fetch TLE data from {tle_url}")
-
-    # Split the file into lines
-    lines = response.text.splitlines()
-
-    # Collect TLE data
     satellites_data = []
-    i = 0
-    while i < len(lines) and len(satellites_data) < num_satellites:
-        name = lines[i].strip()
-        if i + 2 < len(lines):  # Ensure there are two more lines for TLE data
-            tle_line1 = lines[i + 1].strip()
-            tle_line2 = lines[i + 2].strip()
-            satellites_data.append((name, tle_line1, tle_line2))
-        i += 3  # Move to the next satellite (names and 2 TLE lines)
-
+    for entry in iter_tle(tle_url, strict=False):
+        satellites_data.append(entry)
+        if len(satellites_data) >= num_satellites:
+            break
     return satellites_data
 
 
-# Fetch TLE data for up to 10 satellites from CelesTrak
-TLE_URL = "https://celestrak.com/NORAD/elements/stations.txt"
-satellites = fetch_multiple_tle_from_url(TLE_URL, num_satellites=10)
+if __name__ == "__main__":
+    # Fetch TLE data for up to 10 satellites from CelesTrak
+    TLE_URL = "https://celestrak.com/NORAD/elements/stations.txt"
+    satellites = fetch_multiple_tle_from_url(TLE_URL, num_satellites=10)
 
-# Print the fetched TLE data
-for sat in satellites:
-    print(f"Satellite Name: {sat[0]}")
-    print(f"TLE Line 1: {sat[1]}")
-    print(f"TLE Line 2: {sat[2]}")
-    print()
+    # Print the fetched TLE data
+    for sat in satellites:
+        print(f"Satellite Name: {sat[0]}")
+        print(f"TLE Line 1: {sat[1]}")
+        print(f"TLE Line 2: {sat[2]}")
+        print()
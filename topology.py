@@ -0,0 +1,332 @@
+from collections import namedtuple
+import numpy as np
+import networkx as nx
+from scipy.spatial import cKDTree
+from geometry import EARTH_RADIUS_KM, geodetic_to_ecef, latlon_to_unit, spherical_to_ecef
+from satellites import DEFAULT_SATELLITE_ALTITUDE_KM
+from tle import to_catalog
+
+DEFAULT_MAX_RANGE_KM = 5000.0
+# ISLs must clear the Earth plus this much atmosphere
+ATMOSPHERE_MARGIN_KM = 80.0
+
+# Adjacency of one timestep in CSR form, plus the links that changed since the previous step.
+# Node ids: satellites are 0..num_satellites-1 (the `satellite_num` convention of allocation.py),
+# ground nodes follow as num_satellites + ground index.
+# indptr, indices, weights: symmetric CSR, weights are link lengths in km
+# added, removed:           [n, 2] arrays of (u, v) with u < v
+TopologySnapshot = namedtuple("TopologySnapshot",
+                              ["step", "num_nodes", "indptr", "indices", "weights", "added", "removed"])
+
+
+def line_of_sight(a, b, min_radius=EARTH_RADIUS_KM + ATMOSPHERE_MARGIN_KM):
+    """
+    Whether the segments a-b stay above min_radius from the Earth's centre.
+    :param a: Array [..., 3] of ECEF points in km.
+    :param b: Array [..., 3] of ECEF points in km.
+    :param min_radius: Minimum distance from the centre in km.
+    :return: Boolean array [...].
+    """
+    d = b - a
+    t = np.clip(-np.sum(a * d, axis=-1) / np.maximum(np.sum(d * d, axis=-1), 1e-12), 0, 1)
+    closest = a + t[..., None] * d
+    return np.sum(closest ** 2, axis=-1) > min_radius ** 2
+
+
+def plus_grid_planes(tle_data, raan_tolerance=2.0, inclination_tolerance=1.0):
+    """
+    Group satellites into orbital planes and order each plane along the orbit.
+    :param tle_data: Catalog array or list of TLE tuples.
+    :param raan_tolerance: Max RAAN difference (degrees) inside one plane.
+    :param inclination_tolerance: Max inclination difference (degrees) inside one plane.
+    :return: List of index arrays, one per plane, sorted by RAAN; each ordered by argument of latitude.
+    """
+    catalog = to_catalog(tle_data)
+    order = np.lexsort((catalog["inclination"], catalog["raan"]))
+    planes = []
+    for sat in order:
+        for plane in planes:
+            head = plane[0]
+            raan_gap = abs((catalog["raan"][sat] - catalog["raan"][head] + 180) % 360 - 180)
+            if (raan_gap <= raan_tolerance
+                    and abs(catalog["inclination"][sat] - catalog["inclination"][head]) <= inclination_tolerance):
+                plane.append(sat)
+                break
+        else:
+            planes.append([sat])
+    arg_latitude = (catalog["arg_perigee"] + catalog["mean_anomaly"]) % 360
+    return [np.array(sorted(plane, key=lambda sat: arg_latitude[sat]), dtype=np.intp) for plane in planes]
+
+
+def plus_grid_candidates(planes):
+    """
+    +Grid link candidates: both in-plane neighbours and the same slot in the next plane.
+    :param planes: List of index arrays from plus_grid_planes.
+    :return: Array [num_edges, 2] of (u, v) with u < v, unique.
+    """
+    edges = []
+    for p, plane in enumerate(planes):
+        n = len(plane)
+        if n > 1:
+            edges.extend(zip(plane, np.roll(plane, -1)))
+        if len(planes) > 1:
+            other = planes[(p + 1) % len(planes)]
+            for slot, sat in enumerate(plane):
+                edges.append((sat, other[(slot * len(other)) // n]))
+    edges = np.array([(min(u, v), max(u, v)) for u, v in edges if u != v], dtype=np.intp).reshape(-1, 2)
+    return np.unique(edges, axis=0)
+
+
+class ConstellationTopology:
+    """
+    Time-varying inter-satellite link graph built from propagated positions.
+    Links must be shorter than max_range_km and clear the atmosphere. Two policies:
+    "grid"    - +Grid: fixed candidate links from plus_grid_candidates, filtered every step;
+    "nearest" - each satellite links to its max_links nearest satellites in range (union).
+    steps() walks the horizon once and reports per-step CSR adjacency plus the links that were
+    added or removed, so consumers can update instead of rebuilding.
+    """
+
+    def __init__(self, satellite_ecef, policy="nearest", max_range_km=DEFAULT_MAX_RANGE_KM, max_links=4,
+                 planes=None, ground_points=None, ground_links=1, elevation_mask=10.0,
+                 min_radius_km=EARTH_RADIUS_KM + ATMOSPHERE_MARGIN_KM, gateways=None):
+        """
+        :param satellite_ecef: Array [num_satellites, num_steps, 3] of ECEF positions in km.
+        :param policy: "nearest" or "grid".
+        :param max_range_km: Maximum ISL length.
+        :param max_links: Neighbours per satellite for the "nearest" policy.
+        :param planes: Plane membership for the "grid" policy (see plus_grid_planes).
+        :param ground_points: Optional array [num_ground, 2 (lat, lon)] of ground nodes (users, gateways).
+        :param ground_links: Satellites each ground node links to (nearest ones above the mask).
+        :param elevation_mask: Minimum elevation in degrees for a ground link.
+        :param min_radius_km: ISLs must stay above this distance from the Earth's centre.
+        :param gateways: Optional GatewayNetwork with visibility built over the same steps; its gateways
+                         become nodes after the ground points, linked to every satellite that sees them.
+        """
+        if policy not in ("nearest", "grid"):
+            raise ValueError(f"Unknown ISL policy {policy!r}")
+        if policy == "grid" and planes is None:
+            raise ValueError("The grid policy needs the orbital planes")
+        self.ecef = np.asarray(satellite_ecef, dtype=float)
+        self.policy = policy
+        self.max_range_km = max_range_km
+        self.max_links = max_links
+        self.min_radius_km = min_radius_km
+        self.candidates = plus_grid_candidates(planes) if policy == "grid" else None
+        self.ground_links = ground_links
+        self.elevation_mask = elevation_mask
+        if ground_points is None:
+            ground_points = np.zeros((0, 2))
+        self.ground_points = np.asarray(ground_points, dtype=float).reshape(-1, 2)
+        self.ground_ecef = geodetic_to_ecef(self.ground_points[:, 0], self.ground_points[:, 1]).reshape(-1, 3)
+        self.ground_up = latlon_to_unit(self.ground_points[:, 0], self.ground_points[:, 1]).reshape(-1, 3)
+        self.gateways = gateways
+        if gateways is not None and gateways.first_node != self.num_satellites + len(self.ground_points):
+            raise ValueError(f"Gateway nodes must start at {self.num_satellites + len(self.ground_points)}, "
+                             f"after the satellites and ground points, got {gateways.first_node}")
+
+    @classmethod
+    def from_positions(cls, satellite_positions, sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM, **kwargs):
+        """
+        Build from the [num_satellites, num_steps, 2 (lat, lon)] positions tensor and an altitude.
+        """
+        ecef = spherical_to_ecef(satellite_positions[..., 0], satellite_positions[..., 1], sat_alt)
+        return cls(ecef, **kwargs)
+
+    @property
+    def num_satellites(self):
+        return self.ecef.shape[0]
+
+    @property
+    def num_steps(self):
+        return self.ecef.shape[1]
+
+    @property
+    def num_nodes(self):
+        return self.num_satellites + len(self.ground_points) + (len(self.gateways) if self.gateways is not None else 0)
+
+    def isl_links(self, time):
+        """
+        :param time: Time index.
+        :return: Tuple (edges [n, 2] with u < v, lengths [n] in km) of the ISLs at this step.
+        """
+        if self.policy == "grid":
+            up, lengths = self._grid_links(time)
+            return self.candidates[up], lengths[up]
+        positions = self.ecef[:, time]
+        k = min(self.max_links + 1, self.num_satellites)
+        distance, neighbours = cKDTree(positions).query(positions, k=k, distance_upper_bound=self.max_range_km)
+        source = np.repeat(np.arange(self.num_satellites), k)
+        neighbours = neighbours.reshape(-1)
+        found = np.isfinite(distance.reshape(-1)) & (neighbours != source)
+        edges = np.sort(np.stack((source[found], neighbours[found]), axis=1), axis=1)
+        edges = np.unique(edges, axis=0)
+        lengths = self._lengths(positions, edges)
+        keep = (lengths <= self.max_range_km) & self._clear(positions, edges)
+        return edges[keep], lengths[keep]
+
+    def _grid_links(self, time):
+        """
+        :return: Tuple (up [num_candidates] bool, lengths [num_candidates]) of the fixed +Grid candidates.
+        """
+        positions = self.ecef[:, time]
+        lengths = self._lengths(positions, self.candidates)
+        return (lengths <= self.max_range_km) & self._clear(positions, self.candidates), lengths
+
+    @staticmethod
+    def _lengths(positions, edges):
+        return np.sqrt(np.sum((positions[edges[:, 1]] - positions[edges[:, 0]]) ** 2, axis=1))
+
+    def _clear(self, positions, edges):
+        return line_of_sight(positions[edges[:, 0]], positions[edges[:, 1]], self.min_radius_km)
+
+    def ground_edges(self, time):
+        """
+        :param time: Time index.
+        :return: Tuple (edges [n, 2], lengths [n]) linking ground nodes to satellites above the mask.
+        """
+        if not len(self.ground_points):
+            return np.zeros((0, 2), dtype=np.intp), np.zeros(0)
+        positions = self.ecef[:, time]
+        k = min(self.ground_links, self.num_satellites)
+        _, nearest = cKDTree(positions).query(self.ground_ecef, k=k)
+        nearest = nearest.reshape(len(self.ground_points), k)
+        line_of_sight_vec = positions[nearest] - self.ground_ecef[:, None, :]
+        slant = np.sqrt(np.sum(line_of_sight_vec ** 2, axis=-1))
+        sin_elevation = np.sum(line_of_sight_vec * self.ground_up[:, None, :], axis=-1) / slant
+        visible = sin_elevation >= np.sin(np.radians(self.elevation_mask))
+        ground_node = np.broadcast_to(self.num_satellites + np.arange(len(self.ground_points))[:, None], nearest.shape)
+        edges = np.stack((nearest[visible], ground_node[visible]), axis=1)
+        return edges, slant[visible]
+
+    def gateway_edges(self, time):
+        """
+        :param time: Time index.
+        :return: Tuple (edges [n, 2], lengths [n]) of the CSLs to gateways, from the gateway visibility lookup.
+        """
+        if self.gateways is None:
+            return np.zeros((0, 2), dtype=np.intp), np.zeros(0)
+        edges = self.gateways.csl_edges(time)
+        slant = self.ecef[edges[:, 0], time] - self.gateways.ecef[edges[:, 1] - self.gateways.first_node]
+        return edges, np.sqrt(np.sum(slant ** 2, axis=1))
+
+    def links(self, time):
+        """
+        All links (ISL + ground + gateway) at one step, sorted by (u, v).
+        :return: Tuple (edges [n, 2] with u < v, lengths [n]).
+        """
+        isl_edges, isl_lengths = self.isl_links(time)
+        access_edges, access_lengths = self._access_links(time)
+        return _sorted_links(np.concatenate((isl_edges, access_edges)), np.concatenate((isl_lengths, access_lengths)))
+
+    def _access_links(self, time):
+        """
+        :return: Tuple (edges [n, 2], lengths [n]) of the ground and gateway links at one step.
+        """
+        ground_edges, ground_lengths = self.ground_edges(time)
+        gateway_edges, gateway_lengths = self.gateway_edges(time)
+        return (np.concatenate((ground_edges, gateway_edges)).astype(np.intp),
+                np.concatenate((ground_lengths, gateway_lengths)))
+
+    def _csr(self, edges, lengths):
+        rows = np.concatenate((edges[:, 0], edges[:, 1]))
+        cols = np.concatenate((edges[:, 1], edges[:, 0]))
+        weights = np.concatenate((lengths, lengths))
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(self.num_nodes + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=self.num_nodes), out=indptr[1:])
+        return indptr, cols[order], weights[order]
+
+    def snapshot(self, time, previous=None):
+        """
+        CSR adjacency at one step.
+        :param time: Time index.
+        :param previous: Optional [n, 2] edge array of the previous step, to fill added/removed.
+        :return: TopologySnapshot.
+        """
+        edges, lengths = self.links(time)
+        indptr, indices, weights = self._csr(edges, lengths)
+        if previous is None:
+            added, removed = edges, np.zeros((0, 2), dtype=np.intp)
+        else:
+            added, removed = edge_difference(edges, previous, self.num_nodes)
+        return TopologySnapshot(time, self.num_nodes, indptr, indices, weights, added, removed)
+
+    def steps(self):
+        """
+        Walk every timestep, carrying the edge set forward and reporting only what changed.
+        :return: Generator of TopologySnapshot.
+        """
+        if self.policy == "grid":
+            yield from self._grid_steps()
+            return
+        previous = None
+        for time in range(self.num_steps):
+            snapshot = self.snapshot(time, previous)
+            previous = snapshot_edges(snapshot)
+            yield snapshot
+
+    def _grid_steps(self):
+        """
+        steps() for the +Grid policy. The ISL candidates are fixed, so each step only re-tests them
+        (range and line of sight) and the ISL changes are flips of that mask; only the ground and
+        gateway links are diffed as edge sets.
+        """
+        previous_up = previous_access = None
+        for time in range(self.num_steps):
+            up, isl_lengths = self._grid_links(time)
+            access_edges, access_lengths = self._access_links(time)
+            edges, lengths = _sorted_links(np.concatenate((self.candidates[up], access_edges)),
+                                           np.concatenate((isl_lengths[up], access_lengths)))
+            indptr, indices, weights = self._csr(edges, lengths)
+            if previous_up is None:
+                added, removed = edges, np.zeros((0, 2), dtype=np.intp)
+            else:
+                access_added, access_removed = edge_difference(access_edges, previous_access, self.num_nodes)
+                added = _sorted_links(np.concatenate((self.candidates[up & ~previous_up], access_added)))[0]
+                removed = _sorted_links(np.concatenate((self.candidates[previous_up & ~up], access_removed)))[0]
+            previous_up, previous_access = up, access_edges
+            yield TopologySnapshot(time, self.num_nodes, indptr, indices, weights, added, removed)
+
+
+def _sorted_links(edges, lengths=None):
+    """
+    :return: Tuple (edges, lengths) sorted by (u, v) (lengths None if not given).
+    """
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    return edges[order], (lengths[order] if lengths is not None else None)
+
+
+def snapshot_edges(snapshot):
+    """
+    :return: Array [n, 2] of the (u, v), u < v, links of a snapshot.
+    """
+    rows = np.repeat(np.arange(snapshot.num_nodes), np.diff(snapshot.indptr))
+    upper = rows < snapshot.indices
+    return np.stack((rows[upper], snapshot.indices[upper]), axis=1)
+
+
+def edge_difference(current, previous, num_nodes):
+    """
+    :return: Tuple (added, removed) of [n, 2] edge arrays between two edge sets.
+    """
+    current_keys = current[:, 0].astype(np.int64) * num_nodes + current[:, 1]
+    previous_keys = previous[:, 0].astype(np.int64) * num_nodes + previous[:, 1]
+    added = np.setdiff1d(current_keys, previous_keys, assume_unique=True)
+    removed = np.setdiff1d(previous_keys, current_keys, assume_unique=True)
+    return (np.stack(np.divmod(added, num_nodes), axis=1).astype(np.intp),
+            np.stack(np.divmod(removed, num_nodes), axis=1).astype(np.intp))
+
+
+def to_networkx(snapshot):
+    """
+    Convert a snapshot to the networkx graph expected by allocation.search_alternate_path.
+    :return: nx.Graph with a node per satellite/ground node and `weight` = link length in km.
+    """
+    G = nx.Graph()
+    G.add_nodes_from(range(snapshot.num_nodes))
+    edges = snapshot_edges(snapshot)
+    rows = np.repeat(np.arange(snapshot.num_nodes), np.diff(snapshot.indptr))
+    weights = snapshot.weights[rows < snapshot.indices]
+    G.add_weighted_edges_from(zip(edges[:, 0].tolist(), edges[:, 1].tolist(), weights.tolist()))
+    return G
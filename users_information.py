@@ -1,5 +1,9 @@
+import numpy as np
 import scipy.io as scio
-import heapq
+import instrumentation
+from geometry import haversine, latlon_to_unit, unit_to_latlon
+from positions import PositionTensor
+from spatial_index import SatelliteIndex
 
 
 class user:
@@ -21,32 +25,219 @@ class user:
     def get_id(self):
         return self.id
 
+
+class UserView(user):
+    """
+    A row of a UserTable with the user API: attributes read and write the table's columns.
+    """
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    id = property(lambda self: int(self.table.ids[self.row]))
+    city = property(lambda self: str(self.table.city_names[self.table.city[self.row]]))
+    create_time = property(lambda self: int(self.table.create_time[self.row]))
+    session = property(lambda self: int(self.table.session_id[self.row]))
+
+    @property
+    def latitude(self):
+        return float(self.table.latitude[self.row])
+
+    @latitude.setter
+    def latitude(self, value):
+        self.table.latitude[self.row] = value
+
+    @property
+    def longitude(self):
+        return float(self.table.longitude[self.row])
+
+    @longitude.setter
+    def longitude(self, value):
+        self.table.longitude[self.row] = value
+
+    @property
+    def path(self):
+        return self.table.paths.get(self.row)
+
+    @path.setter
+    def path(self, value):
+        self.table.paths[self.row] = value
+
+
+class UserRange:
+    """
+    Rows start:stop of a UserTable as a read-only sequence of users: len() is O(1) and the
+    UserViews are only created for the rows actually accessed.
+    """
+
+    def __init__(self, table, start, stop):
+        self.table = table
+        self.start = int(start)
+        self.stop = int(stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [UserView(self.table, row) for row in range(self.start, self.stop)[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("user index out of range")
+        return UserView(self.table, self.start + index)
+
+    def __iter__(self):
+        return (UserView(self.table, row) for row in range(self.start, self.stop))
+
+    @property
+    def latitude(self):
+        return self.table.latitude[self.start:self.stop]
+
+    @property
+    def longitude(self):
+        return self.table.longitude[self.start:self.stop]
+
+
+class UserTable:
+    """
+    Columnar store of users: one NumPy array per attribute instead of one object per user.
+    Cities are stored as codes into city_names. Paths, the only per-user value that is not a
+    scalar, live in a dict filled on demand. table[i] is a UserView usable wherever a user is.
+    """
+
+    def __init__(self, ids, latitude, longitude, create_time, session_id, city=None, city_names=("",)):
+        """
+        :param ids: Array [num_users] of user ids.
+        :param latitude: Array [num_users] of latitudes in degrees.
+        :param longitude: Array [num_users] of longitudes in degrees.
+        :param create_time: Array [num_users] of creation timestamps (seconds).
+        :param session_id: Array [num_users] of the session of each user.
+        :param city: Optional array [num_users] of codes into city_names.
+        :param city_names: City names.
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.create_time = np.asarray(create_time, dtype=np.int64)
+        self.session_id = np.asarray(session_id, dtype=np.int64)
+        self.city = np.zeros(len(self.ids), dtype=np.int16) if city is None else np.asarray(city, dtype=np.int16)
+        self.city_names = np.asarray(city_names)
+        self.paths = {}
+
+    @classmethod
+    def from_users(cls, user_list):
+        """
+        Build a table from user objects.
+        """
+        city_names, city = np.unique(np.array([u.city for u in user_list], dtype=str), return_inverse=True)
+        return cls([u.id for u in user_list], [u.latitude for u in user_list], [u.longitude for u in user_list],
+                   [u.create_time for u in user_list], [u.session for u in user_list], city, city_names)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        return UserView(self, row)
+
+    def __iter__(self):
+        return (UserView(self, row) for row in range(len(self)))
+
+    def locations(self):
+        """
+        :return: Array [num_users, 2 (lat, lon)].
+        """
+        return np.column_stack((self.latitude, self.longitude))
+
+    def take(self, rows):
+        """
+        :return: New UserTable with the given rows (paths are not carried).
+        """
+        return UserTable(self.ids[rows], self.latitude[rows], self.longitude[rows], self.create_time[rows],
+                         self.session_id[rows], self.city[rows], self.city_names)
+
+
+@instrumentation.timed("users_information.find_user_center")
 def find_user_center(user_list):
-    user_num = len(user_list)
-    mean_latitude = mean_longitude = 0
-    for i in range(user_num):
-        mean_latitude += user_list[i].latitude
-        mean_longitude += user_list[i].longitude
-    mean_latitude /= user_num
-    mean_longitude /= user_num
-    return [mean_latitude, mean_longitude]
-def k_center(user_list, satellite_positions, time, k):
+    """
+    Spherical centroid of the users: the direction of the sum of their unit vectors, which stays
+    between users on both sides of the antimeridian (an arithmetic lat/lon mean puts it on the far side).
+    :param user_list: List of user objects, a UserTable or a UserRange.
+    :return: [latitude, longitude] in degrees, NaN without users (like SessionTable.centers).
+    """
+    if isinstance(user_list, (UserTable, UserRange)):
+        latitude, longitude = user_list.latitude, user_list.longitude
+    else:
+        latitude = np.array([u.latitude for u in user_list], dtype=float)
+        longitude = np.array([u.longitude for u in user_list], dtype=float)
+    if len(latitude) == 0:
+        return [float("nan"), float("nan")]
+    center_latitude, center_longitude = unit_to_latlon(latlon_to_unit(latitude, longitude).sum(axis=0))
+    return [float(center_latitude), float(center_longitude)]
+
+
+@instrumentation.timed("users_information.k_center")
+def k_center(user_list, satellite_positions, time, k, index=None, candidates=None):
     """
     Find k satellites that are closest to the user center.
     :param user_list: List of user objects.
-    :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)].
-    :param time: Time index to consider for satellite positions.
+    :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)],
+                                or one simulation frame [num_satellites, 2] when time is None,
+                                or a PositionTensor (searched by dot products, no index needed).
+    :param time: Time index to consider for satellite positions (None for a single frame).
     :param k: Number of closest satellites to find.
-    :return: Indices of the k-central satellites.
+    :param index: Optional SatelliteIndex of this timestep (built and shared per step if omitted).
+    :param candidates: Optional satellite indices to choose from, e.g. VisibilityIndex.visible(...).
+    :return: Indices of the k-central satellites (empty without users).
     """
     user_center = find_user_center(user_list)
-    distance_list = []
+    if np.isnan(user_center).any():
+        # No users, no center to be close to (an empty cu_set, like k_center_batch)
+        return []
+    if isinstance(satellite_positions, PositionTensor):
+        min_indices, _ = satellite_positions.nearest(user_center[0], user_center[1], time, k, candidates)
+        return min_indices.tolist()
+    if candidates is not None:
+        # Only a handful of satellites are visible, a direct scan beats the tree here
+        candidates = np.asarray(candidates, dtype=int)
+        frame = satellite_positions if time is None else satellite_positions[:, time]
+        angle = haversine(user_center[0], user_center[1], frame[candidates, 0], frame[candidates, 1])
+        return candidates[np.argsort(angle, kind="stable")[:k]].tolist()
+    if index is None:
+        index = SatelliteIndex.for_step(satellite_positions, time)
+
+    # Indices of the k closest satellites (great-circle distance)
+    min_indices, _ = index.query(user_center[0], user_center[1], k)
+    return min_indices.tolist()
 
-    for sat_position in satellite_positions[:, time]:
-        latitude, longitude = sat_position
-        distance = (latitude - user_center[0]) ** 2 + (longitude - user_center[1]) ** 2
-        distance_list.append(distance)
 
-    # Indices of the k closest satellites
-    min_indices = heapq.nsmallest(k, range(len(distance_list)), key=distance_list.__getitem__)
-    return min_indices
+@instrumentation.timed("users_information.k_center_batch")
+def k_center_batch(centers, satellite_positions, time, k, index=None):
+    """
+    k_center for many groups at once, one nearest-satellite query for every center instead of a call per group.
+    A PositionTensor is searched with one argpartition over the centers x satellites dot products
+    (PositionTensor.nearest, chunked to bound memory); lat/lon positions with the shared SatelliteIndex of the step.
+    :param centers: Array [num_centers, 2 (lat, lon)], e.g. SessionTable.centers(); NaN rows are skipped.
+    :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)],
+                                or one simulation frame [num_satellites, 2] when time is None,
+                                or a PositionTensor.
+    :param time: Time index to consider for satellite positions (None for a single frame).
+    :param k: Number of closest satellites per center.
+    :param index: Optional SatelliteIndex of this timestep (built and shared per step if omitted).
+    :return: Array [num_centers, k] of satellite indices, closest first, -1 on the rows of NaN centers.
+    """
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    valid = ~np.isnan(centers).any(axis=1)
+    if isinstance(satellite_positions, PositionTensor):
+        nearest = lambda lat, lon, k: satellite_positions.nearest(lat, lon, time, k)
+        k = min(k, satellite_positions.num_satellites)
+    else:
+        if index is None:
+            index = SatelliteIndex.for_step(satellite_positions, time)
+        nearest = index.query
+        k = min(k, len(index))
+    indices = np.full((len(centers), k), -1, dtype=np.intp)
+    if valid.any():
+        indices[valid], _ = nearest(centers[valid, 0], centers[valid, 1], k)
+    return indices
@@ -0,0 +1,165 @@
+import itertools
+import numpy as np
+from geometry import EARTH_RADIUS_KM, latlon_to_unit
+from propagation import iter_positions
+from satellites import DEFAULT_SATELLITE_ALTITUDE_KM
+
+# Upper bound on ground points x satellites x steps tested at once
+CHUNK_ELEMENTS = 1 << 24
+
+
+def coverage_angle(sat_alt, elevation_mask):
+    """
+    Earth central angle between a satellite's sub-point and the edge of its coverage footprint
+    (spherical Earth).
+    :param sat_alt: Satellite altitude(s) in km.
+    :param elevation_mask: Minimum elevation in degrees.
+    :return: Angle(s) in radians.
+    """
+    elevation = np.radians(elevation_mask)
+    ratio = EARTH_RADIUS_KM / (EARTH_RADIUS_KM + np.asarray(sat_alt, dtype=float))
+    return np.arccos(ratio * np.cos(elevation)) - elevation
+
+
+class VisibilityIndex:
+    """
+    Rise/set intervals of every satellite over a set of ground points (users or ground cells).
+    Intervals are half-open step ranges [start, end), stored per ground point sorted by start
+    (CSR layout: the intervals of point p are rows offsets[p]:offsets[p + 1]).
+    A pass never lasts longer than max_duration, so the intervals covering step t all start in
+    (t - max_duration, t]: "who is visible at t" is two binary searches plus a short filter.
+    """
+
+    def __init__(self, offsets, starts, ends, satellites, num_steps):
+        self.offsets = offsets
+        self.starts = starts
+        self.ends = ends
+        self.satellites = satellites
+        self.num_steps = num_steps
+        self.max_duration = int((ends - starts).max()) if len(starts) else 0
+
+    @classmethod
+    def build(cls, ground_points, satellite_positions, sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM, elevation_mask=10.0,
+              block_steps=64):
+        """
+        Predict every pass of every satellite over every ground point.
+        :param ground_points: Array of locations [num_points, 2 (lat, lon)].
+        :param satellite_positions: Array of satellite positions [num_satellites, num_steps, 2 (lat, lon)].
+        :param sat_alt: Satellite altitude in km (scalar or [num_satellites]).
+        :param elevation_mask: Minimum elevation in degrees for a satellite to count as visible.
+        :param block_steps: Steps converted and tested together.
+        :return: VisibilityIndex.
+        """
+        num_steps = satellite_positions.shape[1]
+        blocks = ((begin, satellite_positions[:, begin:begin + block_steps])
+                  for begin in range(0, num_steps, block_steps))
+        return cls.from_blocks(ground_points, blocks, num_steps, sat_alt, elevation_mask)
+
+    @classmethod
+    def from_tle(cls, ground_points, tle_data, time_step, num_steps, start_time=None,
+                 sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM, elevation_mask=10.0, block_steps=64):
+        """
+        build() straight from the TLEs: positions are streamed with propagation.iter_positions, so only
+        one block of steps is ever held, never [num_satellites, num_steps, 2].
+        :param tle_data: Catalog array or list of tuples (satellite_name, TLE line 1, TLE line 2).
+        :param time_step: Time interval between steps (in seconds).
+        :param num_steps: Number of time steps.
+        :param start_time: datetime of the first step (None means now, UTC).
+        :return: VisibilityIndex.
+        """
+        frames = iter_positions(tle_data, time_step, num_steps, start_time, block_steps)
+        blocks = ((begin, np.stack([positions for _, _, positions in itertools.islice(frames, block_steps)],
+                                   axis=1))
+                  for begin in range(0, num_steps, block_steps))
+        return cls.from_blocks(ground_points, blocks, num_steps, sat_alt, elevation_mask)
+
+    @classmethod
+    def from_blocks(cls, ground_points, blocks, num_steps, sat_alt=DEFAULT_SATELLITE_ALTITUDE_KM, elevation_mask=10.0):
+        """
+        build() over consecutive blocks of steps. Only the visibility of the last step of the previous
+        block is carried over, so passes spanning blocks are joined without keeping earlier blocks.
+        :param ground_points: Array of locations [num_points, 2 (lat, lon)].
+        :param blocks: Iterable of (first step, positions [num_satellites, block_len, 2 (lat, lon)]) in step
+                       order, covering steps 0..num_steps - 1.
+        :param num_steps: Number of time steps.
+        :return: VisibilityIndex.
+        """
+        ground_points = np.asarray(ground_points, dtype=float).reshape(-1, 2)
+        num_points = len(ground_points)
+        ground = latlon_to_unit(ground_points[:, 0], ground_points[:, 1])
+        min_dot = None
+        was_visible = None
+
+        point_ids, sat_ids, rises, sets = [], [], [], []
+        for begin, block in blocks:
+            num_satellites, block_len = block.shape[:2]
+            if min_dot is None:
+                # Visible <=> central angle below the footprint radius <=> dot product above its cosine
+                min_dot = np.broadcast_to(np.cos(coverage_angle(sat_alt, elevation_mask)), (num_satellites,))
+                was_visible = np.zeros((num_points, num_satellites), dtype=bool)
+            last = begin + block_len >= num_steps
+            sats = latlon_to_unit(block[..., 0], block[..., 1])
+            sat_chunk = max(1, min(num_satellites, CHUNK_ELEMENTS // max(block_len, 1)))
+            point_chunk = max(1, CHUNK_ELEMENTS // max(sat_chunk * block_len, 1))
+            for sat_begin in range(0, num_satellites, sat_chunk):
+                cols = slice(sat_begin, min(sat_begin + sat_chunk, num_satellites))
+                for point_begin in range(0, num_points, point_chunk):
+                    rows = slice(point_begin, min(point_begin + point_chunk, num_points))
+                    visible = np.einsum("pk,stk->pst", ground[rows], sats[cols]) >= min_dot[cols, None]
+                    # Lead with the previous step, and close every pass still open after the last one
+                    padded = np.concatenate((was_visible[rows, cols, None], visible,
+                                             np.zeros(visible.shape[:2] + (int(last),), dtype=bool)), axis=2)
+                    was_visible[rows, cols] = visible[:, :, -1]
+                    edges = np.diff(padded.astype(np.int8), axis=2)
+                    rise_p, rise_s, rise_t = np.nonzero(edges == 1)
+                    set_p, set_s, set_t = np.nonzero(edges == -1)
+                    point_ids.append(rise_p + point_begin)
+                    sat_ids.append(rise_s + sat_begin)
+                    rises.append(rise_t + begin)
+                    sets.append(np.stack((set_p + point_begin, set_s + sat_begin, set_t + begin)))
+
+        point_ids = np.concatenate(point_ids) if point_ids else np.zeros(0, dtype=np.intp)
+        sat_ids = np.concatenate(sat_ids) if sat_ids else np.zeros(0, dtype=np.intp)
+        rises = np.concatenate(rises) if rises else np.zeros(0, dtype=np.intp)
+        sets = np.concatenate(sets, axis=1) if sets else np.zeros((3, 0), dtype=np.intp)
+        # The k-th rise of a (point, satellite) pair ends at its k-th set
+        rise_order = np.lexsort((rises, sat_ids, point_ids))
+        set_order = np.lexsort((sets[2], sets[1], sets[0]))
+        point_ids, sat_ids, starts = point_ids[rise_order], sat_ids[rise_order], rises[rise_order]
+        ends = sets[2][set_order]
+        order = np.lexsort((starts, point_ids))
+        offsets = np.zeros(num_points + 1, dtype=np.intp)
+        np.cumsum(np.bincount(point_ids, minlength=num_points), out=offsets[1:])
+        return cls(offsets, starts[order].astype(np.int32), ends[order].astype(np.int32),
+                   sat_ids[order].astype(np.int32), num_steps)
+
+    def windows(self, point):
+        """
+        :param point: Ground point index.
+        :return: Tuple (satellites, starts, ends) of every pass over this point, sorted by start.
+        """
+        rows = slice(self.offsets[point], self.offsets[point + 1])
+        return self.satellites[rows], self.starts[rows], self.ends[rows]
+
+    def visible(self, point, time):
+        """
+        Satellites visible from a ground point at a time step.
+        :param point: Ground point index.
+        :param time: Time step.
+        :return: Array of satellite indices.
+        """
+        satellites, starts, ends = self.windows(point)
+        low = np.searchsorted(starts, time - self.max_duration, side="right")
+        high = np.searchsorted(starts, time, side="right")
+        hit = ends[low:high] > time
+        return satellites[low:high][hit]
+
+    def next_pass(self, point, satellite, time):
+        """
+        :return: (start, end) of the first pass of satellite over point ending after time, or None.
+        """
+        satellites, starts, ends = self.windows(point)
+        match = np.nonzero((satellites == satellite) & (ends > time))[0]
+        if len(match) == 0:
+            return None
+        return int(starts[match[0]]), int(ends[match[0]])